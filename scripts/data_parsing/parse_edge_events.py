@@ -1,95 +1,107 @@
 import json
 import argparse
 import os
+import sys
+from collections import deque
 from pathlib import Path
 
-def load_data(path):
-    with open(path, "r") as f:
-        return json.load(f)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from detection_log import iter_frames
 
-def get_detection_events(data):
-    events = []
-    active_event = None
+MERGE_GAP = 100   # events of the same car closer than this many frames are merged
+SAMPLE_STEP = 5   # search step (frames) for a detected frame from the event middle
+
+def load_data(path, follow=False):
+    """Lazily iterate the frames of a camera detection log (.jsonl) or a legacy camera_N_input.json."""
+    return iter_frames(path, follow=follow)
+
+def stream_events(frames, merge_gap=MERGE_GAP, sample_step=SAMPLE_STEP):
+    """
+    Single-pass event extraction over an iterable of frame dicts.
+
+    Yields (event, event_datum) as soon as each event can no longer grow, where
+    event is {"start_frame", "end_frame", "global_id"} and event_datum is the
+    (frame, car_id, location) sample for it, or None if no sample frame was found.
+
+    A detection run starts an event, keyed by the global_id of its first car.
+    Runs of the same car less than merge_gap frames apart are merged, so an
+    event closes once another car's run starts or merge_gap frames pass
+    without detections. The sample is the first detected frame at
+    middle, middle + sample_step, ... up to the event end.
 
-    for entry in data:
+    Memory is not constant: besides the open event, candidates holds the
+    (frame, position) of every detected frame of its second half, so at most
+    (end_frame - start_frame) // 2 + 1 entries, and it grows with the event.
+    Earlier frames can never be the sample and are dropped as the middle
+    moves, but which of the later ones is sampled depends on the final middle,
+    known only when the event closes, so no fixed-size window gives the same
+    samples. At 30 fps a 10-minute event keeps at most ~9000 entries.
+    """
+    event = None        # open (possibly merged) event
+    in_run = False      # whether the previous frame was a detection
+    candidates = deque()  # (frame, position) of detected frames that could still be the sample
+
+    def close():
+        middle = (event["start_frame"] + event["end_frame"]) // 2
+        for frame, position in candidates:
+            if frame > event["end_frame"]:
+                break
+            if frame >= middle and (frame - middle) % sample_step == 0:
+                return event, (frame, event["global_id"], position)
+        return event, None
+
+    for entry in frames:
         frame = entry["frame"]
-        detected = entry["car_detected"]
-
-        if detected:
-            if active_event is None:
-                # Start new event - extract global_id from first car
-                global_id = None
-                if entry["cars"]:
-                    global_id = entry["cars"][0]["global_id"]
-                active_event = {
-                    "start_frame": frame,
-                    "end_frame": frame,
-                    "global_id": global_id
-                }
-            else:
-                # Extend event
-                active_event["end_frame"] = frame
+
+        if entry["car_detected"]:
+            if not in_run:
+                # Start of a detection run - extract global_id from first car
+                global_id = entry["cars"][0]["global_id"] if entry["cars"] else None
+                if event is not None:
+                    gap = frame - event["end_frame"] - 1
+                    if event["global_id"] != global_id or gap >= merge_gap:
+                        yield close()
+                        event = None
+                if event is None:
+                    event = {"start_frame": frame, "end_frame": frame, "global_id": global_id}
+                    candidates.clear()
+                in_run = True
+            event["end_frame"] = frame
+
+            if entry["cars"]:
+                candidates.append((frame, entry["cars"][0]["position"]))
+            # The middle only moves forward as the event grows
+            middle = (event["start_frame"] + event["end_frame"]) // 2
+            while candidates and candidates[0][0] < middle:
+                candidates.popleft()
         else:
-            if active_event is not None:
-                # Close event
-                events.append(active_event)
-                active_event = None
+            in_run = False
+            # No later run can merge into the open event any more
+            if event is not None and frame - event["end_frame"] >= merge_gap:
+                yield close()
+                event = None
 
     # Close final event if open
-    if active_event is not None:
-        events.append(active_event)
-
-    # Merge events from same car if less than 100 frames apart
-    merged_events = []
-    for event in events:
-        if merged_events and merged_events[-1]["global_id"] == event["global_id"]:
-            # Check if gap is less than 100 frames
-            gap = event["start_frame"] - merged_events[-1]["end_frame"] - 1
-            if gap < 100:
-                # Merge events
-                merged_events[-1]["end_frame"] = event["end_frame"]
-                continue
-        merged_events.append(event)
-
-    return merged_events
-
-def extract_event_data(events, data):
-    """Convert events to list of (frame, car_id, location) tuples using middle frame."""
-    event_data = []
-    
-    # Create a dictionary for quick lookup: frame -> entry
-    # because we might chop off the beginning, so we can't just index data by frame
-    frame_lookup = {entry["frame"]: entry for entry in data}
-    
-    for event in events:
-        # Calculate middle frame
-        current_frame = (event["start_frame"] + event["end_frame"]) // 2
-        
-        # Search forward by increments of 5 until we find car_detected=true
-        while current_frame <= event["end_frame"]:
-            if current_frame in frame_lookup:
-                frame_entry = frame_lookup[current_frame]
-                if frame_entry["car_detected"] and frame_entry["cars"]:
-                    # Get position from first car (should match the event's car_id)
-                    position = frame_entry["cars"][0]["position"]
-                    event_data.append((current_frame, event["global_id"], position))
-                    break
-            current_frame += 5
-    
-    return event_data
+    if event is not None:
+        yield close()
+
+def get_detection_events(data):
+    """All (merged) detection events of data, see stream_events."""
+    return [event for event, _ in stream_events(data)]
 
-def print_events(events):
-    print("\n=== Car Detection Events ===")
-    for i, e in enumerate(events):
-        print(f"Event {i+1}: Car ID {e['global_id']} | frames {e['start_frame']} → {e['end_frame']} "
-              f"(duration {e['end_frame'] - e['start_frame'] + 1} frames)")
-    print("============================\n")
+def extract_event_data(data):
+    """(frame, car_id, location) for every event of data with a sample frame, see stream_events."""
+    return [datum for _, datum in stream_events(data) if datum is not None]
 
-def print_event_data(event_data):
-    print("\n=== Event Data (frame, car_id, location) ===")
-    for frame, car_id, location in event_data:
-        print(f"Frame {frame}: Car ID {car_id} | Position {location}")
-    print("==========================================\n")
+def print_event(number, e):
+    """One event line, flushed so --follow output shows up as events close."""
+    print(f"Event {number}: Car ID {e['global_id']} | frames {e['start_frame']} → {e['end_frame']} "
+          f"(duration {e['end_frame'] - e['start_frame'] + 1} frames)", flush=True)
+
+def print_event_datum(datum):
+    """The sample frame of the event printed just before it."""
+    frame, car_id, location = datum
+    print(f"    Frame {frame}: Car ID {car_id} | Position {location}", flush=True)
 
 def write_event_data_to_file(event_data, input_file):
     """Write event data to a JSON file in out/ directory based on input filename."""
@@ -121,16 +133,21 @@ def write_event_data_to_file(event_data, input_file):
 
 def main():
     parser = argparse.ArgumentParser(description="Parse car detection events from JSON.")
-    parser.add_argument("--file", help="Path to camera input JSON file")
+    parser.add_argument("--file", help="Path to camera detection log (.jsonl) or legacy input JSON file")
+    parser.add_argument("--follow", action="store_true",
+                        help="Keep reading while the detection log is still being written")
     args = parser.parse_args()
 
-    data = load_data(args.file)
-    events = get_detection_events(data)
-    print_events(events)
-    
-    event_data = extract_event_data(events, data)
-    print_event_data(event_data)
-    
+    # Events are printed as they close, the file is written at the end
+    print("\n=== Car Detection Events (event | frame, car_id, location) ===")
+    event_data = []
+    for i, (e, datum) in enumerate(stream_events(load_data(args.file, follow=args.follow))):
+        print_event(i + 1, e)
+        if datum is not None:
+            print_event_datum(datum)
+            event_data.append(datum)
+    print("==============================================================\n")
+
     write_event_data_to_file(event_data, args.file)
 
 if __name__ == "__main__":
@@ -13,122 +13,124 @@ By grouping packets into frames, then thresholding frame sizes, we can detect
 when activity increases, indicating a car is in the camera's field of view.
 """
 import numpy as np
-from scapy.all import rdpcap
-from scapy.layers.dot11 import Dot11
 import os
 from pathlib import Path
 import sys
 import argparse
 import json
-from tqdm import tqdm
 import matplotlib.pyplot as plt
 
+# Add parent directory to path to import util and pcap_frames
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
 from util import FPS
+from pcap_frames import read_video_packets
 
 # ----------------------------
 # CONFIG
 # ----------------------------
 
 OUTPUT_DIR = "tmp/"
-MIN_VIDEO_PACKET_SIZE = 1000  # Minimum packet size to consider as video transmission packet
+IFRAME_ZSCORE = 2  # frames with a size z-score above this are treated as I-frames and zeroed
+EVENT_MIN_GAP = 30  # detections more than this many frames apart are separate events
 
 # ----------------------------
 # Frame-level feature extraction function
 # ----------------------------
 
+def frames_from_packets(packets):
+    """(frame_idx, total data frame bytes) rows from an already read pcap_frames.VideoPackets."""
+    frame_sizes = packets.frame_sizes()
+    data_frames = np.stack([np.arange(len(frame_sizes)), frame_sizes], axis=1)
+
+    print(f"Found a total of {len(data_frames)} frames")    
+    print("Duration in sec:", len(data_frames)/FPS)
+
+    return data_frames
+
 def pcap_to_frame(pcap_path):
     """
     convert pcap file of packets to video frames 
-    """
-    # Load pcap file
-    packets = rdpcap(pcap_path)
-    
-    if len(packets) == 0:
-        raise RuntimeError(f"No packets found in {pcap_path}")
-    
-    # Find the first video transmission packet (802.11 data frame with larger size)
-    first_video_packet = None
-    first_video_timestamp = None
-    first_video_packet_index = None
-    
-    for idx, pkt in enumerate(packets):
-        # Check if it's an 802.11 data frame (type == 2)
-        if pkt.haslayer(Dot11):
-            dot11 = pkt[Dot11]
-            # Type 2 = Data frame
-            if dot11.type == 2:
-                packet_size = len(pkt)
-                if packet_size >= MIN_VIDEO_PACKET_SIZE:
-                    first_video_packet = pkt
-                    first_video_timestamp = float(pkt.time)
-                    first_video_packet_index = idx
-                    break
-    
-    if first_video_packet is None:
-        raise RuntimeError(f"No video transmission packet found in {pcap_path}")
-       
-    # chop off until first video packet
-    packets = packets[first_video_packet_index:]
-
-    # Calculate frame time window
-    frame_duration = 1.0 / FPS  # seconds per frame
-    
-    # Collect all 802.11 data frames with their timestamps and sizes
-    data_frames = []
-    frame_idx = 0
-    packet_acc = 0
-    for idx, pkt in enumerate(tqdm(packets, desc="Collecting 802.11 data frames", leave=False)):
-        # Check if it's an 802.11 data frame
-        if pkt.haslayer(Dot11):
-            dot11 = pkt[Dot11]
-            if dot11.type == 2:  # Data frame
-                timestamp = float(pkt.time)
-                # if this is the next frame
-                if (timestamp - first_video_timestamp)/frame_duration >= frame_idx:
-                    data_frames.append([frame_idx, packet_acc])
-                    frame_idx += 1
-                    packet_acc = 0
-                # else accumulate the packet size to the current frame
-                else:
-                    packet_acc += len(pkt)
-    
-    if len(data_frames) == 0:
-        raise RuntimeError(f"No 802.11 data frames found after first video packet in {pcap_path}")
-    
-    print(f"Found a total of {len(data_frames)} frames")    
-    print("Duration in sec:", len(data_frames)/FPS)
 
-    return np.array(data_frames)
+    Packets are bucketed into 1/FPS frames from the first video packet on by
+    the shared pcap_frames core, the same frames parse_pcap computes the LSTM
+    features for. To feed both from one read, call
+    pcap_frames.read_video_packets once and pass the result to
+    frames_from_packets and VideoPackets.frame_features.
+    """
+    return frames_from_packets(read_video_packets(pcap_path))
 
-def frames_to_events(data):
-    """Convert frame-level data to car detection events."""
-    events = []
-    final_events = []
+def normalize_frame_sizes(data, iframe_zscore=IFRAME_ZSCORE, verbose=True):
+    """
+    Frame sizes with I-frames zeroed, scaled to [0, 1] by the largest remaining frame.
 
-    # remove i-frames
-    frame_sizes = data[:,1].copy()
+    I-frames are the frames whose size z-score exceeds iframe_zscore.
+    data is the (frame_idx, size) array from pcap_to_frame and is left unchanged.
+    """
+    frame_sizes = data[:, 1].astype(np.float64)
 
     mean = np.mean(frame_sizes)
     std = np.std(frame_sizes)
+    if verbose:
+        print("mean: ", mean)
+        print("std: ", std)
+
+    # remove i-frames
+    frame_sizes[(frame_sizes - mean) / std > iframe_zscore] = 0
+    return frame_sizes / np.max(frame_sizes)
+
+def over_threshold_prefix(normalized_data, threshold_size):
+    """Prefix counts of frames above threshold_size: prefix[i] = #{j < i : x[j] > threshold_size}."""
+    prefix = np.zeros(len(normalized_data) + 1, dtype=np.int64)
+    np.cumsum(normalized_data > threshold_size, out=prefix[1:])
+    return prefix
+
+def window_over_fraction(prefix, win_length):
+    """
+    Fraction of frames above threshold in the window starting at every index,
+    from an over_threshold_prefix array, in O(N).
 
-    print("mean: ", mean)
-    print("std: ", std)
-    frame_sizes = (frame_sizes - mean) / std
+    Windows that would reach the last frame are left out, as in the original scan.
+    """
+    if win_length < 1:
+        raise ValueError(f"window size must be positive, got {win_length}")
+    over_count = prefix[win_length:-1] - prefix[:-win_length - 1]
+    return over_count / float(win_length)
+
+def prune_events(events, min_gap=EVENT_MIN_GAP):
+    """Collapse runs of detection indices into single events (a new event needs a jump > min_gap)."""
+    events = np.asarray(events)
+    if len(events) == 0:
+        return []
+    keep = np.concatenate(([True], np.diff(events) > min_gap))
+    return events[keep].tolist()
+
+def detect_events(normalized_data, win_length, threshold_size, required_fraction, prefix=None):
+    """
+    Frame indices where a car is detected.
 
-    threshold = 2
-    for i in range(len(frame_sizes)):
-        if frame_sizes[i] > threshold: 
-            data[i][1] = 0
-            frame_sizes[i] = 0
+    A window of win_length frames starting at an index fires if at least
+    required_fraction of its frames exceed threshold_size; consecutive firing
+    indices are pruned to one event. prefix can be passed to reuse an
+    over_threshold_prefix array across window sizes and fractions.
+    """
+    if prefix is None:
+        prefix = over_threshold_prefix(normalized_data, threshold_size)
+    fraction = window_over_fraction(prefix, win_length)
+    return prune_events(np.flatnonzero(fraction >= required_fraction))
 
-    # plt.figure(figsize=(12,5))
-    # plt.plot(data[:,0], data[:,1])
-    # plt.xlabel("Frame Index")
-    # plt.ylabel("Frame Size")
-    # plt.title("Frame Size vs Frame Index with i-frames removed")
-    # plt.show()
+def frames_to_events(data, win_length=None, threshold_size=None, required_fraction=None):
+    """
+    Convert frame-level data to car detection events.
+
+    With win_length, threshold_size and required_fraction given, runs once and
+    returns the events. Otherwise shows the normalized series and prompts for
+    parameters until the user enters 'x', returning the last events found.
+    """
+    normalized_data = normalize_frame_sizes(data)
+
+    if None not in (win_length, threshold_size, required_fraction):
+        return detect_events(normalized_data, win_length, threshold_size, required_fraction)
 
-    normalized_data = data[:,1]/np.max(data[:,1])
     plt.figure(figsize=(12,5))
     plt.plot(data[:,0], normalized_data)
     # plt.scatter(data[3900:4100,0], normalized_data[3900:4100])
@@ -136,8 +138,8 @@ def frames_to_events(data):
     plt.ylabel("Frame Size")
     plt.title("Normalized Frame Size vs Frame Index with i-frames removed")
     plt.show()
-    # return []
 
+    final_events = []
     while True:
         user_input = input("Enter window size, threshold_size and required fraction of window (how much of window above threshold) separated by a comma (or 'x' to exit): ")
         
@@ -150,25 +152,14 @@ def frames_to_events(data):
             win_length = int(win_length_str.strip())
             threshold_size = float(threshold_size_str.strip())
             required_fraction = float(required_fraction_str.strip())
+            if win_length < 1:
+                raise ValueError
         except ValueError:
-            print("Invalid input. Please enter three numbers separated by commas.")
+            print("Invalid input. Please enter three numbers separated by commas (window size >= 1).")
             continue
 
         print("More than ", required_fraction * win_length, " out of ", win_length, " must exceed ", threshold_size)
-        events.clear()  # clear previous events
-        final_events.clear()
-        for idx, size in enumerate(normalized_data[0:-win_length]):
-            over_count = np.sum(normalized_data[idx:idx+win_length] > threshold_size)
-            if over_count / float(win_length) >= required_fraction:
-                events.append(idx)
-
-        if len(events) > 0:
-            # prune events down to single events
-            final_events.append(events[0])
-            for idx in range(1,len(events)):
-                if events[idx] - events[idx-1] > 30:
-                    final_events.append(events[idx])
-
+        final_events = detect_events(normalized_data, win_length, threshold_size, required_fraction)
         print(f"Detected events at indices: {final_events}")
     
         
@@ -222,14 +213,36 @@ def main():
         description="Convert pcap to npy array of frame-level features"
     )
     parser.add_argument("-f", "--pcap-file", type=str, help="Path to the pcap file to process")
+    detection = parser.add_argument_group(
+        "batch mode", "give all three to detect events without the interactive prompt"
+    )
+    detection.add_argument("-w", "--window", type=int, help="Sliding window size in frames")
+    detection.add_argument("-t", "--threshold", type=float, help="Normalized frame size threshold")
+    detection.add_argument("-r", "--fraction", type=float, help="Required fraction of the window above threshold")
+    detection.add_argument("-o", "--output", type=str, help="Write the detected event frame indices to this JSON file")
+    parser.add_argument("--features-out", type=str,
+                        help="Also save the LSTM frame features (as parse_pcap.py would) from the same pcap read")
 
     args = parser.parse_args()
-
-    data = pcap_to_frame(args.pcap_file)
-    plot_frame_data(data)
-    events = frames_to_events(data)
+    batch_args = (args.window, args.threshold, args.fraction)
+    batch = None not in batch_args
+    if not batch and any(arg is not None for arg in batch_args):
+        parser.error("--window, --threshold and --fraction must be given together")
+
+    packets = read_video_packets(args.pcap_file)
+    data = frames_from_packets(packets)
+    if args.features_out:
+        np.save(args.features_out, packets.frame_features())
+        print(f"Frame features written to {args.features_out}")
+    if not batch:
+        plot_frame_data(data)
+    events = frames_to_events(data, *batch_args)
     print_events(events)
 
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(events, f)
+        print(f"Events written to {args.output}")
+
 if __name__ == "__main__":
     main()
-
@@ -0,0 +1,221 @@
+"""
+Parameter sweep for the inner-event (encrypted traffic) car detector.
+
+Instead of typing (window, threshold, fraction) guesses into the
+`parse_inner_events.py` prompt, this evaluates a whole grid of settings and
+ranks them by precision/recall/F1 against labeled car events:
+
+- YOLO per-frame labels (`<camera>_features.npy` from mininet/parse_video.py):
+  every run of car frames is one event, spanning the run.
+- Edge events (`data_parsing/out/<camera>_events.json` from parse_edge_events.py):
+  every event is a single frame.
+
+A detection counts as a hit if it lies within --tolerance frames of an
+unmatched labeled event; each labeled event can be hit at most once.
+
+Thresholds are spread over worker processes. Each worker builds one
+over-threshold prefix-sum array per threshold and reuses it for every window
+size and fraction, so every setting costs O(N).
+"""
+import argparse
+import heapq
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from parse_inner_events import (
+    normalize_frame_sizes,
+    over_threshold_prefix,
+    pcap_to_frame,
+    prune_events,
+    window_over_fraction,
+)
+
+# ----------------------------
+# CONFIG
+# ----------------------------
+
+DEFAULT_WINDOWS = "10:200:10"
+DEFAULT_THRESHOLDS = "0.1:0.9:0.05"
+DEFAULT_FRACTIONS = "0.1:1.0:0.1"
+MATCH_TOLERANCE = 100  # frames (5 s at 20 FPS) between a detection and a labeled event
+TOP_K = 20
+
+# ----------------------------
+# Labels
+# ----------------------------
+
+def label_events(labels_path):
+    """
+    Labeled car events as an (M, 2) array of inclusive [start, end] frames.
+
+    Accepts YOLO per-frame labels (.npy, one 0/1 entry per frame) or an edge
+    events file (.json list of {"frame", "car_id", "location"}).
+    """
+    if str(labels_path).endswith(".npy"):
+        labels = np.load(labels_path).astype(bool)
+        padded = np.concatenate(([False], labels, [False]))
+        edges = np.flatnonzero(np.diff(padded.astype(np.int8)))
+        # rising edges are run starts, falling edges are one past run ends
+        return np.stack([edges[0::2], edges[1::2] - 1], axis=1)
+
+    with open(labels_path, "r") as f:
+        frames = sorted(event["frame"] for event in json.load(f))
+    frames = np.asarray(frames, dtype=np.int64)
+    return np.stack([frames, frames], axis=1)
+
+def count_matches(detections, events, tolerance):
+    """
+    Maximum number of one-to-one (detection, event) pairs with the detection
+    inside [start - tolerance, end + tolerance] of the event.
+
+    detections must be sorted. Greedy: each detection takes the open event
+    that closes first, which is optimal for points against intervals.
+    """
+    order = np.argsort(events[:, 0], kind="stable")
+    starts = events[order, 0] - tolerance
+    ends = events[order, 1] + tolerance
+
+    matched = 0
+    open_events = []  # heap of ends of events that have started
+    next_event = 0
+    for d in detections:
+        while next_event < len(starts) and starts[next_event] <= d:
+            heapq.heappush(open_events, ends[next_event])
+            next_event += 1
+        while open_events and open_events[0] < d:
+            heapq.heappop(open_events)
+        if open_events:
+            heapq.heappop(open_events)
+            matched += 1
+    return matched
+
+def score(num_detections, num_events, matched):
+    precision = matched / num_detections if num_detections else 0.0
+    recall = matched / num_events if num_events else 0.0
+    f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+    return precision, recall, f1
+
+# ----------------------------
+# Sweep
+# ----------------------------
+
+# Set once per worker process by init_worker, so the series is not re-sent per task
+_normalized_data = None
+_events = None
+
+def init_worker(normalized_data, events):
+    global _normalized_data, _events
+    _normalized_data = normalized_data
+    _events = events
+
+def sweep_threshold(threshold_size, windows, fractions, offset, tolerance):
+    """Score every (window, fraction) for one threshold from a single prefix-sum array."""
+    prefix = over_threshold_prefix(_normalized_data, threshold_size)
+    rows = []
+    for win_length in windows:
+        fraction = window_over_fraction(prefix, win_length)
+        for required_fraction in fractions:
+            detections = np.asarray(prune_events(np.flatnonzero(fraction >= required_fraction)), dtype=np.int64)
+            detections += offset
+            matched = count_matches(detections, _events, tolerance)
+            precision, recall, f1 = score(len(detections), len(_events), matched)
+            rows.append((win_length, threshold_size, required_fraction, len(detections), matched, precision, recall, f1))
+    return rows
+
+def run_sweep(normalized_data, events, windows, thresholds, fractions,
+              offset=0, tolerance=MATCH_TOLERANCE, workers=None):
+    """
+    Evaluate every (window, threshold, fraction) setting.
+
+    Returns rows of (window, threshold, fraction, detections, matched,
+    precision, recall, f1), best F1 first (ties: higher precision, then recall).
+    """
+    windows = [int(w) for w in windows]
+    if workers == 1:
+        init_worker(normalized_data, events)
+        results = [sweep_threshold(t, windows, fractions, offset, tolerance) for t in thresholds]
+    else:
+        with ProcessPoolExecutor(
+            max_workers=workers, initializer=init_worker, initargs=(normalized_data, events)
+        ) as pool:
+            futures = [pool.submit(sweep_threshold, t, windows, fractions, offset, tolerance) for t in thresholds]
+            results = [future.result() for future in futures]
+
+    rows = [row for result in results for row in result]
+    rows.sort(key=lambda row: (-row[7], -row[5], -row[6], row[0], row[1], row[2]))
+    return rows
+
+# ----------------------------
+# Output
+# ----------------------------
+
+COLUMNS = ("window", "threshold", "fraction", "detections", "matched", "precision", "recall", "f1")
+
+def print_table(rows, top_k=TOP_K):
+    print(f"{'rank':>4} {'window':>6} {'thresh':>6} {'frac':>5} {'det':>5} {'hit':>4} {'prec':>6} {'recall':>6} {'f1':>6}")
+    for rank, (w, t, r, n, m, p, rc, f1) in enumerate(rows[:top_k], start=1):
+        print(f"{rank:>4} {w:>6} {t:>6.3f} {r:>5.2f} {n:>5} {m:>4} {p:>6.3f} {rc:>6.3f} {f1:>6.3f}")
+
+def write_csv(rows, output_path):
+    with open(output_path, "w") as f:
+        f.write(",".join(COLUMNS) + "\n")
+        for w, t, r, n, m, p, rc, f1 in rows:
+            f.write(f"{w},{t:.6g},{r:.6g},{n},{m},{p:.6f},{rc:.6f},{f1:.6f}\n")
+
+def parse_grid(spec):
+    """'start:stop:step' (stop inclusive) or a comma separated list of values."""
+    if ":" in spec:
+        start, stop, step = (float(x) for x in spec.split(":"))
+        count = int(np.floor((stop - start) / step + 1e-9)) + 1
+        return [round(start + i * step, 10) for i in range(count)]
+    return [float(x) for x in spec.split(",")]
+
+def load_frames(path):
+    """(frame_idx, size) array from a pcap, or one saved from pcap_to_frame as .npy."""
+    if str(path).endswith(".npy"):
+        return np.load(path)
+    return pcap_to_frame(path)
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Sweep (window, threshold, fraction) for the inner-event detector against labeled events"
+    )
+    parser.add_argument("-f", "--pcap-file", required=True, help="pcap file, or a saved (frame, size) .npy array")
+    parser.add_argument("-l", "--labels", required=True,
+                        help="YOLO labels (<camera>_features.npy) or edge events (<camera>_events.json)")
+    parser.add_argument("--windows", default=DEFAULT_WINDOWS, help=f"Window sizes, start:stop:step or list (default: {DEFAULT_WINDOWS})")
+    parser.add_argument("--thresholds", default=DEFAULT_THRESHOLDS, help=f"Thresholds (default: {DEFAULT_THRESHOLDS})")
+    parser.add_argument("--fractions", default=DEFAULT_FRACTIONS, help=f"Required fractions (default: {DEFAULT_FRACTIONS})")
+    parser.add_argument("--tolerance", type=int, default=MATCH_TOLERANCE,
+                        help=f"Frames a detection may be off from a labeled event (default: {MATCH_TOLERANCE})")
+    parser.add_argument("--offset", type=int, default=0, help="Frames added to detections to align them with the labels")
+    parser.add_argument("-j", "--workers", type=int, default=None, help="Worker processes (default: CPU count)")
+    parser.add_argument("-k", "--top", type=int, default=TOP_K, help=f"Rows of the ranked table to print (default: {TOP_K})")
+    parser.add_argument("-o", "--output", help="Write the full ranked table to this CSV file")
+    args = parser.parse_args()
+
+    data = load_frames(args.pcap_file)
+    normalized_data = normalize_frame_sizes(data, verbose=False)
+    events = label_events(args.labels)
+
+    windows = parse_grid(args.windows)
+    thresholds = parse_grid(args.thresholds)
+    fractions = parse_grid(args.fractions)
+    print(f"{len(normalized_data)} frames, {len(events)} labeled events, "
+          f"{len(windows) * len(thresholds) * len(fractions)} settings")
+
+    rows = run_sweep(normalized_data, events, windows, thresholds, fractions,
+                     offset=args.offset, tolerance=args.tolerance, workers=args.workers)
+    print_table(rows, args.top)
+
+    if args.output:
+        write_csv(rows, args.output)
+        print(f"Ranked table written to {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+"""
+Append-only per-camera detection log (JSON Lines).
+
+`process_edge_camera_video.py` writes one compact JSON object per frame as soon
+as the frame's global IDs are assigned, so a crash or Ctrl-C only loses the
+frame in flight. The first line is a header with the camera id and position,
+which the old format repeated in every frame:
+
+    {"format": "detections", "version": 1, "camera_id": 4, "camera_pos": [35.0, -210.0, 7.5]}
+    {"frame": 0, "car_detected": false, "cars": []}
+    {"frame": 1, "car_detected": true, "cars": [{"global_id": 1, "local_id": 3, "position": [0.0, 0.0, 0.0]}]}
+
+`iter_frames` reads a log lazily (optionally following it while it is still
+being written) and yields the same frame dicts as the old
+`camera_<id>_input.json` lists (camera_pos included). It also accepts those
+legacy JSON files so existing test data keeps working.
+"""
+
+import json
+import os
+import time
+
+LOG_FORMAT = "detections"
+LOG_VERSION = 1
+LOG_SUFFIX = ".jsonl"
+
+FOLLOW_POLL_INTERVAL = 0.05  # seconds between polls of a growing log
+FOLLOW_IDLE_TIMEOUT = 10.0   # stop following after this long without new frames
+
+
+class DetectionLogWriter:
+    """
+    Writes the per-frame detection log for one camera.
+
+    Every frame is flushed to the OS immediately, so the log survives the
+    writing process dying; close() also fsyncs it to disk.
+    """
+
+    def __init__(self, path, camera_id, camera_pos):
+        self.path = str(path)
+        self.num_frames = 0
+        self.f = open(self.path, "w")
+        self._write({
+            "format": LOG_FORMAT,
+            "version": LOG_VERSION,
+            "camera_id": camera_id,
+            "camera_pos": list(camera_pos) if camera_pos is not None else None,
+        })
+
+    def _write(self, record):
+        self.f.write(json.dumps(record, separators=(",", ":")))
+        self.f.write("\n")
+        self.f.flush()
+
+    def write_frame(self, frame):
+        """Append one frame dict (frame, car_detected, cars); camera_pos is stored once in the header."""
+        record = {key: value for key, value in frame.items() if key != "camera_pos"}
+        self._write(record)
+        self.num_frames += 1
+
+    def close(self):
+        if self.f.closed:
+            return
+        os.fsync(self.f.fileno())
+        self.f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+def read_header(path):
+    """Header of a detection log, or None for a legacy JSON list."""
+    with open(path, "r") as f:
+        first = f.readline()
+    try:
+        record = json.loads(first)
+    except json.JSONDecodeError:
+        return None
+    if isinstance(record, dict) and record.get("format") == LOG_FORMAT:
+        return record
+    return None
+
+
+def iter_frames(path, follow=False, idle_timeout=FOLLOW_IDLE_TIMEOUT):
+    """
+    Lazily yield the frame dicts of a detection log or a legacy camera_<id>_input.json.
+
+    A truncated last line (the writer was killed mid-write) is skipped.
+
+    Args:
+        follow: keep reading as the log grows (like tail -f), for consuming a
+            log while process_edge_camera_video.py is still writing it
+        idle_timeout: in follow mode, stop after this many seconds without new data
+    """
+    if follow:
+        # The header may not be written yet
+        wait_for_data(path, idle_timeout)
+    header = read_header(path)
+    if header is None:
+        # Legacy format: one indented JSON list, must be loaded whole
+        with open(path, "r") as f:
+            yield from json.load(f)
+        return
+
+    camera_pos = header["camera_pos"]
+    with open(path, "r") as f:
+        f.readline()  # header
+        partial = ""
+        idle_since = time.monotonic()
+        while True:
+            line = f.readline()
+            if line:
+                partial += line
+                if not partial.endswith("\n"):
+                    continue
+                line, partial = partial, ""
+                idle_since = time.monotonic()
+            elif follow and time.monotonic() - idle_since < idle_timeout:
+                time.sleep(FOLLOW_POLL_INTERVAL)
+                continue
+            else:
+                break  # EOF, a partial last line is dropped
+
+            record = json.loads(line)
+            if camera_pos is not None:
+                record["camera_pos"] = camera_pos
+            yield record
+
+
+def wait_for_data(path, idle_timeout):
+    """Block until path exists and holds a complete first line, or the timeout passes."""
+    deadline = time.monotonic() + idle_timeout
+    while time.monotonic() < deadline:
+        if os.path.exists(path):
+            with open(path, "r") as f:
+                if f.readline().endswith("\n"):
+                    return
+        time.sleep(FOLLOW_POLL_INTERVAL)
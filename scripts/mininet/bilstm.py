@@ -0,0 +1,91 @@
+"""
+The BiLSTM regressor and loading it for inference.
+
+Kept apart from model.py's dataset, training and export code so a training
+checkpoint (.pt) or a TorchScript export (.ts) loads with torch and this file
+only. `TorchModel` gives either one the numpy-in/numpy-out call of
+runtime.OnnxModel.
+"""
+
+from __future__ import annotations
+
+import json
+from pathlib import Path
+
+import numpy as np
+import torch
+from torch import nn
+
+from runtime import EXPORT_META_KEY
+
+HIDDEN_DIM = 128
+DEVICE = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+
+
+class BiLSTMRegressor(nn.Module):
+    def __init__(self, input_dim: int, hidden_dim: int, output_dim: int):
+        super().__init__()
+        self.lstm = nn.LSTM(
+            input_dim,
+            hidden_dim,
+            batch_first=True,
+            bidirectional=True,
+            num_layers=2,
+            dropout=0.1,
+        )
+        self.head = nn.Sequential(
+            nn.Linear(hidden_dim * 2, hidden_dim),
+            nn.ReLU(),
+            nn.Linear(hidden_dim, output_dim),
+        )
+
+    def forward(self, x: torch.Tensor) -> torch.Tensor:
+        seq_out, _ = self.lstm(x)
+        return self.head(seq_out)
+
+
+def model_from_checkpoint(checkpoint: dict) -> BiLSTMRegressor:
+    """Float model in eval mode on the CPU from a checkpoint saved by model.train()."""
+    model = BiLSTMRegressor(
+        input_dim=checkpoint["input_dim"],
+        hidden_dim=HIDDEN_DIM,
+        output_dim=checkpoint["output_dim"],
+    )
+    model.load_state_dict(checkpoint["model_state"])
+    return model.eval()
+
+
+def checkpoint_meta(checkpoint: dict) -> dict:
+    """Everything but the weights: dims, window size and (if recorded) the feature preprocessing."""
+    meta = {key: checkpoint[key] for key in ("input_dim", "output_dim", "window_size")}
+    if "preprocessing" in checkpoint:
+        meta["preprocessing"] = checkpoint["preprocessing"]
+    return meta
+
+
+class TorchModel:
+    """A torch module on DEVICE, called with and returning float32 numpy windows."""
+
+    def __init__(self, module: nn.Module):
+        self.module = module.to(DEVICE).eval()
+
+    @torch.no_grad()
+    def __call__(self, windows: np.ndarray) -> np.ndarray:
+        inputs = torch.from_numpy(np.asarray(windows, dtype=np.float32)).to(DEVICE)
+        return self.module(inputs).float().cpu().numpy()
+
+
+def load_torch_model(model_path: Path) -> tuple[TorchModel, dict]:
+    """TorchModel and meta of a .pt training checkpoint or a .ts TorchScript export."""
+    if model_path.suffix == ".ts":
+        extra_files = {EXPORT_META_KEY: ""}
+        module = torch.jit.load(str(model_path), map_location="cpu", _extra_files=extra_files)
+        meta = json.loads(extra_files[EXPORT_META_KEY])
+    else:
+        checkpoint = torch.load(model_path, map_location="cpu")
+        module = model_from_checkpoint(checkpoint)
+        meta = {**checkpoint_meta(checkpoint), "precision": "float32"}
+
+    if meta["precision"] == "int8" and DEVICE.type != "cpu":
+        raise ValueError(f"{model_path} is quantized and runs on the CPU only (set CUDA_VISIBLE_DEVICES=).")
+    return TorchModel(module), meta
@@ -2,6 +2,8 @@ import numpy as np
 from pathlib import Path
 from typing import Dict
 
+from runtime import FEATURE_COLUMNS, TRIM_ROWS
+
 
 VIDEO_FEATURES_DIR = Path("/home/ubuntu/M202A-CARLA/scripts/mininet/video_features")
 PCAP_FEATURES_DIR = Path("/home/ubuntu/M202A-CARLA/scripts/mininet/pcap_features")
@@ -26,7 +28,7 @@ def preprocess_feature_pairs() -> None:
         pcap = np.load(pcap_files[camera])
         video = np.load(video_files[camera])
 
-        X = pcap[:, (0,1,3)] # pkt count, total pkt size, pkt std dev
+        X = pcap[:, FEATURE_COLUMNS] # pkt count, total pkt size, pkt std dev
         target_rows = X.shape[0]
 
         if video.ndim == 1:
@@ -40,13 +42,13 @@ def preprocess_feature_pairs() -> None:
         # assume Y is always larger than X, so we can slice Y to the same length as X
         y = video[:target_rows]
 
-        # Remove first 500 elements from both X and y
+        # Remove first TRIM_ROWS elements from both X and y
         # get rid of networking noise at the beginning
-        X = X[500:]
-        y = y[500:]
+        X = X[TRIM_ROWS:]
+        y = y[TRIM_ROWS:]
 
-        # Standardize X: zero mean and unit variance
-        X = (X - X.mean(axis=0)) / X.std(axis=0)
+        # X is left unscaled: model.py standardizes with the stats of the
+        # training frames across all cameras and stores them in the checkpoint
 
         print(f"{camera}: X shape {X.shape}, y shape {y.shape}")
 
@@ -0,0 +1,137 @@
+"""
+Accuracy/latency comparison of the float BiLSTM checkpoint and its exports.
+
+Scores the held-out windows of `dataset/` (the split model.py trains with)
+with the training checkpoint and every artifact from `model.py export`, and
+reports per model:
+
+- test MSE and frame accuracy of the rounded, clipped prediction against y
+- agreement of that binary output with the float checkpoint, and the largest
+  probability deviation from it
+- batched throughput (windows/s) and median single-window latency
+- file size
+
+    python model.py export --formats torchscript onnx
+    python compare_models.py
+"""
+
+from __future__ import annotations
+
+import argparse
+import time
+from pathlib import Path
+from typing import List, Sequence
+
+import numpy as np
+import torch
+
+from infer import load_model
+from model import DATASET_DIR, MODEL_PATH, RNG_SEED, TEST_SPLIT, WindowDataset, load_feature_pairs, set_seed, split_dataset
+from runtime import FeaturePreprocessing, WindowModel
+
+EVAL_BATCH_SIZE = 256
+LATENCY_REPEATS = 200
+MAX_EVAL_WINDOWS = 20_000  # evenly spaced test windows used for the comparison
+
+
+def default_models(checkpoint_path: Path) -> List[Path]:
+    """The checkpoint followed by whichever of its exports exist next to it."""
+    stem = checkpoint_path.stem
+    exports = [f"{stem}.ts", f"{stem}_int8.ts", f"{stem}.onnx", f"{stem}_int8.onnx"]
+    return [checkpoint_path] + [checkpoint_path.with_name(name) for name in exports
+                                if checkpoint_path.with_name(name).exists()]
+
+
+def test_windows(dataset_dir: Path, meta: dict, max_windows: int) -> tuple[np.ndarray, np.ndarray]:
+    """Stacked (x, y) test windows of the default training split, standardized as in training."""
+    set_seed(RNG_SEED)
+    dataset = WindowDataset(load_feature_pairs(dataset_dir), meta["window_size"])
+    if "preprocessing" in meta:
+        preprocessing = FeaturePreprocessing.from_dict(meta["preprocessing"])
+        dataset = dataset.normalized(preprocessing.mean, preprocessing.std)
+    _, test_ds = split_dataset(dataset, TEST_SPLIT)
+    indices = np.linspace(0, len(test_ds) - 1, min(len(test_ds), max_windows)).astype(np.int64)
+    xs, ys = zip(*(test_ds[int(i)] for i in np.unique(indices)))
+    return torch.stack(xs).numpy(), torch.stack(ys).numpy()
+
+
+def predict(model: WindowModel, x: np.ndarray, batch_size: int) -> tuple[np.ndarray, float]:
+    """Predictions for every window and the throughput in windows/s."""
+    start_time = time.perf_counter()
+    preds = np.concatenate([model(x[start : start + batch_size]) for start in range(0, len(x), batch_size)])
+    return preds, len(x) / (time.perf_counter() - start_time)
+
+
+def single_window_latency(model: WindowModel, window: np.ndarray, repeats: int) -> float:
+    """Median seconds for one forward pass on a single window (the streaming case)."""
+    window = window[None]
+    model(window)  # warm-up
+    timings = []
+    for _ in range(repeats):
+        start_time = time.perf_counter()
+        model(window)
+        timings.append(time.perf_counter() - start_time)
+    return float(np.median(timings))
+
+
+def compare(model_paths: Sequence[Path], dataset_dir: Path, batch_size: int, max_windows: int) -> None:
+    reference = None
+    x = y = None
+    print(f"{'model':<28} {'prec':>7} {'MB':>6} {'mse':>8} {'acc':>6} {'agree':>6} {'max|d|':>7} "
+          f"{'win/s':>9} {'1-win ms':>8}")
+    for path in model_paths:
+        model, meta = load_model(path)
+        if x is None:
+            x, y = test_windows(dataset_dir, meta, max_windows)
+        if meta["input_dim"] != x.shape[-1] or meta["window_size"] != x.shape[1]:
+            print(f"{path.name:<28} skipped: expects {meta['window_size']}x{meta['input_dim']} windows")
+            continue
+
+        preds, throughput = predict(model, x, batch_size)
+        latency = single_window_latency(model, x[0], LATENCY_REPEATS)
+        probs = np.clip(preds, 0.0, 1.0)
+        binary = np.round(probs)
+        if reference is None:
+            reference = (probs, binary)
+
+        mse = float(np.mean((preds - y) ** 2))
+        accuracy = float(np.mean(binary == np.round(y)))
+        agreement = float(np.mean(binary == reference[1]))
+        max_diff = float(np.abs(probs - reference[0]).max())
+        size_mb = path.stat().st_size / 1e6
+        print(f"{path.name:<28} {meta['precision']:>7} {size_mb:>6.2f} {mse:>8.5f} {accuracy:>6.3f} "
+              f"{agreement:>6.3f} {max_diff:>7.4f} {throughput:>9.0f} {latency * 1000:>8.3f}")
+    if x is not None:
+        print(f"{len(x)} test windows from {dataset_dir}; agree/max|d| are relative to {model_paths[0].name}")
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Compare the float BiLSTM checkpoint with its exports.")
+    parser.add_argument(
+        "--models",
+        type=Path,
+        nargs="+",
+        help="Models to compare, the first is the reference "
+        f"(default: {MODEL_PATH.name} and its exports next to it).",
+    )
+    parser.add_argument(
+        "--dataset-dir",
+        type=Path,
+        default=DATASET_DIR,
+        help=f"Directory with camera_*_features_X/y.npy (default: {DATASET_DIR}).",
+    )
+    parser.add_argument("--batch-size", type=int, default=EVAL_BATCH_SIZE,
+                        help=f"Windows per forward pass for the accuracy run (default: {EVAL_BATCH_SIZE}).")
+    parser.add_argument("--max-windows", type=int, default=MAX_EVAL_WINDOWS,
+                        help=f"Test windows to score at most (default: {MAX_EVAL_WINDOWS}).")
+    return parser.parse_args()
+
+
+def main() -> None:
+    args = parse_args()
+    model_paths = args.models or default_models(MODEL_PATH)
+    compare(model_paths, args.dataset_dir, args.batch_size, args.max_windows)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+"""
+Incremental cache for the per-camera feature artifacts.
+
+`parse_pcap.py` and `parse_video.py` record every output they write in a JSON
+manifest next to the outputs. An entry is keyed by the output name and stores
+the SHA-256 of the source file together with the extraction parameters, so a
+re-run only processes sources that are new, changed, or were extracted with
+different settings. File size and mtime are stored as well, which lets an
+untouched source skip re-hashing entirely.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+from pathlib import Path
+from typing import Dict, Optional
+
+import numpy as np
+
+MANIFEST_NAME = "feature_cache.json"
+HASH_CHUNK_SIZE = 1 << 20
+
+
+def file_digest(path: str | Path) -> str:
+    """SHA-256 of a file's contents, read in fixed-size chunks."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def save_npy_atomic(output_path: str | Path, array_to_save: np.ndarray) -> None:
+    """
+    Save a numpy array so readers never observe a partially written file.
+
+    The array is written to a temporary file in the destination directory and
+    then renamed over output_path.
+    """
+    tmp_path = f"{output_path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, "wb") as f:
+            np.save(f, array_to_save)
+        os.replace(tmp_path, output_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+class FeatureCache:
+    """Manifest of (source hash, parameters) for every output in one directory."""
+
+    def __init__(self, output_dir: str | Path, params: Dict[str, object]):
+        self.output_dir = Path(output_dir)
+        self.manifest_path = self.output_dir / MANIFEST_NAME
+        # Round-trip through JSON so comparisons see the same types as a loaded manifest
+        self.params = json.loads(json.dumps(params))
+        self.entries: Dict[str, dict] = {}
+        if self.manifest_path.exists():
+            with open(self.manifest_path, "r") as f:
+                self.entries = json.load(f)
+
+    def is_fresh(self, source_path: str | Path, output_path: str | Path) -> bool:
+        """True if output_path was produced from the current source content with the current params."""
+        output_path = Path(output_path)
+        entry = self.entries.get(output_path.name)
+        if entry is None or entry["params"] != self.params or not output_path.exists():
+            return False
+
+        stat = os.stat(source_path)
+        if entry["size"] == stat.st_size and entry["mtime_ns"] == stat.st_mtime_ns:
+            return True
+
+        # Touched but possibly identical content: fall back to the hash
+        if entry["size"] != stat.st_size or file_digest(source_path) != entry["sha256"]:
+            return False
+        entry["mtime_ns"] = stat.st_mtime_ns
+        self.save()
+        return True
+
+    def record(
+        self,
+        source_path: str | Path,
+        output_path: str | Path,
+        digest: Optional[str] = None,
+        stat: Optional[os.stat_result] = None,
+    ) -> None:
+        """
+        Mark output_path as up to date for source_path.
+
+        digest/stat should be taken before the source was read for extraction,
+        so a source modified while it was being processed is seen as stale next run.
+        """
+        if stat is None:
+            stat = os.stat(source_path)
+        if digest is None:
+            digest = file_digest(source_path)
+        self.entries[Path(output_path).name] = {
+            "source": str(Path(source_path).resolve()),
+            "sha256": digest,
+            "size": stat.st_size,
+            "mtime_ns": stat.st_mtime_ns,
+            "params": self.params,
+        }
+        self.save()
+
+    def invalidate(self, output_path: str | Path) -> None:
+        """Drop a stale output so nothing downstream reads it while it is regenerated."""
+        output_path = Path(output_path)
+        if self.entries.pop(output_path.name, None) is not None:
+            self.save()
+        if output_path.exists():
+            output_path.unlink()
+
+    def save(self) -> None:
+        tmp_path = f"{self.manifest_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.entries, f, indent=2, sort_keys=True)
+        os.replace(tmp_path, self.manifest_path)
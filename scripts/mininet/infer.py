@@ -1,9 +1,14 @@
 """
 Run inference with the trained BiLSTM regressor on a single feature file.
 
-Loads the checkpoint produced by `model.py`, slides a WINDOW_SIZE context over
-the provided PCAP feature sequence, and averages overlapping predictions so the
-output aligns 1:1 with the original sequence length.
+Loads the checkpoint produced by `model.py` (or one of its TorchScript/ONNX
+exports, float or int8), slides a WINDOW_SIZE context over the provided PCAP
+feature sequence, and averages overlapping predictions so the output aligns
+1:1 with the original sequence length.
+
+The windowing, preprocessing and ONNX execution live in `runtime.py` and need
+numpy and onnxruntime only; `.pt` and `.ts` files are loaded by `bilstm.py`
+with torch, neither imports model.py's training code.
 """
 
 from __future__ import annotations
@@ -12,63 +17,29 @@ import argparse
 from pathlib import Path
 
 import numpy as np
-import torch
 
-from model import BiLSTMRegressor, DEVICE, WINDOW_SIZE, DATASET_DIR
+from runtime import OnnxModel, WindowModel, predict_frames, prepare_features
 
-DEFAULT_MODEL_PATH = DATASET_DIR / "bilstm_regressor.pt"
+DEFAULT_MODEL_PATH = Path(__file__).resolve().parent / "dataset" / "bilstm_regressor.pt"  # model.MODEL_PATH
 
 
-def build_windows(sequence: np.ndarray, window_size: int) -> torch.Tensor:
-    """Slice numpy array into overlapping windows (stride 1)."""
-    seq_len = len(sequence)
-    if seq_len < window_size:
-        raise ValueError(
-            f"Sequence length {seq_len} shorter than window size {window_size}."
-        )
-
-    windows = []
-    for start in range(seq_len - window_size + 1):
-        windows.append(sequence[start : start + window_size])
-
-    stacked = np.stack(windows).astype(np.float32)
-    return torch.from_numpy(stacked)
-
-
-def overlap_average(preds: torch.Tensor, seq_len: int, window_size: int) -> np.ndarray:
-    """Average overlapping window predictions back to the original sequence length."""
-    output_dim = preds.shape[-1]
-    sums = torch.zeros(seq_len, output_dim, device=preds.device)
-    counts = torch.zeros(seq_len, 1, device=preds.device)
+def load_model(model_path: Path) -> tuple[WindowModel, dict]:
+    """
+    Model and its meta (window_size, input_dim, output_dim, precision and,
+    for checkpoints trained with recorded stats, preprocessing).
 
-    for idx in range(preds.shape[0]):
-        start = idx
-        end = idx + window_size
-        sums[start:end] += preds[idx]
-        counts[start:end] += 1
+    model_path is a training checkpoint (.pt) or an artifact from
+    `model.py export`: TorchScript (.ts) or ONNX (.onnx), float32 or int8.
+    The model takes and returns numpy windows (see runtime.py). ONNX files
+    are run by onnxruntime alone; torch is only imported for the others.
+    """
+    if model_path.suffix == ".onnx":
+        model = OnnxModel(model_path)
+        return model, model.meta
 
-    averaged = sums / counts
-    return averaged.cpu().numpy()
+    from bilstm import load_torch_model
 
-
-def load_model(model_path: Path) -> tuple[BiLSTMRegressor, dict]:
-    checkpoint = torch.load(model_path, map_location=DEVICE)
-    input_dim = checkpoint["input_dim"]
-    output_dim = checkpoint["output_dim"]
-    window_size = checkpoint["window_size"]
-
-    model = BiLSTMRegressor(
-        input_dim=input_dim,
-        hidden_dim=128,
-        output_dim=output_dim,
-    ).to(DEVICE)
-    model.load_state_dict(checkpoint["model_state"])
-    model.eval()
-    return model, {
-        "window_size": window_size,
-        "input_dim": input_dim,
-        "output_dim": output_dim,
-    }
+    return load_torch_model(model_path)
 
 
 def run_inference(feature_path: Path, output_path: Path, model_path: Path) -> None:
@@ -80,32 +51,10 @@ def run_inference(feature_path: Path, output_path: Path, model_path: Path) -> No
     model, meta = load_model(model_path)
     window_size = meta["window_size"]
 
-    features = np.load(feature_path)
-    if features.ndim == 1:
-        features = features[:, None]
-    expected_in = meta["input_dim"]
-    current_in = features.shape[1]
-    if current_in > expected_in:
-        print(
-            f"Feature dimension {current_in} larger than model input {expected_in}. "
-            "Truncating to fit the model."
-        )
-        features = features[:, :expected_in]
-    elif current_in < expected_in:
-        print(
-            f"Feature dimension {current_in} smaller than model input {expected_in}. "
-            "Zero padding the missing channels."
-        )
-        pad_width = expected_in - current_in
-        features = np.pad(features, ((0, 0), (0, pad_width)), mode="constant")
-
-    windows = build_windows(features, window_size).to(DEVICE)
-    with torch.no_grad():
-        preds = model(windows)
+    # Memory-mapped: only the selected columns are copied, once, by prepare_features
+    features = prepare_features(np.load(feature_path, mmap_mode="r"), meta)
 
-    averaged = overlap_average(preds, seq_len=len(features), window_size=window_size)
-    averaged = np.clip(averaged, 0.0, 1.0)
-    binary = np.rint(averaged)
+    binary = np.rint(predict_frames(model, features, window_size))
     output_path.parent.mkdir(parents=True, exist_ok=True)
     np.savetxt(output_path, binary)
     print(f"Saved predictions to {output_path}")
@@ -117,7 +66,8 @@ def parse_args() -> argparse.Namespace:
         "--feature-path",
         type=Path,
         required=True,
-        help="Path to the .npy file containing PCAP features.",
+        help="Path to the .npy file of raw parse_pcap.py features (or of "
+        "preprocess_infer.py output, for checkpoints without recorded preprocessing).",
     )
     parser.add_argument(
         "--output-path",
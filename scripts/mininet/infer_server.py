@@ -0,0 +1,469 @@
+"""
+Long-lived, multi-camera inference service for the BiLSTM regressor.
+
+`infer.py` loads the checkpoint and scores one feature file per run, so
+scoring every encrypted camera pays the model load once per camera and runs
+many small forward passes. `InferenceServer` loads the model once and batches
+windows from many cameras into shared forward passes:
+
+- predict_many({camera: features}) scores whole feature sequences. The
+  stride-1 windows of every camera are concatenated, run in batches of up to
+  max_batch_windows and overlap-averaged back per camera, with the same result
+  as infer.py on each file.
+- push_many({camera: row}) feeds one live feature row per camera. Each camera
+  keeps a stream_infer.StreamingPredictor; the newest window of every camera
+  is scored in one forward pass and the frames that became final are returned.
+
+`serve` exposes the same API on a local socket (multiprocessing.connection).
+The connection unpickles what it receives, so clients must present a shared
+key: --authkey or $INFER_SERVER_AUTHKEY, or a random one the server generates
+and prints at startup. There is no built-in default. Requests from all connected clients that arrive within
+BATCH_WAIT of each other are merged into the same forward passes.
+
+    python infer_server.py serve
+    INFER_SERVER_AUTHKEY=<printed key> python infer_server.py predict --feature-path camera_25_features.npy camera_26_features.npy
+"""
+
+from __future__ import annotations
+
+import argparse
+import os
+import queue
+import secrets
+import threading
+import time
+from multiprocessing.connection import Client, Listener
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+from infer import DEFAULT_MODEL_PATH, load_model
+from runtime import FeaturePreprocessing, build_windows, fit_input_dim, overlap_average, prepare_features
+from stream_infer import StreamingPredictor
+
+MAX_BATCH_WINDOWS = 4096  # windows per forward pass
+BATCH_WAIT = 0.005  # seconds the server waits for more requests to join a batch
+DEFAULT_HOST = "localhost"
+DEFAULT_PORT = 6070
+AUTHKEY_ENV = "INFER_SERVER_AUTHKEY"  # shared key, if not given with --authkey
+
+Emitted = List[Tuple[int, np.ndarray]]
+
+
+class InferenceServer:
+    """In-process API: one loaded model shared by any number of camera streams."""
+
+    def __init__(self, model_path: Path, max_batch_windows: int = MAX_BATCH_WINDOWS, lookahead: int | None = None):
+        if not model_path.exists():
+            raise FileNotFoundError(f"Model checkpoint not found: {model_path}")
+        self.model, self.meta = load_model(model_path)
+        self.max_batch_windows = max_batch_windows
+        self.lookahead = lookahead
+        self.streams: Dict[str, StreamingPredictor] = {}
+        self.preprocessing = None
+        if "preprocessing" in self.meta:
+            self.preprocessing = FeaturePreprocessing.from_dict(self.meta["preprocessing"])
+        self.raw_rows: Dict[str, int] = {}  # raw rows received per live stream, for the trim
+
+    def _forward(self, windows: np.ndarray) -> np.ndarray:
+        """Model output for a stack of windows, in chunks of max_batch_windows."""
+        chunks = [
+            self.model(windows[start : start + self.max_batch_windows])
+            for start in range(0, len(windows), self.max_batch_windows)
+        ]
+        return np.concatenate(chunks)
+
+    def _prepare_row(self, camera: str, row: np.ndarray) -> np.ndarray | None:
+        """
+        Model input for one live row, or None while the stream is inside the
+        leading trim. Changes no state; push_many counts the row once the whole
+        request has been prepared.
+        """
+        row = np.asarray(row, dtype=np.float32).reshape(1, -1)
+        if self.preprocessing is None:
+            return fit_input_dim(row, self.meta["input_dim"])[0]
+        # Transform first so a bad row is rejected even inside the trim
+        prepared = self.preprocessing.transform(row)[0]
+        if self.raw_rows.get(camera, 0) < self.preprocessing.trim:
+            return None
+        return prepared
+
+    def predict_many(self, features_by_camera: Dict[str, np.ndarray]) -> Dict[str, np.ndarray]:
+        """Per-frame probabilities (clipped to [0, 1]) for each camera's full feature sequence."""
+        window_size = self.meta["window_size"]
+        cameras = list(features_by_camera)
+        lengths = []
+        windows = []
+        for camera in cameras:
+            features = prepare_features(np.asarray(features_by_camera[camera]), self.meta)
+            lengths.append(len(features))
+            windows.append(build_windows(features, window_size))
+
+        preds = self._forward(np.concatenate(windows))
+        results = {}
+        splits = np.cumsum([len(w) for w in windows])[:-1]
+        for camera, seq_len, camera_preds in zip(cameras, lengths, np.split(preds, splits)):
+            averaged = overlap_average(camera_preds, seq_len=seq_len, window_size=window_size)
+            results[camera] = np.clip(averaged, 0.0, 1.0)
+        return results
+
+    def _stream(self, camera: str) -> StreamingPredictor:
+        if camera not in self.streams:
+            self.streams[camera] = StreamingPredictor(
+                self.model, self.meta["window_size"], self.meta["input_dim"], self.lookahead
+            )
+        return self.streams[camera]
+
+    def push_many(self, rows_by_camera: Dict[str, np.ndarray]) -> Dict[str, Emitted]:
+        """
+        Append one feature row per camera and score all new windows together.
+
+        All rows are checked and transformed before any stream changes, and
+        the appends are undone if the forward pass fails, so a failing call
+        leaves every stream as it was. Rows are raw parse_pcap features when
+        the checkpoint records its preprocessing; the first `trim` rows of a
+        stream are then dropped and frame indices count from the first kept
+        row, as in infer.py. Returns the (frame_idx, probabilities) pairs that
+        became final per camera. A camera's stream is created on its first row
+        (and dropped again if that call fails).
+        """
+        start_time = time.perf_counter()
+        # Prepare every row before touching any stream, so a bad row leaves all streams unchanged
+        prepared = {camera: self._prepare_row(camera, row) for camera, row in rows_by_camera.items()}
+
+        results: Dict[str, Emitted] = {}
+        new_cameras = [camera for camera in prepared if camera not in self.streams]
+        appended = []  # every stream that took a row, windowed or not
+        pending = []
+        for camera, row in prepared.items():
+            self.raw_rows[camera] = self.raw_rows.get(camera, 0) + 1
+            stream = self._stream(camera)
+            window = None
+            if row is not None:
+                window = stream.append(row)
+                appended.append(stream)
+            if window is None:
+                results[camera] = []
+            else:
+                # append returns a view of the ring buffer, which the next row overwrites
+                pending.append((camera, stream, window.copy()))
+
+        if pending:
+            try:
+                preds = self._forward(np.stack([window for _, _, window in pending]))
+            except Exception:
+                for camera in prepared:
+                    self.raw_rows[camera] -= 1
+                for stream in appended:
+                    stream.unappend()
+                for camera in new_cameras:
+                    del self.streams[camera]
+                    del self.raw_rows[camera]
+                raise
+            for (camera, stream, _), camera_preds in zip(pending, preds):
+                results[camera] = stream.accept(camera_preds)
+
+        elapsed = time.perf_counter() - start_time
+        for camera in rows_by_camera:
+            self.streams[camera].latency.add(elapsed)
+        return results
+
+    def close_stream(self, camera: str) -> Emitted:
+        """End a camera's stream and return its frames still waiting for lookahead."""
+        self.raw_rows.pop(camera, None)
+        stream = self.streams.pop(camera, None)
+        if stream is None:
+            return []
+        print(f"Camera {camera} stream closed: {stream.latency.summary()}")
+        return stream.flush()
+
+
+# ----------------------------
+# Socket service
+# ----------------------------
+
+def _push_rounds(requests: List[Tuple[int, Dict[str, np.ndarray]]]) -> List[List[Tuple[int, Dict[str, np.ndarray]]]]:
+    """Group push requests into rounds in which each camera appears at most once, keeping row order."""
+    rounds: List[List[Tuple[int, Dict[str, np.ndarray]]]] = []
+    last_round: Dict[str, int] = {}
+    for index, rows in requests:
+        # The first round after the last one holding any of these cameras
+        target = max((last_round.get(camera, -1) + 1 for camera in rows), default=0)
+        if target == len(rounds):
+            rounds.append([])
+        rounds[target].append((index, rows))
+        for camera in rows:
+            last_round[camera] = target
+    return rounds
+
+
+REQUEST_KINDS = ("predict", "push", "close")
+
+
+def _error(exc: Exception) -> Tuple[str, str]:
+    return ("error", repr(exc))
+
+
+def validate_request(request: object) -> Tuple[str, object]:
+    """(kind, payload) of a received request, or ValueError if it is not one the server can batch."""
+    if not isinstance(request, tuple) or len(request) != 2:
+        raise ValueError("Request must be a (kind, payload) tuple")
+    kind, payload = request
+    if kind not in REQUEST_KINDS:
+        raise ValueError(f"Unknown request {kind!r}, expected one of {REQUEST_KINDS}")
+    if kind == "close":
+        if not isinstance(payload, (list, tuple)) or not all(isinstance(camera, str) for camera in payload):
+            raise ValueError("close payload must be a list of camera names")
+        return kind, payload
+    if not isinstance(payload, dict) or not all(isinstance(camera, str) for camera in payload):
+        raise ValueError(f"{kind} payload must be a dict keyed by camera name")
+    for camera, values in payload.items():
+        values = np.asarray(values)
+        if values.dtype.kind not in "biuf":
+            raise ValueError(f"Camera {camera}: features must be numeric, got dtype {values.dtype}")
+        if kind == "push" and values.ndim != 1:
+            raise ValueError(f"Camera {camera}: a pushed row must be 1-D, got shape {values.shape}")
+        if kind == "predict" and values.ndim not in (1, 2):
+            raise ValueError(f"Camera {camera}: features must be 1-D or 2-D, got shape {values.shape}")
+    return kind, payload
+
+
+def _answer_predicts(server: InferenceServer, predicts: List[Tuple[int, dict]], replies: Dict[int, object]) -> None:
+    merged = {(i, camera): features for i, payload in predicts for camera, features in payload.items()}
+    try:
+        results = server.predict_many(merged)
+        for i, payload in predicts:
+            replies[i] = ("ok", {camera: results[(i, camera)] for camera in payload})
+    except Exception:
+        # One bad sequence fails the merged pass, so retry each request on its own
+        for i, payload in predicts:
+            try:
+                replies[i] = ("ok", server.predict_many(payload))
+            except Exception as exc:
+                replies[i] = _error(exc)
+
+
+def _answer_pushes(server: InferenceServer, pushes: List[Tuple[int, dict]], replies: Dict[int, object]) -> None:
+    for round_requests in _push_rounds(pushes):
+        merged = {camera: row for _, rows in round_requests for camera, row in rows.items()}
+        try:
+            results = server.push_many(merged)
+            for i, rows in round_requests:
+                replies[i] = ("ok", {camera: results[camera] for camera in rows})
+        except Exception:
+            # push_many changes no stream when it fails, so retry each request on its own
+            for i, rows in round_requests:
+                try:
+                    replies[i] = ("ok", server.push_many(rows))
+                except Exception as exc:
+                    replies[i] = _error(exc)
+
+
+def _run_batch(server: InferenceServer, batch: List[Tuple[str, object, queue.Queue]]) -> Dict[int, object]:
+    """Replies to a batch of validated requests, by index, using as few forward passes as possible."""
+    replies: Dict[int, object] = {}
+    handlers = (
+        ("predict", _answer_predicts),
+        ("push", _answer_pushes),
+    )
+    for kind, handler in handlers:
+        requests = [(i, payload) for i, (request_kind, payload, _) in enumerate(batch) if request_kind == kind]
+        if not requests:
+            continue
+        try:
+            handler(server, requests, replies)
+        except Exception as exc:
+            for i, _ in requests:
+                replies.setdefault(i, _error(exc))
+
+    for i, (kind, payload, _) in enumerate(batch):
+        if kind == "close":
+            try:
+                replies[i] = ("ok", {camera: server.close_stream(camera) for camera in payload})
+            except Exception as exc:
+                replies[i] = _error(exc)
+        elif i not in replies:
+            replies[i] = ("error", f"Unknown request {kind!r}")
+    return replies
+
+
+def _batch_loop(server: InferenceServer, requests: queue.Queue) -> None:
+    """Single model thread: collect requests for up to BATCH_WAIT, then run them together."""
+    while True:
+        batch = [requests.get()]
+        deadline = time.perf_counter() + BATCH_WAIT
+        while True:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(requests.get(timeout=remaining))
+            except queue.Empty:
+                break
+        try:
+            replies = _run_batch(server, batch)
+        except Exception as exc:
+            # Never let the only model thread die: every client in the batch gets the error
+            print(f"Batch failed: {exc!r}")
+            replies = {i: _error(exc) for i in range(len(batch))}
+        for i, (_, _, reply_queue) in enumerate(batch):
+            reply_queue.put(replies.get(i, ("error", "No reply produced")))
+
+
+def _handle_client(conn, requests: queue.Queue) -> None:
+    reply_queue: queue.Queue = queue.Queue(maxsize=1)
+    with conn:
+        while True:
+            try:
+                request = conn.recv()
+            except (EOFError, OSError):
+                return
+            except Exception as exc:
+                # The message arrived whole but could not be unpickled
+                conn.send(_error(exc))
+                continue
+            try:
+                kind, payload = validate_request(request)
+            except ValueError as exc:
+                conn.send(_error(exc))
+                continue
+            requests.put((kind, payload, reply_queue))
+            conn.send(reply_queue.get())
+
+
+def resolve_authkey(authkey: str | None) -> str | None:
+    """authkey, else $INFER_SERVER_AUTHKEY, else None."""
+    return authkey or os.environ.get(AUTHKEY_ENV) or None
+
+
+def serve(server: InferenceServer, host: str = DEFAULT_HOST, port: int = DEFAULT_PORT,
+          authkey: str | None = None) -> None:
+    """
+    Accept clients until interrupted; all of them share the server's model and batches.
+
+    Without an authkey (argument or $INFER_SERVER_AUTHKEY) a random one is
+    generated and printed for the clients.
+    """
+    authkey = resolve_authkey(authkey)
+    if authkey is None:
+        authkey = secrets.token_hex(16)
+        print(f"Generated authkey (pass with --authkey or {AUTHKEY_ENV}): {authkey}")
+
+    requests: queue.Queue = queue.Queue()
+    threading.Thread(target=_batch_loop, args=(server, requests), daemon=True).start()
+
+    with Listener((host, port), authkey=authkey.encode()) as listener:
+        print(f"Inference server listening on {host}:{port}")
+        while True:
+            try:
+                conn = listener.accept()
+            except KeyboardInterrupt:
+                print("Shutting down.")
+                return
+            except Exception as exc:
+                # e.g. a client with the wrong authkey
+                print(f"Rejected connection: {exc}")
+                continue
+            threading.Thread(target=_handle_client, args=(conn, requests), daemon=True).start()
+
+
+class InferenceClient:
+    """Client for `serve`, with the same predict_many / push_many / close_stream calls."""
+
+    def __init__(self, host: str = DEFAULT_HOST, port: int = DEFAULT_PORT, authkey: str | None = None):
+        authkey = resolve_authkey(authkey)
+        if authkey is None:
+            raise ValueError(f"No authkey: pass the server's key or set {AUTHKEY_ENV}")
+        self.conn = Client((host, port), authkey=authkey.encode())
+
+    def _call(self, kind: str, payload: object):
+        self.conn.send((kind, payload))
+        status, result = self.conn.recv()
+        if status != "ok":
+            raise RuntimeError(result)
+        return result
+
+    def predict_many(self, features_by_camera: Dict[str, np.ndarray]) -> Dict[str, np.ndarray]:
+        return self._call("predict", features_by_camera)
+
+    def push_many(self, rows_by_camera: Dict[str, np.ndarray]) -> Dict[str, Emitted]:
+        return self._call("push", rows_by_camera)
+
+    def close_stream(self, camera: str) -> Emitted:
+        return self._call("close", [camera])[camera]
+
+    def close(self) -> None:
+        self.conn.close()
+
+    def __enter__(self) -> "InferenceClient":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+# ----------------------------
+# CLI
+# ----------------------------
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Batched multi-camera BiLSTM inference service.")
+    parser.add_argument("--host", default=DEFAULT_HOST, help=f"Server address (default: {DEFAULT_HOST}).")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help=f"Server port (default: {DEFAULT_PORT}).")
+    parser.add_argument(
+        "--authkey",
+        help=f"Shared key clients must present (default: ${AUTHKEY_ENV}; "
+        "serve generates and prints one if neither is set).",
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    serve_parser = commands.add_parser("serve", help="Load the model and serve requests until interrupted.")
+    serve_parser.add_argument(
+        "--model-path",
+        type=Path,
+        default=DEFAULT_MODEL_PATH,
+        help=f"Path to the trained model checkpoint (default: {DEFAULT_MODEL_PATH}).",
+    )
+    serve_parser.add_argument(
+        "--max-batch-windows",
+        type=int,
+        default=MAX_BATCH_WINDOWS,
+        help=f"Windows per forward pass (default: {MAX_BATCH_WINDOWS}).",
+    )
+    serve_parser.add_argument(
+        "--lookahead",
+        type=int,
+        default=None,
+        help="Lookahead of live streams in frames (default: window size - 1).",
+    )
+
+    predict_parser = commands.add_parser(
+        "predict", help="Score feature files on a running server, writing <feature_path>_y_pred.txt for each."
+    )
+    predict_parser.add_argument("--feature-path", type=Path, nargs="+", required=True,
+                                help="One or more .npy feature files, scored in one request.")
+    return parser.parse_args()
+
+
+def main() -> None:
+    args = parse_args()
+    if args.command == "serve":
+        server = InferenceServer(args.model_path, args.max_batch_windows, args.lookahead)
+        serve(server, args.host, args.port, args.authkey)
+        return
+
+    features = {str(path): np.load(path) for path in args.feature_path}
+    with InferenceClient(args.host, args.port, args.authkey) as client:
+        start_time = time.perf_counter()
+        results = client.predict_many(features)
+        print(f"Scored {len(results)} files in {time.perf_counter() - start_time:.3f} s")
+
+    for path in args.feature_path:
+        output_path = path.with_name(path.stem + "_y_pred.txt")
+        np.savetxt(output_path, np.rint(results[str(path)]))
+        print(f"Saved predictions to {output_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,32 +1,59 @@
 """
 Sequence modeling entry point for the Mininet dataset.
 
-Loads paired feature tensors from `dataset/`, slices them into fixed-size
-windows, performs a train/test split, and trains a bidirectional LSTM that
-predicts the per-frame target for every timestep in a window.
+Memory-maps paired feature arrays from `dataset/`, serves fixed-size windows
+over them lazily, performs a train/test split, and trains a bidirectional LSTM
+that predicts the per-frame target for every timestep in a window.
+
+Inputs are standardized with mean/std taken from the training frames only,
+and the checkpoint records them together with the feature column selection
+and leading trim (`FeaturePreprocessing`), so `infer.py` can turn raw
+`parse_pcap.py` output into model inputs exactly as training did.
+
+Stride-1 windows overlap, so a random window split puts near-identical
+windows on both sides. The default split instead holds out a contiguous time
+block of every camera (or whole cameras) with a gap between train and test.
+
+`python model.py export` turns the saved checkpoint into deployable artifacts
+(TorchScript and/or ONNX, float32 and dynamic int8) that `infer.py` loads
+directly, and checks every artifact's output against the checkpoint;
+`compare_models.py` measures their accuracy and latency. The model class
+itself lives in `bilstm.py` and the torch-free preprocessing in `runtime.py`,
+so loading a model never needs this file.
 """
 
 from __future__ import annotations
 
+import argparse
+import json
 import math
 import random
 from dataclasses import dataclass
 from pathlib import Path
-from typing import Iterable, List, Sequence, Tuple
+from typing import Dict, Iterable, List, Sequence, Tuple
 
 import numpy as np
 import torch
 from torch import nn
-from torch.utils.data import DataLoader, Dataset, TensorDataset, random_split
+from torch.utils.data import DataLoader, Dataset, Subset, random_split
+
+from bilstm import DEVICE, HIDDEN_DIM, BiLSTMRegressor, checkpoint_meta, model_from_checkpoint
+from infer import load_model
+from runtime import EXPORT_META_KEY, FEATURE_COLUMNS, TRIM_ROWS, FeaturePreprocessing
 
 
 WINDOW_SIZE = 16  # frames per sequence window
 TEST_SPLIT = 0.2
+SPLIT_MODE = "time"  # "time" (held-out block per camera), "camera" (held-out cameras) or "random" (leaky)
+SPLIT_GAP = WINDOW_SIZE  # frames left unused between train and test frames
 BATCH_SIZE = 64
 EPOCHS = 75
 LEARNING_RATE = 3e-4
 DATASET_DIR = Path(__file__).resolve().parent / "dataset"
-DEVICE = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+MODEL_PATH = DATASET_DIR / "bilstm_regressor.pt"
+EXPORT_FORMATS = ("torchscript", "onnx")
+EXPORT_TOLERANCE = {"float32": 1e-4, "int8": 0.05}  # max |output difference| of an export from the checkpoint
+VERIFY_WINDOWS = 256  # random windows every export is checked on
 RNG_SEED = 1337
 
 
@@ -39,7 +66,12 @@ def set_seed(seed: int) -> None:
 
 
 def load_feature_pairs(dataset_dir: Path) -> List[Tuple[np.ndarray, np.ndarray]]:
-    """Collect X/y numpy arrays for every camera that has a matching pair."""
+    """
+    Collect X/y arrays for every camera that has a matching pair.
+
+    The arrays are memory-mapped copy-on-write, so nothing is read until a
+    window is requested and torch can wrap slices without copying.
+    """
     pairs: List[Tuple[np.ndarray, np.ndarray]] = []
     for x_path in sorted(dataset_dir.glob("camera_*_features_X.npy")):
         cam_prefix = x_path.name.replace("_features_X.npy", "")
@@ -47,8 +79,8 @@ def load_feature_pairs(dataset_dir: Path) -> List[Tuple[np.ndarray, np.ndarray]]
         if not y_path.exists():
             continue
 
-        x = np.load(x_path)
-        y = np.load(y_path)
+        x = np.load(x_path, mmap_mode="c")
+        y = np.load(y_path, mmap_mode="c")
         if y.ndim == 1:
             y = y[:, None]
 
@@ -64,56 +96,211 @@ def load_feature_pairs(dataset_dir: Path) -> List[Tuple[np.ndarray, np.ndarray]]
     return pairs
 
 
-def build_windows(
-    series_pairs: Sequence[Tuple[np.ndarray, np.ndarray]],
-    window_size: int,
-) -> Tuple[torch.Tensor, torch.Tensor]:
-    """Slice every sequence into overlapping windows with stride 1."""
-    windows_x: List[np.ndarray] = []
-    windows_y: List[np.ndarray] = []
-
-    for x_np, y_np in series_pairs:
-        seq_len = len(x_np)
-        if seq_len < window_size:
+# A run of consecutive window starts [first, stop) in one sequence
+Segment = Tuple[int, int, int]
+
+
+class WindowDataset(Dataset):
+    """
+    Overlapping stride-1 windows over a set of (X, y) sequences, built on demand.
+
+    Nothing is stacked up front: item i maps to a sequence and a start frame
+    through the cumulative window counts, and the window is a slice (a
+    zero-copy view) of that sequence. Memory use stays at the size of the
+    underlying arrays, which are memory-mapped by load_feature_pairs.
+
+    segments restricts the dataset to runs of window starts
+    (sequence index, first start, stop start); the default is every window of
+    every sequence. Train/test splits are datasets over disjoint segments of
+    the same arrays, see split_dataset.
+
+    normalization is an optional (mean, std) pair applied to every X window.
+    """
+
+    def __init__(
+        self,
+        series_pairs: Sequence[Tuple[np.ndarray, np.ndarray]],
+        window_size: int,
+        segments: Sequence[Segment] | None = None,
+        normalization: Tuple[np.ndarray, np.ndarray] | None = None,
+    ):
+        self.window_size = window_size
+        self.series = list(series_pairs)
+        self.normalization = normalization
+        if normalization is not None:
+            self._mean, self._std = (torch.as_tensor(v, dtype=torch.float32) for v in normalization)
+        if segments is None:
+            segments = [
+                (k, 0, len(x) - window_size + 1)
+                for k, (x, _) in enumerate(self.series)
+                if len(x) >= window_size
+            ]
+        self.segments = [segment for segment in segments if segment[2] > segment[1]]
+        window_counts = [stop - first for _, first, stop in self.segments]
+        # offsets[k] is the dataset index of the first window of segment k
+        self.offsets = np.concatenate(([0], np.cumsum(window_counts, dtype=np.int64)))
+
+    def __len__(self) -> int:
+        return int(self.offsets[-1])
+
+    def locate(self, index: int) -> Tuple[int, int]:
+        """(sequence index, start frame) of window index."""
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(f"window {index} out of range for {len(self)} windows")
+        segment_idx = int(np.searchsorted(self.offsets, index, side="right")) - 1
+        series_idx, first, _ = self.segments[segment_idx]
+        return series_idx, first + index - int(self.offsets[segment_idx])
+
+    def __getitem__(self, index: int) -> Tuple[torch.Tensor, torch.Tensor]:
+        series_idx, start = self.locate(index)
+        x, y = self.series[series_idx]
+        end = start + self.window_size
+        window = torch.from_numpy(x[start:end]).float()
+        if self.normalization is not None:
+            window = (window - self._mean) / self._std
+        return window, torch.from_numpy(y[start:end]).float()
+
+    def subset(self, segments: Sequence[Segment]) -> "WindowDataset":
+        """Dataset over other window segments of the same sequences (no data is copied)."""
+        return WindowDataset(self.series, self.window_size, segments, self.normalization)
+
+    def normalized(self, mean: np.ndarray, std: np.ndarray) -> "WindowDataset":
+        """The same windows with X standardized by mean/std."""
+        return WindowDataset(self.series, self.window_size, self.segments, (mean, std))
+
+    def frame_stats(self) -> Tuple[np.ndarray, np.ndarray]:
+        """Per-column mean/std of X over the frames the windows cover (constant columns get std 1)."""
+        total = np.zeros(self.input_dim)
+        total_sq = np.zeros(self.input_dim)
+        count = 0
+        for series_idx, first, stop in self.segments:
+            frames = np.asarray(self.series[series_idx][0][first : stop + self.window_size - 1], dtype=np.float64)
+            total += frames.sum(axis=0)
+            total_sq += np.square(frames).sum(axis=0)
+            count += len(frames)
+        mean = total / count
+        std = np.sqrt(np.maximum(total_sq / count - mean**2, 0.0))
+        std[std == 0] = 1.0
+        return mean.astype(np.float32), std.astype(np.float32)
+
+    @property
+    def input_dim(self) -> int:
+        return self.series[0][0].shape[-1]
+
+    @property
+    def output_dim(self) -> int:
+        return self.series[0][1].shape[-1]
+
+
+def split_by_time(
+    dataset: WindowDataset,
+    test_split: float,
+    gap: int,
+    rng: np.random.Generator,
+) -> Tuple[WindowDataset, WindowDataset]:
+    """
+    Hold out one contiguous block of frames per sequence.
+
+    The block covers test_split of the sequence's frames at a random position.
+    Test windows lie fully inside it; train windows end at least gap frames
+    before it or start at least gap frames after it, so no frame (and no
+    neighbourhood of gap frames) is shared between train and test.
+    """
+    window_size = dataset.window_size
+    train_segments: List[Segment] = []
+    test_segments: List[Segment] = []
+
+    for series_idx, first, stop in dataset.segments:
+        num_frames = stop - first + window_size - 1
+        block_len = max(window_size, round(num_frames * test_split))
+        if num_frames < block_len + gap + window_size:
+            # Too short to hold both sides, keep it for training
+            train_segments.append((series_idx, first, stop))
             continue
 
-        n_windows = seq_len - window_size + 1
-        for start in range(n_windows):
-            end = start + window_size
-            windows_x.append(x_np[start:end])
-            windows_y.append(y_np[start:end])
-
-    X = torch.from_numpy(np.stack(windows_x)).float()
-    y = torch.from_numpy(np.stack(windows_y)).float()
-    return X, y
-
-
-class BiLSTMRegressor(nn.Module):
-    def __init__(self, input_dim: int, hidden_dim: int, output_dim: int):
-        super().__init__()
-        self.lstm = nn.LSTM(
-            input_dim,
-            hidden_dim,
-            batch_first=True,
-            bidirectional=True,
-            num_layers=2,
-            dropout=0.1,
-        )
-        self.head = nn.Sequential(
-            nn.Linear(hidden_dim * 2, hidden_dim),
-            nn.ReLU(),
-            nn.Linear(hidden_dim, output_dim),
-        )
-
-    def forward(self, x: torch.Tensor) -> torch.Tensor:
-        seq_out, _ = self.lstm(x)
-        return self.head(seq_out)
-
-
-def split_dataset(dataset: Dataset, test_split: float) -> Tuple[Dataset, Dataset]:
-    test_len = math.ceil(len(dataset) * test_split)
-    train_len = len(dataset) - test_len
-    return random_split(dataset, [train_len, test_len])
+        block_start = first + int(rng.integers(0, num_frames - block_len + 1))
+        block_stop = block_start + block_len  # exclusive, in frames
+
+        test_segments.append((series_idx, block_start, block_stop - window_size + 1))
+        train_segments.append((series_idx, first, block_start - gap - window_size + 1))
+        train_segments.append((series_idx, block_stop + gap, stop))
+
+    return dataset.subset(train_segments), dataset.subset(test_segments)
+
+
+def split_by_camera(
+    dataset: WindowDataset,
+    test_split: float,
+    rng: np.random.Generator,
+) -> Tuple[WindowDataset, WindowDataset]:
+    """Hold out whole sequences (cameras) until they hold at least test_split of the windows."""
+    if len(dataset.segments) < 2:
+        raise ValueError("Camera split needs at least two sequences")
+
+    segments = [dataset.segments[i] for i in rng.permutation(len(dataset.segments))]
+    target = len(dataset) * test_split
+    test_segments: List[Segment] = []
+    test_windows = 0
+    # Always leave at least one sequence for training
+    while segments[1:] and test_windows < target:
+        segment = segments.pop()
+        test_segments.append(segment)
+        test_windows += segment[2] - segment[1]
+
+    return dataset.subset(segments), dataset.subset(test_segments)
+
+
+def split_dataset(
+    dataset: WindowDataset,
+    test_split: float,
+    mode: str = SPLIT_MODE,
+    gap: int = SPLIT_GAP,
+    seed: int = RNG_SEED,
+) -> Tuple[Dataset, Dataset]:
+    """
+    Split windows into train and test sets.
+
+    mode "time" and "camera" never let a frame appear in both sets (see
+    split_by_time / split_by_camera). "random" is the plain random_split over
+    overlapping windows and overstates test performance.
+    """
+    rng = np.random.default_rng(seed)
+    if mode == "time":
+        if gap < dataset.window_size:
+            raise ValueError(f"Split gap ({gap}) must be at least one window ({dataset.window_size})")
+        return split_by_time(dataset, test_split, gap, rng)
+    if mode == "camera":
+        return split_by_camera(dataset, test_split, rng)
+    if mode == "random":
+        test_len = math.ceil(len(dataset) * test_split)
+        train_len = len(dataset) - test_len
+        return random_split(dataset, [train_len, test_len])
+    raise ValueError(f"Unknown split mode {mode!r}")
+
+
+def normalize_splits(
+    dataset: WindowDataset,
+    train_ds: Dataset,
+    test_ds: Dataset,
+) -> Tuple[Dataset, Dataset, FeaturePreprocessing]:
+    """
+    Standardize both splits with the training frames' stats.
+
+    For the "random" split (torch Subsets of dataset) the stats come from
+    every frame, since train and test frames are shared anyway.
+    """
+    stats_source = train_ds if isinstance(train_ds, WindowDataset) else dataset
+    mean, std = stats_source.frame_stats()
+    preprocessing = FeaturePreprocessing(FEATURE_COLUMNS, TRIM_ROWS, mean, std)
+
+    def normalize(ds: Dataset) -> Dataset:
+        if isinstance(ds, Subset):
+            return Subset(normalize(ds.dataset), ds.indices)
+        return ds.normalized(mean, std)
+
+    return normalize(train_ds), normalize(test_ds), preprocessing
 
 
 @dataclass
@@ -152,21 +339,122 @@ def run_epoch(
     return Metrics(loss=mean_loss)
 
 
-def main() -> None:
+def quantize_int8(model: nn.Module) -> nn.Module:
+    """Copy of model with dynamic int8 LSTM and Linear weights (activations stay float, CPU only)."""
+    return torch.ao.quantization.quantize_dynamic(model.cpu(), {nn.LSTM, nn.Linear}, dtype=torch.qint8)
+
+
+def export_onnx(model: nn.Module, meta: dict, path: Path) -> List[Path]:
+    """
+    Write path (float32) and <stem>_int8.onnx next to it.
+
+    Exporting needs the onnx package, the int8 variant is quantized with
+    onnxruntime (which is also what infer.py runs ONNX files with).
+    """
+    import onnx
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    dummy = torch.zeros(1, meta["window_size"], meta["input_dim"])
+    torch.onnx.export(
+        model,
+        (dummy,),
+        str(path),
+        input_names=["windows"],
+        output_names=["preds"],
+        dynamic_axes={"windows": {0: "batch"}, "preds": {0: "batch"}},
+        dynamo=False,
+    )
+    int8_path = path.with_name(f"{path.stem}_int8.onnx")
+    quantize_dynamic(str(path), str(int8_path), weight_type=QuantType.QInt8)
+
+    for artifact, precision in ((path, "float32"), (int8_path, "int8")):
+        proto = onnx.load(str(artifact))
+        onnx.helper.set_model_props(proto, {EXPORT_META_KEY: json.dumps({**meta, "precision": precision})})
+        onnx.save(proto, str(artifact))
+    return [path, int8_path]
+
+
+def verify_export(path: Path, reference: nn.Module, meta: dict, num_windows: int = VERIFY_WINDOWS) -> float:
+    """
+    Largest |difference| between an exported artifact, loaded as infer.py
+    loads it, and the float checkpoint model on the same windows.
+
+    The windows are standard normal, like standardized inputs. Raises if the
+    artifact's meta differs from the checkpoint's or the difference is above
+    EXPORT_TOLERANCE for its precision.
+    """
+    model, artifact_meta = load_model(path)
+    precision = artifact_meta.pop("precision")
+    if artifact_meta != meta:
+        raise ValueError(f"{path} records meta {artifact_meta}, the checkpoint has {meta}")
+
+    shape = (num_windows, meta["window_size"], meta["input_dim"])
+    windows = np.random.default_rng(RNG_SEED).standard_normal(shape, dtype=np.float32)
+    with torch.no_grad():
+        expected = reference.cpu()(torch.from_numpy(windows)).numpy()
+    max_diff = float(np.abs(model(windows) - expected).max())
+    if max_diff > EXPORT_TOLERANCE[precision]:
+        raise ValueError(
+            f"{path} ({precision}) differs from the checkpoint by up to {max_diff:.2e}, "
+            f"more than {EXPORT_TOLERANCE[precision]:.0e}"
+        )
+    return max_diff
+
+
+def export_model(
+    checkpoint_path: Path = MODEL_PATH,
+    formats: Sequence[str] = ("torchscript",),
+    output_dir: Path | None = None,
+) -> Dict[Path, float]:
+    """
+    Write a float32 and a dynamic-int8 artifact of a checkpoint per format.
+
+    torchscript: <stem>.ts and <stem>_int8.ts, scripted modules that run
+    without this file's Python code. onnx: <stem>.onnx and <stem>_int8.onnx,
+    see export_onnx. Every artifact carries its meta (window size, input and
+    output dims, feature preprocessing, precision), so infer.load_model needs
+    nothing else. Each one is reloaded and checked against the checkpoint
+    (verify_export); returns the max |difference| per written path.
+    """
+    checkpoint = torch.load(checkpoint_path, map_location="cpu")
+    model = model_from_checkpoint(checkpoint)
+    meta = checkpoint_meta(checkpoint)
+    output_dir = checkpoint_path.parent if output_dir is None else output_dir
+    output_dir.mkdir(parents=True, exist_ok=True)
+
+    written: List[Path] = []
+    for fmt in formats:
+        if fmt == "torchscript":
+            for precision, variant, suffix in (("float32", model, ""), ("int8", quantize_int8(model), "_int8")):
+                path = output_dir / f"{checkpoint_path.stem}{suffix}.ts"
+                extra_files = {EXPORT_META_KEY: json.dumps({**meta, "precision": precision})}
+                torch.jit.save(torch.jit.script(variant), str(path), _extra_files=extra_files)
+                written.append(path)
+        elif fmt == "onnx":
+            written.extend(export_onnx(model, meta, output_dir / f"{checkpoint_path.stem}.onnx"))
+        else:
+            raise ValueError(f"Unknown export format {fmt!r}, expected one of {EXPORT_FORMATS}")
+    return {path: verify_export(path, model, meta) for path in written}
+
+
+def train() -> None:
     set_seed(RNG_SEED)
 
     pairs = load_feature_pairs(DATASET_DIR)
-    X, y = build_windows(pairs, WINDOW_SIZE)
+    dataset = WindowDataset(pairs, WINDOW_SIZE)
+    print(f"{len(dataset)} windows over {len(dataset.series)} sequences")
 
-    dataset = TensorDataset(X, y)
     train_ds, test_ds = split_dataset(dataset, TEST_SPLIT)
+    print(f"{SPLIT_MODE} split: {len(train_ds)} train / {len(test_ds)} test windows")
+    train_ds, test_ds, preprocessing = normalize_splits(dataset, train_ds, test_ds)
+    print(f"Training feature mean {preprocessing.mean}, std {preprocessing.std}")
     train_loader = DataLoader(train_ds, batch_size=BATCH_SIZE, shuffle=True)
     test_loader = DataLoader(test_ds, batch_size=BATCH_SIZE)
 
-    input_dim = X.shape[-1]
-    output_dim = y.shape[-1]
+    input_dim = dataset.input_dim
+    output_dim = dataset.output_dim
 
-    model = BiLSTMRegressor(input_dim=input_dim, hidden_dim=128, output_dim=output_dim).to(DEVICE)
+    model = BiLSTMRegressor(input_dim=input_dim, hidden_dim=HIDDEN_DIM, output_dim=output_dim).to(DEVICE)
     print("Model architecture:\n", model)
     criterion = nn.MSELoss()
     optimizer = torch.optim.Adam(model.parameters(), lr=LEARNING_RATE)
@@ -182,19 +470,55 @@ def main() -> None:
 
     print("Training complete.")
 
-    model_path = DATASET_DIR / "bilstm_regressor.pt"
+    model_path = MODEL_PATH
     torch.save(
         {
             "model_state": model.state_dict(),
             "input_dim": input_dim,
             "output_dim": output_dim,
             "window_size": WINDOW_SIZE,
+            "preprocessing": preprocessing.to_dict(),
         },
         model_path,
     )
     print(f"Saved model checkpoint to {model_path}")
 
 
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Train the BiLSTM regressor or export a trained checkpoint.")
+    parser.add_argument(
+        "command",
+        nargs="?",
+        choices=("train", "export"),
+        default="train",
+        help="train (default) a new checkpoint, or export an existing one.",
+    )
+    parser.add_argument(
+        "--checkpoint",
+        type=Path,
+        default=MODEL_PATH,
+        help=f"Checkpoint to export (default: {MODEL_PATH}).",
+    )
+    parser.add_argument(
+        "--formats",
+        nargs="+",
+        choices=EXPORT_FORMATS,
+        default=["torchscript"],
+        help="Export formats, each written as float32 and int8 (default: torchscript).",
+    )
+    return parser.parse_args()
+
+
+def main() -> None:
+    args = parse_args()
+    if args.command == "train":
+        train()
+        return
+
+    for path, max_diff in export_model(args.checkpoint, args.formats).items():
+        print(f"Exported {path} (max |diff| from the checkpoint {max_diff:.2e})")
+
+
 if __name__ == "__main__":
     main()
 
@@ -1,14 +1,27 @@
+import argparse
 import numpy as np
-from scapy.all import rdpcap
-from scapy.layers.dot11 import Dot11
 import os
+import struct
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from pathlib import Path
 import sys
+import time
 from tqdm import tqdm
 
-# Add parent directory to path to import util
+# Add parent directory to path to import util and pcap_frames
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
 from util import FPS
+from feature_cache import FeatureCache, file_digest, save_npy_atomic
+from pcap_frames import (
+    FOLLOW_IDLE_TIMEOUT,
+    MIN_VIDEO_PACKET_SIZE,
+    PCAP_GLOBAL_HEADER_LEN,
+    PCAP_MAGICS,
+    PCAP_RECORD_HEADER_LEN,
+    iter_dot11_data_frames,
+    read_video_packets,
+    stream_frame_features,
+)
 
 # ----------------------------
 # CONFIG
@@ -16,239 +29,264 @@ from util import FPS
 
 PCAPS_DIR = "/home/ubuntu/M202A-CARLA/scripts/mininet/pcaps"
 OUTPUT_DIR = "/home/ubuntu/M202A-CARLA/scripts/mininet/pcap_features"
-MIN_VIDEO_PACKET_SIZE = 1000  # Minimum packet size to consider as video transmission packet
+
+# ----------------------------
+# Live replay
+# ----------------------------
+
+def replay_pcap(pcap_path, out, speed=1.0):
+    """
+    Write a pcap to out at the pace its packets were recorded.
+
+    Used to test the live mode without Mininet, e.g.
+        python parse_pcap.py --replay camera_4.pcap | python parse_pcap.py --live -
+
+    Args:
+        pcap_path: Path to a classic pcap file
+        out: Binary file object to write to (sys.stdout.buffer for a pipe)
+        speed: Playback speed multiplier (2.0 replays twice as fast)
+    """
+    with open(pcap_path, "rb") as f:
+        global_header = f.read(PCAP_GLOBAL_HEADER_LEN)
+        if global_header[:4] not in PCAP_MAGICS:
+            raise RuntimeError(f"Unsupported capture format (not a classic pcap): {pcap_path}")
+        byte_order, ts_units = PCAP_MAGICS[global_header[:4]]
+        record_header = struct.Struct(byte_order + "IIII")
+        out.write(global_header)
+        out.flush()
+
+        first_timestamp = None
+        start = time.monotonic()
+        while True:
+            header = f.read(PCAP_RECORD_HEADER_LEN)
+            if len(header) < PCAP_RECORD_HEADER_LEN:
+                break
+            ts_sec, ts_frac, incl_len, _ = record_header.unpack(header)
+            data = f.read(incl_len)
+
+            timestamp = (ts_sec * ts_units + ts_frac) / ts_units
+            if first_timestamp is None:
+                first_timestamp = timestamp
+            delay = (timestamp - first_timestamp) / speed - (time.monotonic() - start)
+            if delay > 0:
+                time.sleep(delay)
+
+            out.write(header)
+            out.write(data)
+            out.flush()
 
 # ----------------------------
 # Frame-level feature extraction function
 # ----------------------------
 
-def extract_frame_features_from_pcap(pcap_path):
+def extract_frame_features_from_pcap(pcap_path, verbose=True):
     """
     Process a pcap file and extract frame-level features.
-    
+
+    The pcap is read in a single streaming pass (see pcap_frames.read_video_packets).
+
     Args:
         pcap_path: Path to the pcap file
+        verbose: Print progress bar and per-file details (disable in worker processes)
     
     Returns:
-        frame_features: numpy array of shape (num_frames, 8) containing:
-            - num_packets
-            - sum_packet_length
-            - packet_size_mean
-            - packet_size_std
-            - inter_arrival_time_mean
-            - inter_arrival_time_std
-            - start_index (index in data_frames list)
-            - end_index (index in data_frames list)
+        frame_features: numpy array of shape (num_frames, 8), see
+            pcap_frames.aggregate_frame_features
     """
-    # Load pcap file
-    packets = rdpcap(pcap_path)
-    
-    if len(packets) == 0:
-        raise RuntimeError(f"No packets found in {pcap_path}")
+    packets = read_video_packets(pcap_path, verbose=verbose)
+
+    if verbose:
+        print(f"  Found first video packet at timestamp: {packets.first_video_timestamp:.6f}, "
+              f"index: {packets.first_video_packet_index}")
+        print(f"  Processing {len(packets)} 802.11 data frames into {packets.num_frames} frames")
+        print("last relative timestamp, effective duration in sec:", packets.last_relative_timestamp)
+
+    return packets.frame_features()
+
+# ----------------------------
+# Live (streaming) feature extraction
+# ----------------------------
+
+def run_live(source, output_path=None, idle_timeout=FOLLOW_IDLE_TIMEOUT):
+    """
+    Print frame features of a capture that is still being written, one row per closed window.
+
+    Args:
+        source: "-" to read a pcap stream from stdin (e.g. tcpdump -U -w -),
+            otherwise the path of a pcap file that tcpdump is writing
+        output_path: Optional .npy path for all emitted rows once the capture ends
+        idle_timeout: Seconds without new data before a followed file is considered finished
+    """
+    if source == "-":
+        data_frames = iter_dot11_data_frames(sys.stdin.buffer)
     else:
-        print("len(packets) =", len(packets))
-    
-    # Find the first video transmission packet (802.11 data frame with larger size)
-    first_video_packet = None
-    first_video_timestamp = None
-    first_video_packet_index = None
-    
-    for idx, pkt in enumerate(packets):
-        # Check if it's an 802.11 data frame (type == 2)
-        if pkt.haslayer(Dot11):
-            dot11 = pkt[Dot11]
-            # Type 2 = Data frame
-            if dot11.type == 2:
-                packet_size = len(pkt)
-                if packet_size >= MIN_VIDEO_PACKET_SIZE:
-                    first_video_packet = pkt
-                    first_video_timestamp = float(pkt.time)
-                    first_video_packet_index = idx
-
-                    print()
-                    print()
-                    print("first packet: idx", idx)
-                    print("first packet:", pkt)
-                    print("first packet: pkt.time", pkt.time)
-                    print()
-                    print()
-
-                    break
-    
-    if first_video_packet is None:
-        raise RuntimeError(f"No video transmission packet found in {pcap_path}")
-    
-    print(f"  Found first video packet at timestamp: {first_video_timestamp:.6f}, index: {first_video_packet_index}")
-    
-    # Calculate frame time window
-    frame_duration = 1.0 / FPS  # seconds per frame
-    
-    # Collect all 802.11 data frames with their timestamps and sizes
-    data_frames = []
-    for idx, pkt in enumerate(tqdm(packets, desc="Collecting 802.11 data frames", leave=False)):
-        # Check if it's an 802.11 data frame
-        if pkt.haslayer(Dot11):
-            dot11 = pkt[Dot11]
-            if dot11.type == 2:  # Data frame
-                timestamp = float(pkt.time)
-                # Only consider packets after the first video packet
-                if timestamp >= first_video_timestamp:
-                    packet_size = len(pkt)
-                    data_frames.append({
-                        'timestamp': timestamp,
-                        'size': packet_size,
-                        'absolute_time': timestamp,
-                        'relative_time': timestamp - first_video_timestamp,
-                        'original_index': idx
-                    })
-    
-    if len(data_frames) == 0:
-        raise RuntimeError(f"No 802.11 data frames found after first video packet in {pcap_path}")
-    
-    # Determine number of frames based on the last packet timestamp
-    last_packet_time = data_frames[-1]['relative_time']
-    num_frames = int(np.ceil(last_packet_time / frame_duration))
-    
-    print(f"  Processing {len(data_frames)} 802.11 data frames into {num_frames} frames")    
-    print("last relative timestamp, effective duration in sec:", data_frames[-1]['absolute_time'] - first_video_timestamp)
+        data_frames = iter_dot11_data_frames(source, follow=True, idle_timeout=idle_timeout)
 
-    # ======== code is correct until here =========
+    rows = []
+    for frame_idx, features in stream_frame_features(data_frames):
+        print(frame_idx, *features.tolist(), sep="\t", flush=True)
+        if output_path is not None:
+            rows.append(features)
 
-    # Initialize feature array: (num_frames, 8)
-    # Features: [num_packets, sum_packet_length, packet_size_mean, packet_size_std, 
-    #            inter_arrival_time_mean, inter_arrival_time_std, start_index, end_index]
-    frame_features = np.zeros((num_frames, 8), dtype=np.float32)
-    
-    # Initialize frame buckets to store packets and track indices
-    frame_packets = [[] for _ in range(num_frames)]
-    frame_indices = [[] for _ in range(num_frames)]  # Track indices in data_frames list
-    
-    # Group packets into frame buckets
-    for i in tqdm(range(len(data_frames)), desc="Grouping packets into frames", leave=False):
-        pkt = data_frames[i]
-        relative_time = pkt['relative_time']
-        
-        # Determine which frame this packet belongs to
-        frame_idx = int(relative_time / frame_duration)
-        
-        # Ensure frame_idx is within bounds
-        if frame_idx >= num_frames:
-            frame_idx = num_frames - 1
-        
-        # Store packet info for this frame
-        frame_packets[frame_idx].append({
-            'size': pkt['size'],
-            'timestamp': pkt['timestamp']
-        })
-        # Track the index in data_frames list
-        frame_indices[frame_idx].append(pkt['original_index'])
-    
-    # Calculate features for each frame
-    for frame_idx in tqdm(range(num_frames), desc="Calculating frame features", leave=False):
-        frame_pkt_list = frame_packets[frame_idx]
-        frame_idx_list = frame_indices[frame_idx]
-        
-        if len(frame_pkt_list) == 0:
-            # No packets in this frame - all features are 0, indices are -1
-            frame_features[frame_idx] = [0, 0, 0, 0, 0, 0, -1, -1]
-        else:
-            # Extract packet sizes and timestamps
-            packet_sizes = [pkt['size'] for pkt in frame_pkt_list]
-            packet_timestamps = sorted([pkt['timestamp'] for pkt in frame_pkt_list])
-            
-            # Calculate features
-            num_packets = len(frame_pkt_list)
-            sum_packet_length = sum(packet_sizes)
-            packet_size_mean = np.mean(packet_sizes)
-            packet_size_std = np.std(packet_sizes) if len(packet_sizes) > 1 else 0.0
-            
-            # Calculate inter-arrival times
-            if len(packet_timestamps) > 1:
-                inter_arrival_times = np.diff(packet_timestamps)
-                inter_arrival_time_mean = np.mean(inter_arrival_times)
-                inter_arrival_time_std = np.std(inter_arrival_times)
-            else:
-                inter_arrival_time_mean = 0.0
-                inter_arrival_time_std = 0.0
-            
-            # Get start and end indices for this bucket
-            start_index = min(frame_idx_list) if frame_idx_list else -1
-            end_index = max(frame_idx_list) if frame_idx_list else -1
-            
-            frame_features[frame_idx] = [
-                num_packets,
-                sum_packet_length,
-                packet_size_mean,
-                packet_size_std,
-                inter_arrival_time_mean,
-                inter_arrival_time_std,
-                start_index,
-                end_index
-            ]
-    
-    return frame_features
+    if output_path is not None:
+        frame_features = np.stack(rows) if rows else np.zeros((0, 8), dtype=np.float32)
+        save_npy_atomic(output_path, frame_features)
+        print(f"Saved {len(frame_features)} frames to {output_path}", file=sys.stderr)
 
 # ----------------------------
 # Main processing function
 # ----------------------------
 
-def process_all_pcaps():
+def pcap_cache_params():
+    """Extraction settings that invalidate cached pcap features when they change."""
+    return {
+        "FPS": FPS,
+        "MIN_VIDEO_PACKET_SIZE": MIN_VIDEO_PACKET_SIZE,
+    }
+
+
+def process_pcap(pcap_path, output_dir):
+    """
+    Extract frame-level features for one pcap and save them as <name>_features.npy.
+
+    Runs inside a worker process, so it only returns a summary for the parent to print.
+    The source is hashed before extraction so the cache records the content that was read.
+
+    Returns:
+        (output_path, num_frames, total_packets, source_digest, source_stat)
     """
-    Process all pcap files in the pcaps directory sequentially.
+    pcap_name = Path(pcap_path).stem  # e.g., "camera_10"
+    source_stat = os.stat(pcap_path)
+    source_digest = file_digest(pcap_path)
+    frame_features = extract_frame_features_from_pcap(str(pcap_path), verbose=False)
+
+    output_path = os.path.join(output_dir, f"{pcap_name}_features.npy")
+    save_npy_atomic(output_path, frame_features)
+
+    num_frames = len(frame_features)
+    total_packets = int(np.sum(frame_features[:, 0]))  # Sum of num_packets column
+    return output_path, num_frames, total_packets, source_digest, source_stat
+
+
+def process_all_pcaps(pcaps_dir=PCAPS_DIR, output_dir=OUTPUT_DIR, workers=None, force=False):
+    """
+    Process all pcap files in the pcaps directory with a pool of worker processes.
     For each pcap, generate frame-level feature vectors.
+
+    Pcaps whose content and extraction parameters match the cache manifest in
+    output_dir are skipped; outputs of changed pcaps are invalidated and rebuilt.
+
+    Args:
+        pcaps_dir: Directory containing the *.pcap captures
+        output_dir: Directory for the <name>_features.npy outputs
+        workers: Number of worker processes (default: one per CPU, capped at the number of files)
+        force: Re-extract every pcap even if its cached features are up to date
+
+    Returns:
+        failed: list of pcap names that could not be processed
     """
     # Create output directory if it doesn't exist
-    os.makedirs(OUTPUT_DIR, exist_ok=True)
+    os.makedirs(output_dir, exist_ok=True)
     
     # Get all pcap files
-    pcap_dir = Path(PCAPS_DIR)
-    pcap_files = sorted(pcap_dir.glob("*.pcap"))
+    pcap_files = sorted(Path(pcaps_dir).glob("*.pcap"))
     
     if not pcap_files:
-        print(f"No pcap files found in {PCAPS_DIR}")
-        return
-    
-    print(f"Found {len(pcap_files)} pcap files to process.")
-    print(f"Using FPS: {FPS} (frame duration: {1.0/FPS:.4f} seconds)\n")
-    
-    # Process each pcap file sequentially
+        print(f"No pcap files found in {pcaps_dir}")
+        return []
+
+    cache = FeatureCache(output_dir, pcap_cache_params())
+    pending = []
     for pcap_path in pcap_files:
-        pcap_name = pcap_path.stem  # e.g., "camera_10"
-        print(f"Processing {pcap_name}...")
-        
-        try:
-            # Extract frame-level features
-            frame_features = extract_frame_features_from_pcap(str(pcap_path))
-            
-            # Save feature array as numpy file
-            output_path = os.path.join(OUTPUT_DIR, f"{pcap_name}_features.npy")
-            np.save(output_path, frame_features)
-            
-            # Print summary
-            num_frames = len(frame_features)
-            total_packets = int(np.sum(frame_features[:, 0]))  # Sum of num_packets column
-            avg_packets_per_frame = total_packets / num_frames if num_frames > 0 else 0
-            
-            print(f"  Completed: {num_frames} frames, {total_packets} total packets")
-            print(f"  Average packets per frame: {avg_packets_per_frame:.2f}")
-            print(f"  Saved to: {output_path}\n")
-            
-        except Exception as e:
-            print(f"  ERROR processing {pcap_name}: {e}\n")
-            import traceback
-            traceback.print_exc()
+        output_path = os.path.join(output_dir, f"{pcap_path.stem}_features.npy")
+        if not force and cache.is_fresh(pcap_path, output_path):
             continue
+        cache.invalidate(output_path)
+        pending.append(pcap_path)
+
+    print(f"Found {len(pcap_files)} pcap files, {len(pcap_files) - len(pending)} up to date in the cache.")
+    if not pending:
+        print("Nothing to do.")
+        return []
 
-        # TODO: remove
-        print("Exiting...")
-        sys.exit(0)
+    if workers is None:
+        workers = os.cpu_count() or 1
+    workers = max(1, min(workers, len(pending)))
     
-    print("All pcap files processed!")
+    print(f"Processing {len(pending)} pcap files with {workers} worker(s).")
+    print(f"Using FPS: {FPS} (frame duration: {1.0/FPS:.4f} seconds)\n")
+
+    failed = []
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(process_pcap, pcap_path, output_dir): pcap_path
+            for pcap_path in pending
+        }
+
+        with tqdm(total=len(futures), desc="Processing pcaps", unit="pcap") as pbar:
+            for future in as_completed(futures):
+                pcap_path = futures[future]
+                pcap_name = pcap_path.stem
+                try:
+                    output_path, num_frames, total_packets, source_digest, source_stat = future.result()
+                except Exception as e:
+                    failed.append(pcap_name)
+                    tqdm.write(f"  ERROR processing {pcap_name}: {e!r}")
+                else:
+                    cache.record(pcap_path, output_path, digest=source_digest, stat=source_stat)
+                    avg_packets_per_frame = total_packets / num_frames if num_frames > 0 else 0
+                    tqdm.write(
+                        f"  {pcap_name}: {num_frames} frames, {total_packets} total packets, "
+                        f"{avg_packets_per_frame:.2f} packets/frame -> {output_path}"
+                    )
+                pbar.update(1)
+
+    if failed:
+        print(f"\n{len(failed)} of {len(pending)} pcap files failed: {', '.join(sorted(failed))}")
+    else:
+        print("\nAll pcap files processed!")
+    return failed
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Extract frame-level features from pcap captures.")
+    parser.add_argument("--pcaps-dir", default=PCAPS_DIR, help=f"Directory of .pcap files (default: {PCAPS_DIR})")
+    parser.add_argument("--output-dir", default=OUTPUT_DIR, help=f"Output directory (default: {OUTPUT_DIR})")
+    parser.add_argument(
+        "-j", "--workers",
+        type=int,
+        default=None,
+        help="Number of worker processes (default: number of CPUs)",
+    )
+    parser.add_argument("--force", action="store_true", help="Ignore the feature cache and re-extract every pcap")
+
+    live = parser.add_argument_group("live mode")
+    live.add_argument(
+        "--live",
+        metavar="SOURCE",
+        help="Emit features while the capture is written: a growing pcap file, or '-' for a pcap stream on stdin",
+    )
+    live.add_argument("--live-output", help="Also save the live features to this .npy file when the capture ends")
+    live.add_argument(
+        "--idle-timeout",
+        type=float,
+        default=FOLLOW_IDLE_TIMEOUT,
+        help=f"Seconds without new packets before a followed pcap file ends (default: {FOLLOW_IDLE_TIMEOUT})",
+    )
+    live.add_argument("--replay", metavar="PCAP", help="Write PCAP to stdout at its recorded pace (for testing --live)")
+    live.add_argument("--speed", type=float, default=1.0, help="Replay speed multiplier (default: 1.0)")
+    return parser.parse_args()
 
 # ----------------------------
 # MAIN
 # ----------------------------
 
 if __name__ == "__main__":
-    process_all_pcaps()
-
+    args = parse_args()
+    if args.replay:
+        replay_pcap(args.replay, sys.stdout.buffer, args.speed)
+    elif args.live:
+        run_live(args.live, args.live_output, args.idle_timeout)
+    else:
+        failed = process_all_pcaps(args.pcaps_dir, args.output_dir, args.workers, args.force)
+        sys.exit(1 if failed else 0)
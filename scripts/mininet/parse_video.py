@@ -1,10 +1,15 @@
+import argparse
 import cv2
 import numpy as np
 from ultralytics import YOLO
 import os
+import queue
+import threading
 from pathlib import Path
 from tqdm import tqdm
 
+from feature_cache import FeatureCache, file_digest, save_npy_atomic
+
 # ----------------------------
 # CONFIG
 # ----------------------------
@@ -12,6 +17,12 @@ from tqdm import tqdm
 VIDEOS_DIR = "/home/ubuntu/M202A-CARLA/scripts/videos"
 YOLO_MODEL = "/home/ubuntu/M202A-CARLA/scripts/yolov8x.pt"   # COCO-pretrained
 CONF_THRESH = 0.5           # detection confidence threshold
+BATCH_SIZE = 8              # frames per YOLO forward pass (raise on GPU, 4-8 suits a CPU)
+
+# Gated labeling (--gated): only run YOLO on frames that changed since the last detector call
+MOTION_THUMB_SIZE = (160, 90)  # (width, height) of the grayscale thumbnail used for frame differencing
+MOTION_THRESH = 2.0            # mean absolute pixel change (0-255) that triggers the detector
+GATE_MAX_SKIP = 20             # always run the detector after this many skipped frames (1 s at 20 FPS)
 OUTPUT_DIR = "/home/ubuntu/M202A-CARLA/scripts/mininet/video_features"
 
 # COCO class IDs for vehicles (approx):
@@ -22,13 +33,121 @@ VEHICLE_CLASS_IDS = {2, 3, 5, 7}
 # Frame-level labeling function
 # ----------------------------
 
-def label_frames_with_yolo(video_path, model):
+def frame_has_vehicle(results):
+    """True if a YOLO result holds a vehicle detection with sufficient confidence."""
+    if results.boxes is None or len(results.boxes) == 0:
+        return False
+
+    classes = results.boxes.cls.cpu().numpy().astype(int)
+    confs = results.boxes.conf.cpu().numpy()
+
+    # Check if any detection is a vehicle with sufficient confidence
+    for cls_id, conf in zip(classes, confs):
+        if conf >= CONF_THRESH and cls_id in VEHICLE_CLASS_IDS:
+            return True
+    return False
+
+
+class MotionGate:
+    """
+    Decides per frame whether the detector has to run (gated labeling mode).
+
+    Each frame is shrunk to a small grayscale thumbnail and compared with the
+    thumbnail of the last frame the detector saw. The detector runs when the
+    mean absolute pixel change exceeds motion_thresh, or when max_skip frames
+    in a row were skipped; otherwise the previous label is carried forward.
+    """
+
+    def __init__(self, motion_thresh=MOTION_THRESH, max_skip=GATE_MAX_SKIP):
+        self.motion_thresh = motion_thresh
+        self.max_skip = max_skip
+        self.reference = None
+        self.skipped = 0
+        self.total_frames = 0
+        self.detector_frames = 0
+
+    def __call__(self, frame):
+        """Return True if frame needs a detector call."""
+        thumb = cv2.cvtColor(cv2.resize(frame, MOTION_THUMB_SIZE, interpolation=cv2.INTER_AREA), cv2.COLOR_BGR2GRAY)
+        self.total_frames += 1
+
+        needs_detector = (
+            self.reference is None
+            or self.skipped >= self.max_skip
+            or float(np.mean(cv2.absdiff(thumb, self.reference))) >= self.motion_thresh
+        )
+        if needs_detector:
+            self.reference = thumb
+            self.skipped = 0
+            self.detector_frames += 1
+        else:
+            self.skipped += 1
+        return needs_detector
+
+    def summary(self):
+        saved = self.total_frames - self.detector_frames
+        saved_pct = 100.0 * saved / self.total_frames if self.total_frames else 0.0
+        return (f"detector ran on {self.detector_frames}/{self.total_frames} frames "
+                f"({saved} calls saved, {saved_pct:.1f}%)")
+
+
+def decode_batches(cap, batch_size, batch_queue, gate=None, stop=None):
+    """
+    Read frames from cap and put batches of up to batch_size frames on batch_queue.
+
+    Runs on a background thread so decoding the next batch overlaps with
+    inference on the current one. Each batch is (frame_indices, frames,
+    frames_decoded); with a gate only the frames it selects are batched.
+    A None sentinel marks the end of the video; a decoding error is forwarded
+    to the consumer instead of a batch. Setting the stop event (a
+    threading.Event) ends decoding at the next frame.
+    """
+    if stop is None:
+        stop = threading.Event()
+
+    def put(item):
+        # Wait for room, but give up as soon as the consumer has stopped
+        while not stop.is_set():
+            try:
+                batch_queue.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    try:
+        indices, batch = [], []
+        frame_idx = 0
+        while not stop.is_set():
+            ret, frame = cap.read()
+            if not ret:
+                break
+            if gate is None or gate(frame):
+                indices.append(frame_idx)
+                batch.append(frame)
+            frame_idx += 1
+            if len(batch) == batch_size:
+                put((indices, batch, frame_idx))
+                indices, batch = [], []
+        put((indices, batch, frame_idx))
+    except Exception as e:
+        put(e)
+    finally:
+        put(None)
+
+
+def label_frames_with_yolo(video_path, model, batch_size=BATCH_SIZE, gate=None):
     """
     Process a video and label each frame as 0 (no car) or 1 (car present).
+
+    Frames are decoded on a background thread and passed to the model
+    batch_size at a time, one forward pass per batch.
     
     Args:
         video_path: Path to the video file
         model: YOLO model instance
+        batch_size: Number of frames per forward pass
+        gate: Optional MotionGate; frames it rejects skip the detector and
+            carry forward the label of the previous detected frame
     
     Returns:
         frame_labels: list[int] (0 or 1) of length num_frames
@@ -40,53 +159,124 @@ def label_frames_with_yolo(video_path, model):
     # Get total number of frames for progress bar
     total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
 
+    # None marks frames the gate skipped, filled in at the end
     frame_labels = []
 
-    # Use tqdm to show progress
-    with tqdm(total=total_frames, desc="Processing frames", unit="frame") as pbar:
-        while True:
-            ret, frame = cap.read()
-            if not ret:
-                break
+    # Keep at most two decoded batches waiting, to bound memory
+    batch_queue = queue.Queue(maxsize=2)
+    stop = threading.Event()
+    decoder = threading.Thread(target=decode_batches, args=(cap, batch_size, batch_queue, gate, stop), daemon=True)
+    decoder.start()
 
-            # Run YOLO on the frame
-            results = model(frame, verbose=False)[0]  # first result
+    try:
+        # Use tqdm to show progress
+        with tqdm(total=total_frames, desc="Processing frames", unit="frame") as pbar:
+            while True:
+                item = batch_queue.get()
+                if item is None:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                indices, batch, frames_decoded = item
 
-            has_vehicle = False
-            if results.boxes is not None and len(results.boxes) > 0:
-                classes = results.boxes.cls.cpu().numpy().astype(int)
-                confs = results.boxes.conf.cpu().numpy()
+                pbar.update(frames_decoded - len(frame_labels))
+                frame_labels.extend([None] * (frames_decoded - len(frame_labels)))
+                if not batch:
+                    continue
 
-                # Check if any detection is a vehicle with sufficient confidence
-                for cls_id, conf in zip(classes, confs):
-                    if conf >= CONF_THRESH and cls_id in VEHICLE_CLASS_IDS:
-                        has_vehicle = True
-                        break
+                # Run YOLO on the whole batch
+                results = model(batch, verbose=False)
+                for frame_idx, r in zip(indices, results):
+                    frame_labels[frame_idx] = 1 if frame_has_vehicle(r) else 0
+    finally:
+        # Stop the decoder (a no-op after a normal end) and drain the queue so it is not blocked on a put
+        stop.set()
+        while decoder.is_alive():
+            try:
+                batch_queue.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        decoder.join()
+        cap.release()
 
-            frame_labels.append(1 if has_vehicle else 0)
-            pbar.update(1)
+    # Carry labels forward over skipped frames (the gate always runs frame 0)
+    for frame_idx in range(1, len(frame_labels)):
+        if frame_labels[frame_idx] is None:
+            frame_labels[frame_idx] = frame_labels[frame_idx - 1]
 
-    cap.release()
     return frame_labels
 
+
+def compare_gated_labels(video_path, model, batch_size=BATCH_SIZE, motion_thresh=MOTION_THRESH,
+                         max_skip=GATE_MAX_SKIP):
+    """
+    Label a video with and without the motion gate and report how well they agree.
+
+    Returns:
+        dict with frame count, detector calls, agreement and the gated
+        labels' missed/extra car frames relative to full labeling
+    """
+    full = np.array(label_frames_with_yolo(video_path, model, batch_size), dtype=np.int8)
+    gate = MotionGate(motion_thresh, max_skip)
+    gated = np.array(label_frames_with_yolo(video_path, model, batch_size, gate), dtype=np.int8)
+
+    n = min(len(full), len(gated))
+    full, gated = full[:n], gated[:n]
+    return {
+        "frames": n,
+        "detector_frames": gate.detector_frames,
+        "calls_saved_pct": 100.0 * (1 - gate.detector_frames / n) if n else 0.0,
+        "agreement_pct": 100.0 * float(np.mean(full == gated)) if n else 100.0,
+        "missed_car_frames": int(np.sum((full == 1) & (gated == 0))),
+        "extra_car_frames": int(np.sum((full == 0) & (gated == 1))),
+    }
+
 # ----------------------------
 # Main processing function
 # ----------------------------
 
-def process_all_videos():
+def video_cache_params(weights_digest, gated=False, motion_thresh=MOTION_THRESH, max_skip=GATE_MAX_SKIP):
     """
-    Process all videos in the videos directory sequentially.
-    For each video, generate a feature vector (0/1 per frame) indicating car presence.
+    Labeling settings that invalidate cached video labels when they change.
+
+    The detector is keyed by weights_digest, the file_digest of the weights
+    file, so replacing the weights at the same path rebuilds the labels.
     """
-    # Create output directory if it doesn't exist
-    os.makedirs(OUTPUT_DIR, exist_ok=True)
-    
-    # Load YOLO model once
+    params = {
+        "YOLO_WEIGHTS_SHA256": weights_digest,
+        "CONF_THRESH": CONF_THRESH,
+        "VEHICLE_CLASS_IDS": sorted(VEHICLE_CLASS_IDS),
+    }
+    if gated:
+        params["GATE"] = {
+            "MOTION_THUMB_SIZE": list(MOTION_THUMB_SIZE),
+            "MOTION_THRESH": motion_thresh,
+            "GATE_MAX_SKIP": max_skip,
+        }
+    return params
+
+
+def load_yolo_model():
     print(f"Loading YOLO model from {YOLO_MODEL}...")
     model = YOLO(YOLO_MODEL)
     # model.to("cuda:0")
     print("Model loaded successfully.")
     print("device:", model.device)
+    return model
+
+
+def process_all_videos(force=False, batch_size=BATCH_SIZE, gated=False, motion_thresh=MOTION_THRESH,
+                       max_skip=GATE_MAX_SKIP):
+    """
+    Process all videos in the videos directory sequentially.
+    For each video, generate a feature vector (0/1 per frame) indicating car presence.
+
+    Videos whose content and labeling parameters match the cache manifest in
+    OUTPUT_DIR are skipped; labels of changed videos are invalidated and rebuilt.
+    With gated=True the detector only runs on frames selected by a MotionGate.
+    """
+    # Create output directory if it doesn't exist
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
     
     # Get all video files
     video_dir = Path(VIDEOS_DIR)
@@ -95,26 +285,56 @@ def process_all_videos():
     if not video_files:
         print(f"No video files found in {VIDEOS_DIR}")
         return
-    
-    print(f"Found {len(video_files)} video files to process.\n")
+
+    model = None
+    weights_path = Path(YOLO_MODEL)
+    if not weights_path.exists():
+        # Ultralytics downloads missing weights on load, hash the file it resolved to
+        model = load_yolo_model()
+        weights_path = Path(model.ckpt_path)
+    weights_digest = file_digest(weights_path.resolve())
+    cache = FeatureCache(OUTPUT_DIR, video_cache_params(weights_digest, gated, motion_thresh, max_skip))
+    pending = []
+    for video_path in video_files:
+        output_path = os.path.join(OUTPUT_DIR, f"{video_path.stem}_features.npy")
+        if not force and cache.is_fresh(video_path, output_path):
+            continue
+        cache.invalidate(output_path)
+        pending.append(video_path)
+
+    print(f"Found {len(video_files)} video files, {len(video_files) - len(pending)} up to date in the cache.\n")
+    if not pending:
+        print("Nothing to do.")
+        return
+
+    # Load YOLO model once
+    if model is None:
+        model = load_yolo_model()
     
     # Process each video sequentially
-    for video_path in video_files:
+    for video_path in pending:
         video_name = video_path.stem  # e.g., "camera_1"
         print(f"Processing {video_name}...")
         
         try:
+            source_stat = os.stat(video_path)
+            source_digest = file_digest(video_path)
+
             # Get frame-level labels
-            frame_labels = label_frames_with_yolo(str(video_path), model)
+            gate = MotionGate(motion_thresh, max_skip) if gated else None
+            frame_labels = label_frames_with_yolo(str(video_path), model, batch_size, gate)
             
             # Save feature vector as numpy array
             output_path = os.path.join(OUTPUT_DIR, f"{video_name}_features.npy")
-            np.save(output_path, np.array(frame_labels, dtype=np.int8))
+            save_npy_atomic(output_path, np.array(frame_labels, dtype=np.int8))
+            cache.record(video_path, output_path, digest=source_digest, stat=source_stat)
             
             # Print summary
             num_frames = len(frame_labels)
             num_frames_with_cars = sum(frame_labels)
             print(f"  Completed: {num_frames} frames total, {num_frames_with_cars} frames with cars")
+            if gate is not None:
+                print(f"  Gating: {gate.summary()}")
             print(f"  Saved to: {output_path}\n")
             
         except Exception as e:
@@ -123,10 +343,75 @@ def process_all_videos():
     
     print("All videos processed!")
 
+
+def report_gating(video_paths, batch_size=BATCH_SIZE, motion_thresh=MOTION_THRESH, max_skip=GATE_MAX_SKIP):
+    """Print how gated labeling compares with full labeling on the given videos (nothing is saved)."""
+    if not video_paths:
+        video_paths = sorted(Path(VIDEOS_DIR).glob("*.mp4"))
+    model = load_yolo_model()
+
+    total_frames = total_calls = total_agree = 0
+    for video_path in video_paths:
+        print(f"Comparing {Path(video_path).stem}...")
+        stats = compare_gated_labels(str(video_path), model, batch_size, motion_thresh, max_skip)
+        print(
+            f"  {stats['frames']} frames | detector calls {stats['detector_frames']} "
+            f"({stats['calls_saved_pct']:.1f}% saved) | agreement {stats['agreement_pct']:.2f}% "
+            f"| missed car frames {stats['missed_car_frames']} | extra car frames {stats['extra_car_frames']}\n"
+        )
+        total_frames += stats["frames"]
+        total_calls += stats["detector_frames"]
+        total_agree += round(stats["agreement_pct"] * stats["frames"] / 100.0)
+
+    if total_frames:
+        print(
+            f"Overall: {total_frames} frames, {100.0 * (1 - total_calls / total_frames):.1f}% detector calls saved, "
+            f"{100.0 * total_agree / total_frames:.2f}% agreement with full labeling"
+        )
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Label video frames with YOLO car presence.")
+    parser.add_argument("--force", action="store_true", help="Ignore the feature cache and relabel every video")
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=BATCH_SIZE,
+        help=f"Frames per YOLO forward pass (default: {BATCH_SIZE})",
+    )
+    parser.add_argument(
+        "--gated",
+        action="store_true",
+        help="Only run YOLO on frames with motion since the last detector call and carry labels forward",
+    )
+    parser.add_argument(
+        "--motion-thresh",
+        type=float,
+        default=MOTION_THRESH,
+        help=f"Mean absolute pixel change that triggers the detector (default: {MOTION_THRESH})",
+    )
+    parser.add_argument(
+        "--max-skip",
+        type=int,
+        default=GATE_MAX_SKIP,
+        help=f"Run the detector at least every N frames in gated mode (default: {GATE_MAX_SKIP})",
+    )
+    parser.add_argument(
+        "--compare-gating",
+        nargs="*",
+        metavar="VIDEO",
+        help="Label VIDEOs (default: all in the videos directory) with and without gating and report agreement",
+    )
+    return parser.parse_args()
+
 # ----------------------------
 # MAIN
 # ----------------------------
 
 if __name__ == "__main__":
-    process_all_videos()
+    args = parse_args()
+    if args.compare_gating is not None:
+        report_gating(args.compare_gating, args.batch_size, args.motion_thresh, args.max_skip)
+    else:
+        process_all_videos(args.force, args.batch_size, args.gated, args.motion_thresh, args.max_skip)
 
@@ -0,0 +1,238 @@
+"""
+End-to-end encrypted-camera detection: pcap in, car events out.
+
+Replaces the parse_pcap.py -> preprocess_infer.py -> infer.py chain (and its
+intermediate .npy/.txt files) with one in-memory pass per capture:
+
+1. read      stream the pcap's 802.11 data frames from the first video packet on
+2. features  bucket them into the 8 per-frame features (same as parse_pcap.py)
+3. normalize trim, column selection and training stats from the checkpoint
+4. infer     overlap-averaged BiLSTM probabilities per frame
+5. events    threshold, merge nearby runs, drop short ones
+
+The model is loaded once for all captures. Each camera's events are written to
+<output_dir>/<pcap stem>_events.json as compact records
+{"frame", "start_frame", "end_frame", "score"}, with frame numbers counted
+from the first video packet (the trimmed frames included) and "frame" the
+middle of the event, like the edge events of parse_edge_events.py.
+
+    python pipeline.py pcaps/camera_25.pcap pcaps/camera_26.pcap --output-dir events/
+    python pipeline.py --pcaps-dir pcaps/
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import sys
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, List, Sequence
+
+import numpy as np
+
+from infer import DEFAULT_MODEL_PATH, load_model, predict_frames, prepare_features
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from pcap_frames import read_video_packets
+
+DEFAULT_OUTPUT_DIR = Path(__file__).resolve().parent / "pcap_events"
+EVENT_THRESHOLD = 0.5  # car-present probability a frame needs to count as a detection
+EVENT_MERGE_GAP = 30  # detection runs fewer than this many frames apart form one event
+EVENT_MIN_FRAMES = 10  # events shorter than this (after merging) are dropped
+
+STAGES = ("read", "features", "normalize", "infer", "events")
+
+
+@dataclass
+class PipelineResult:
+    camera: str
+    num_frames: int
+    events: List[dict]
+    timings: Dict[str, float] = field(default_factory=dict)
+
+
+def probabilities_to_events(
+    probs: np.ndarray,
+    threshold: float = EVENT_THRESHOLD,
+    merge_gap: int = EVENT_MERGE_GAP,
+    min_frames: int = EVENT_MIN_FRAMES,
+    frame_offset: int = 0,
+) -> List[dict]:
+    """
+    Car events from per-frame probabilities.
+
+    Frames at or above threshold form runs; runs less than merge_gap frames
+    apart are merged and events shorter than min_frames are dropped. score is
+    the peak probability of the event. frame_offset is added to every frame.
+    """
+    detected = np.concatenate(([False], probs >= threshold, [False]))
+    edges = np.flatnonzero(np.diff(detected.astype(np.int8)))
+    # rising edges are run starts, falling edges are one past run ends
+    starts, stops = edges[0::2], edges[1::2]
+    if len(starts) == 0:
+        return []
+
+    keep = np.concatenate(([True], starts[1:] - stops[:-1] >= merge_gap))
+    starts = starts[keep]
+    stops = np.append(stops[np.flatnonzero(keep)[1:] - 1], stops[-1])
+    long_enough = stops - starts >= min_frames
+
+    events = []
+    for start, stop in zip(starts[long_enough], stops[long_enough]):
+        events.append({
+            "frame": int((start + stop - 1) // 2 + frame_offset),
+            "start_frame": int(start + frame_offset),
+            "end_frame": int(stop - 1 + frame_offset),
+            "score": round(float(probs[start:stop].max()), 3),
+        })
+    return events
+
+
+class EventPipeline:
+    """The model and event settings shared by every capture run through it."""
+
+    def __init__(
+        self,
+        model_path: Path = DEFAULT_MODEL_PATH,
+        threshold: float = EVENT_THRESHOLD,
+        merge_gap: int = EVENT_MERGE_GAP,
+        min_frames: int = EVENT_MIN_FRAMES,
+    ):
+        if not model_path.exists():
+            raise FileNotFoundError(f"Model checkpoint not found: {model_path}")
+        self.model, self.meta = load_model(model_path)
+        if "preprocessing" not in self.meta:
+            raise ValueError(
+                f"{model_path} does not record its feature preprocessing; retrain it with model.py "
+                "so raw pcap features can be normalized as in training."
+            )
+        self.threshold = threshold
+        self.merge_gap = merge_gap
+        self.min_frames = min_frames
+
+    def run(self, pcap_path: Path) -> PipelineResult:
+        timings: Dict[str, float] = {}
+        stage_start = time.perf_counter()
+
+        def lap(stage: str) -> None:
+            nonlocal stage_start
+            now = time.perf_counter()
+            timings[stage] = now - stage_start
+            stage_start = now
+
+        packets = read_video_packets(str(pcap_path), verbose=False)
+        lap("read")
+        features = packets.frame_features()
+        lap("features")
+        min_frames = self.meta["preprocessing"]["trim"] + self.meta["window_size"]
+        if len(features) < min_frames:
+            raise ValueError(f"{len(features)} frames, need at least {min_frames} (trim + one window)")
+        inputs = prepare_features(features, self.meta)
+        lap("normalize")
+        probs = predict_frames(self.model, inputs, self.meta["window_size"])
+        lap("infer")
+        events = probabilities_to_events(
+            probs[:, 0],
+            self.threshold,
+            self.merge_gap,
+            self.min_frames,
+            frame_offset=self.meta["preprocessing"]["trim"],
+        )
+        lap("events")
+        return PipelineResult(Path(pcap_path).stem, len(features), events, timings)
+
+
+def run_pipeline(
+    pcap_paths: Sequence[Path],
+    output_dir: Path | None = DEFAULT_OUTPUT_DIR,
+    model_path: Path = DEFAULT_MODEL_PATH,
+    threshold: float = EVENT_THRESHOLD,
+    merge_gap: int = EVENT_MERGE_GAP,
+    min_frames: int = EVENT_MIN_FRAMES,
+) -> List[PipelineResult]:
+    """
+    Run every capture through one EventPipeline and print per-stage timings.
+
+    Events are written per camera under output_dir (skipped if None). A capture
+    that fails is reported and left out of the results.
+    """
+    load_start = time.perf_counter()
+    pipeline = EventPipeline(model_path, threshold, merge_gap, min_frames)
+    print(f"Loaded {model_path.name} in {time.perf_counter() - load_start:.3f} s")
+    if output_dir is not None:
+        output_dir.mkdir(parents=True, exist_ok=True)
+
+    print(f"{'camera':<20} {'frames':>7} {'events':>6} " + " ".join(f"{stage:>9}" for stage in STAGES) + f" {'total':>9}")
+    results = []
+    for pcap_path in pcap_paths:
+        try:
+            result = pipeline.run(pcap_path)
+        except Exception as e:
+            print(f"{Path(pcap_path).stem:<20} ERROR: {e!r}")
+            continue
+        results.append(result)
+
+        if output_dir is not None:
+            with open(output_dir / f"{result.camera}_events.json", "w") as f:
+                json.dump(result.events, f)
+        stage_times = " ".join(f"{result.timings[stage]:>8.3f}s" for stage in STAGES)
+        print(f"{result.camera:<20} {result.num_frames:>7} {len(result.events):>6} {stage_times} "
+              f"{sum(result.timings.values()):>8.3f}s")
+
+    if results:
+        totals = " ".join(f"{sum(r.timings[stage] for r in results):>8.3f}s" for stage in STAGES)
+        total_frames = sum(r.num_frames for r in results)
+        total_events = sum(len(r.events) for r in results)
+        print(f"{'total':<20} {total_frames:>7} {total_events:>6} {totals} "
+              f"{sum(sum(r.timings.values()) for r in results):>8.3f}s")
+    if output_dir is not None:
+        print(f"Events written to {output_dir}")
+    return results
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Detect cars from encrypted camera captures: pcap -> events.")
+    parser.add_argument("pcaps", type=Path, nargs="*", help="pcap files to process.")
+    parser.add_argument("--pcaps-dir", type=Path, help="Also process every *.pcap in this directory.")
+    parser.add_argument(
+        "--output-dir",
+        type=Path,
+        default=DEFAULT_OUTPUT_DIR,
+        help=f"Directory for the <camera>_events.json files (default: {DEFAULT_OUTPUT_DIR}).",
+    )
+    parser.add_argument("--no-output", action="store_true", help="Only print the summary, write no files.")
+    parser.add_argument(
+        "--model-path",
+        type=Path,
+        default=DEFAULT_MODEL_PATH,
+        help=f"Checkpoint or exported model (default: {DEFAULT_MODEL_PATH}).",
+    )
+    parser.add_argument("--threshold", type=float, default=EVENT_THRESHOLD,
+                        help=f"Car-present probability threshold (default: {EVENT_THRESHOLD}).")
+    parser.add_argument("--merge-gap", type=int, default=EVENT_MERGE_GAP,
+                        help=f"Merge detection runs closer than this many frames (default: {EVENT_MERGE_GAP}).")
+    parser.add_argument("--min-frames", type=int, default=EVENT_MIN_FRAMES,
+                        help=f"Drop events shorter than this many frames (default: {EVENT_MIN_FRAMES}).")
+    args = parser.parse_args()
+    if not args.pcaps and args.pcaps_dir is None:
+        parser.error("give pcap files and/or --pcaps-dir")
+    return args
+
+
+def main() -> None:
+    args = parse_args()
+    pcap_paths = list(args.pcaps)
+    if args.pcaps_dir is not None:
+        pcap_paths += sorted(args.pcaps_dir.glob("*.pcap"))
+
+    output_dir = None if args.no_output else args.output_dir
+    results = run_pipeline(pcap_paths, output_dir, args.model_path, args.threshold, args.merge_gap, args.min_frames)
+    if len(results) < len(pcap_paths):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,14 @@
+"""
+Standardize one capture's features with its own mean/std, for checkpoints
+trained before model.py recorded its preprocessing. Newer checkpoints carry
+the column selection, trim and training stats, and infer.py takes raw
+parse_pcap output directly.
+"""
 import numpy as np
 from pathlib import Path
 from typing import Dict
 
+from runtime import FEATURE_COLUMNS, TRIM_ROWS
 
 PCAP_FEATURES_PATH = "/home/ubuntu/M202A-CARLA/scripts/mininet/test_pcap_features/TEST_camera_25_features.npy"
 OUTPUT_PATH = "/home/ubuntu/M202A-CARLA/scripts/mininet/test_pcap_features/TEST_camera_25_features_processed.npy"
@@ -10,11 +17,11 @@ def preprocess_feature() -> None:
 
     pcap = np.load(PCAP_FEATURES_PATH)
 
-    X = pcap[:, (0,1,3)] # pkt count, total pkt size, pkt std dev
+    X = pcap[:, FEATURE_COLUMNS] # pkt count, total pkt size, pkt std dev
     print(f"X shape {X.shape}")
 
     # get rid of networking noise at the beginning
-    X = X[500:]
+    X = X[TRIM_ROWS:]
 
     # Standardize X: zero mean and unit variance
     X = (X - X.mean(axis=0)) / X.std(axis=0)
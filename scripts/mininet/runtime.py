@@ -0,0 +1,176 @@
+"""
+Torch-free inference runtime for the BiLSTM regressor.
+
+Everything between raw parse_pcap features and per-frame probabilities that
+does not need the model itself, on numpy alone: the feature column selection
+and trim (also used by build_dataset.py and preprocess_infer.py), the
+recorded feature preprocessing, stride-1 windows and the overlap average.
+`OnnxModel` adds onnxruntime, so an ONNX export from `model.py export` runs
+without torch or any of model.py's training code installed.
+
+A model here is any callable from a (batch, window, input_dim) float32 array
+to a (batch, window, output_dim) array: OnnxModel, or bilstm.TorchModel for
+.pt checkpoints and TorchScript exports. infer.py picks one by file suffix.
+"""
+
+from __future__ import annotations
+
+import json
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable, Tuple
+
+import numpy as np
+
+FEATURE_COLUMNS = (0, 1, 3)  # parse_pcap frame features used: pkt count, total pkt size, pkt std dev
+TRIM_ROWS = 500  # leading frames dropped from every capture (networking noise at the start)
+EXPORT_META_KEY = "meta.json"  # TorchScript extra file / ONNX metadata entry with the model meta
+
+WindowModel = Callable[[np.ndarray], np.ndarray]
+
+
+@dataclass
+class FeaturePreprocessing:
+    """
+    How raw parse_pcap frame features become model inputs.
+
+    Drop the first trim frames, keep columns, standardize with the training
+    mean/std. Stored in the checkpoint as a plain dict (to_dict/from_dict).
+    """
+
+    columns: Tuple[int, ...]
+    trim: int
+    mean: np.ndarray
+    std: np.ndarray
+
+    def transform(self, raw: np.ndarray) -> np.ndarray:
+        """Selected, standardized float32 columns of raw feature rows (no trim)."""
+        if raw.ndim != 2 or raw.shape[1] <= max(self.columns):
+            raise ValueError(
+                f"Expected raw parse_pcap features with more than {max(self.columns)} columns, "
+                f"got shape {raw.shape}."
+            )
+        features = raw[:, list(self.columns)].astype(np.float32)
+        features -= self.mean
+        features /= self.std
+        return features
+
+    def apply(self, raw: np.ndarray) -> np.ndarray:
+        """Model inputs for a whole raw feature sequence, in one pass."""
+        return self.transform(raw[self.trim :])
+
+    def to_dict(self) -> dict:
+        return {
+            "columns": list(self.columns),
+            "trim": self.trim,
+            "mean": [float(v) for v in self.mean],
+            "std": [float(v) for v in self.std],
+        }
+
+    @classmethod
+    def from_dict(cls, values: dict) -> "FeaturePreprocessing":
+        return cls(
+            columns=tuple(values["columns"]),
+            trim=int(values["trim"]),
+            mean=np.asarray(values["mean"], dtype=np.float32),
+            std=np.asarray(values["std"], dtype=np.float32),
+        )
+
+
+def fit_input_dim(features: np.ndarray, expected_in: int) -> np.ndarray:
+    """Truncate or zero-pad feature columns to the model's input dimension."""
+    current_in = features.shape[1]
+    if current_in > expected_in:
+        print(
+            f"Feature dimension {current_in} larger than model input {expected_in}. "
+            "Truncating to fit the model."
+        )
+        features = features[:, :expected_in]
+    elif current_in < expected_in:
+        print(
+            f"Feature dimension {current_in} smaller than model input {expected_in}. "
+            "Zero padding the missing channels."
+        )
+        pad_width = expected_in - current_in
+        features = np.pad(features, ((0, 0), (0, pad_width)), mode="constant")
+    return features
+
+
+def prepare_features(features: np.ndarray, meta: dict) -> np.ndarray:
+    """
+    Model inputs from a feature array.
+
+    If the checkpoint records its preprocessing, features is raw parse_pcap
+    output and is trimmed, column-selected and standardized with the training
+    stats in one pass. Older checkpoints take features already processed by
+    preprocess_infer.py, fitted to the model's input size.
+    """
+    if features.ndim == 1:
+        features = features[:, None]
+    if "preprocessing" in meta:
+        return FeaturePreprocessing.from_dict(meta["preprocessing"]).apply(features)
+    return fit_input_dim(features, meta["input_dim"])
+
+
+def build_windows(sequence: np.ndarray, window_size: int) -> np.ndarray:
+    """Slice numpy array into overlapping windows (stride 1)."""
+    seq_len = len(sequence)
+    if seq_len < window_size:
+        raise ValueError(
+            f"Sequence length {seq_len} shorter than window size {window_size}."
+        )
+
+    # (num_windows, features, window) view -> (num_windows, window, features), copied once
+    windows = np.lib.stride_tricks.sliding_window_view(sequence, window_size, axis=0)
+    return np.array(windows.transpose(0, 2, 1), dtype=np.float32, order="C")
+
+
+def overlap_average(preds: np.ndarray, seq_len: int, window_size: int) -> np.ndarray:
+    """
+    Average overlapping window predictions back to the original sequence length.
+
+    preds holds one (window_size, output_dim) prediction per stride-1 window.
+    Timestep k of every window lands on frames k .. k + num_windows - 1, so the
+    sums take one vectorized add per timestep, and the number of windows
+    covering each frame has a closed form.
+    """
+    num_windows, _, output_dim = preds.shape
+    if num_windows + window_size - 1 != seq_len:
+        raise ValueError(
+            f"{num_windows} windows of size {window_size} do not cover a sequence of length {seq_len}."
+        )
+
+    sums = np.zeros((seq_len, output_dim), dtype=np.float32)
+    for k in range(window_size):
+        sums[k : k + num_windows] += preds[:, k]
+
+    # Frame t is covered by the windows starting in [max(0, t - window + 1), min(t, num_windows - 1)]
+    frames = np.arange(seq_len)
+    counts = (
+        np.minimum(frames, num_windows - 1)
+        - np.maximum(frames - window_size + 1, 0)
+        + 1
+    )
+    return sums / counts[:, None].astype(np.float32)
+
+
+def predict_frames(model: WindowModel, features: np.ndarray, window_size: int) -> np.ndarray:
+    """Per-frame probabilities in [0, 1] for prepared features, one row per input row."""
+    preds = model(build_windows(features, window_size))
+    averaged = overlap_average(preds, seq_len=len(features), window_size=window_size)
+    return np.clip(averaged, 0.0, 1.0)
+
+
+class OnnxModel:
+    """An exported .onnx model run by onnxruntime on the CPU; meta is read from the file."""
+
+    def __init__(self, model_path: Path):
+        import onnxruntime
+
+        self.session = onnxruntime.InferenceSession(str(model_path), providers=["CPUExecutionProvider"])
+        self.input_name = self.session.get_inputs()[0].name
+        self.meta = json.loads(self.session.get_modelmeta().custom_metadata_map[EXPORT_META_KEY])
+
+    def __call__(self, windows: np.ndarray) -> np.ndarray:
+        inputs = np.asarray(windows, dtype=np.float32)
+        return self.session.run(None, {self.input_name: inputs})[0]
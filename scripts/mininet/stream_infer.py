@@ -0,0 +1,225 @@
+"""
+Online (streaming) inference with the trained BiLSTM regressor.
+
+`infer.py` scores a complete feature file. `StreamingPredictor` instead takes
+one feature row at a time, keeps a ring buffer of the last WINDOW_SIZE rows,
+runs the model once per row on the window ending at that row, and emits each
+frame's car-present probability after a fixed lookahead of L frames.
+
+The bidirectional model needs right context, so frame t is emitted once the
+window ending at t + L has been scored, averaging every window seen so far
+that covers t. With L = WINDOW_SIZE - 1 (the default) that is every window
+covering t, and the output is the same as infer.py's overlap average; a
+smaller L trades accuracy for delay (L = 0 uses only the last timestep of the
+newest window). Nothing can be scored before the first WINDOW_SIZE rows; after
+that every frame is emitted exactly L rows after it arrives. Work per row is
+one forward pass on a single window, so the per-frame latency is constant; it
+is measured on every push.
+
+Replay a feature file as if it were arriving live:
+    python stream_infer.py --feature-path camera_25_features.npy --lookahead 4
+"""
+
+from __future__ import annotations
+
+import argparse
+import time
+from collections import deque
+from pathlib import Path
+from typing import List, Tuple
+
+import numpy as np
+
+from infer import DEFAULT_MODEL_PATH, load_model, prepare_features
+from runtime import WindowModel
+
+LATENCY_HISTORY = 10_000  # most recent per-row latencies kept for percentiles
+
+
+class LatencyStats:
+    """Running latency summary with percentiles over a bounded recent history."""
+
+    def __init__(self, history: int = LATENCY_HISTORY):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.recent: deque = deque(maxlen=history)
+
+    def add(self, seconds: float) -> None:
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        self.recent.append(seconds)
+
+    def summary(self) -> str:
+        if not self.count:
+            return "no rows"
+        recent_ms = np.asarray(self.recent) * 1000
+        return (
+            f"{self.count} rows | mean {self.total / self.count * 1000:.3f} ms "
+            f"| p50 {np.percentile(recent_ms, 50):.3f} ms "
+            f"| p99 {np.percentile(recent_ms, 99):.3f} ms "
+            f"| max {self.max * 1000:.3f} ms"
+        )
+
+
+class StreamingPredictor:
+    """
+    Per-frame probabilities from a stream of feature rows with a fixed lookahead.
+
+    push(row) returns the (frame_idx, probabilities) pairs that became final
+    with that row; flush() returns the rest once the stream has ended.
+    push is append (buffer the row, get its window) + a forward pass + accept
+    (fold the predictions in); callers scoring many streams together can run
+    the forward pass themselves on a batch of appended windows.
+    """
+
+    def __init__(self, model: WindowModel, window_size: int, input_dim: int, lookahead: int | None = None):
+        if lookahead is None:
+            lookahead = window_size - 1
+        if not 0 <= lookahead < window_size:
+            raise ValueError(f"lookahead must be in [0, {window_size - 1}], got {lookahead}")
+
+        self.model = model
+        self.window_size = window_size
+        self.lookahead = lookahead
+
+        # Every row is written twice, W apart, so the last W rows are always
+        # one contiguous slice of the buffer
+        self.rows = np.zeros((2 * window_size, input_dim), dtype=np.float32)
+        # Prediction sums/counts of the last W frames, frame t at slot t % W
+        self.sums: np.ndarray | None = None
+        self.counts = np.zeros(window_size, dtype=np.float32)
+        self.window_offsets = np.arange(window_size)
+
+        self.num_rows = 0
+        self.next_emit = 0
+        self.latency = LatencyStats()
+
+    def _emit(self, frame: int) -> Tuple[int, np.ndarray]:
+        slot = frame % self.window_size
+        return frame, np.clip(self.sums[slot] / self.counts[slot], 0.0, 1.0)
+
+    def append(self, row: np.ndarray) -> np.ndarray | None:
+        """
+        Add a row to the ring buffer and return the window ending at it, or None
+        before the first WINDOW_SIZE rows. The window is a view of the buffer
+        and has to be scored before the next append.
+        """
+        window_size = self.window_size
+        t = self.num_rows
+        self.rows[t % window_size] = row
+        self.rows[t % window_size + window_size] = row
+        self.num_rows += 1
+        if self.num_rows < window_size:
+            return None
+        first = (t + 1) % window_size
+        return self.rows[first : first + window_size]
+
+    def unappend(self) -> None:
+        """Drop the last appended row when its window could not be scored (before accept)."""
+        self.num_rows -= 1
+
+    def accept(self, preds: np.ndarray) -> List[Tuple[int, np.ndarray]]:
+        """Fold the (window_size, output_dim) predictions of the last window in and emit final frames."""
+        window_size = self.window_size
+        t = self.num_rows - 1
+        preds = np.asarray(preds, dtype=np.float32)
+        if self.sums is None:
+            self.sums = np.zeros((window_size, preds.shape[-1]), dtype=np.float32)
+        # Slot of frame t held frame t - W, which has been emitted already
+        self.sums[t % window_size] = 0
+        self.counts[t % window_size] = 0
+        slots = (self.window_offsets + (t + 1)) % window_size
+        self.sums[slots] += preds
+        self.counts[slots] += 1
+
+        emitted = []
+        while self.next_emit <= t - self.lookahead:
+            emitted.append(self._emit(self.next_emit))
+            self.next_emit += 1
+        return emitted
+
+    def push(self, row: np.ndarray) -> List[Tuple[int, np.ndarray]]:
+        start_time = time.perf_counter()
+        emitted = []
+        window = self.append(row)
+        if window is not None:
+            preds = self.model(window[None])[0]
+            emitted = self.accept(preds)
+        self.latency.add(time.perf_counter() - start_time)
+        return emitted
+
+    def flush(self) -> List[Tuple[int, np.ndarray]]:
+        """Emit the frames still waiting for lookahead at the end of the stream."""
+        if self.num_rows < self.window_size:
+            return []
+        emitted = [self._emit(frame) for frame in range(self.next_emit, self.num_rows)]
+        self.next_emit = self.num_rows
+        return emitted
+
+
+def replay_features(feature_path: Path, output_path: Path, model_path: Path, lookahead: int | None) -> None:
+    """Feed a feature file row by row through StreamingPredictor, as if it were live."""
+    model, meta = load_model(model_path)
+    features = prepare_features(np.load(feature_path, mmap_mode="r"), meta)
+
+    predictor = StreamingPredictor(model, meta["window_size"], meta["input_dim"], lookahead)
+    print(f"Streaming {len(features)} rows, lookahead {predictor.lookahead} frames")
+
+    outputs = []
+    for row in features:
+        outputs.extend(probs for _, probs in predictor.push(row))
+    outputs.extend(probs for _, probs in predictor.flush())
+
+    print(f"Per-row latency: {predictor.latency.summary()}")
+    if not outputs:
+        raise ValueError(f"Sequence length {len(features)} shorter than window size {meta['window_size']}.")
+
+    binary = np.rint(np.stack(outputs))
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    np.savetxt(output_path, binary)
+    print(f"Saved predictions to {output_path}")
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Streaming BiLSTM inference over PCAP feature rows.")
+    parser.add_argument(
+        "--feature-path",
+        type=Path,
+        required=True,
+        help="Path to the .npy file whose rows are replayed as a live stream.",
+    )
+    parser.add_argument(
+        "--output-path",
+        type=Path,
+        help="Optional output path for the predicted y features (.txt). "
+        "Defaults to <feature_path>_y_stream.txt",
+    )
+    parser.add_argument(
+        "--model-path",
+        type=Path,
+        default=DEFAULT_MODEL_PATH,
+        help=f"Path to the trained model checkpoint (default: {DEFAULT_MODEL_PATH}).",
+    )
+    parser.add_argument(
+        "--lookahead",
+        type=int,
+        default=None,
+        help="Frames of right context before a frame is emitted (default: window size - 1, "
+        "identical to infer.py).",
+    )
+    return parser.parse_args()
+
+
+def main() -> None:
+    args = parse_args()
+    output_path = args.output_path
+    if output_path is None:
+        output_path = args.feature_path.with_name(args.feature_path.stem + "_y_stream.txt")
+
+    replay_features(args.feature_path, output_path, args.model_path, args.lookahead)
+
+
+if __name__ == "__main__":
+    main()
@@ -48,6 +48,7 @@ def start_tcpdump_capture(pcap_path):
         [
             "tcpdump",
             "-s", "0",
+            "-U",  # flush every packet so parse_pcap.py --live can follow the file
             "-i", MONITOR_INTERFACE,
             "-w", pcap_path,
         ],
@@ -0,0 +1,477 @@
+"""
+Streaming 802.11 frame bucketing shared by the pcap consumers.
+
+Both `mininet/parse_pcap.py` (LSTM features) and
+`data_parsing/parse_inner_events.py` (threshold detector) look for the first
+video packet and bucket the 802.11 data frames after it into 1/FPS windows.
+This module does that once:
+
+- `iter_dot11_data_frames` streams (packet_index, timestamp, size) from a pcap
+  without building packet objects.
+- `VideoPacketGate` drops data frames timestamped before the first video packet.
+- `iter_frame_windows` / `stream_frame_features` emit each window once the next
+  one closes (live captures).
+- `read_video_packets` collects a whole capture into flat columns in one pass;
+  the returned `VideoPackets` gives both the per-frame byte totals and the
+  8 LSTM features, so one read of a pcap feeds both consumers.
+"""
+import os
+import struct
+import time
+from array import array
+
+import numpy as np
+from tqdm import tqdm
+
+from util import FPS
+
+# ----------------------------
+# CONFIG
+# ----------------------------
+
+MIN_VIDEO_PACKET_SIZE = 1000  # Minimum packet size to consider as video transmission packet
+FOLLOW_POLL_INTERVAL = 0.01  # seconds between reads while waiting for a live pcap to grow
+FOLLOW_IDLE_TIMEOUT = 5.0  # seconds without new packets before a live capture is considered finished
+
+# ----------------------------
+# Streaming pcap reader
+# ----------------------------
+
+PCAP_GLOBAL_HEADER_LEN = 24
+PCAP_RECORD_HEADER_LEN = 16
+LINKTYPE_IEEE802_11 = 105
+LINKTYPE_IEEE802_11_RADIOTAP = 127
+DOT11_TYPE_DATA = 2
+
+# pcap magic number (as stored on disk) -> (struct byte order, timestamp units per second)
+PCAP_MAGICS = {
+    b"\xd4\xc3\xb2\xa1": ("<", 1_000_000),
+    b"\xa1\xb2\xc3\xd4": (">", 1_000_000),
+    b"\x4d\x3c\xb2\xa1": ("<", 1_000_000_000),
+    b"\xa1\xb2\x3c\x4d": (">", 1_000_000_000),
+}
+
+
+def read_exact(f, size, follow=False, idle_timeout=FOLLOW_IDLE_TIMEOUT):
+    """
+    Read exactly size bytes from f, returning fewer only at the end of the capture.
+
+    With follow=True a short read is treated as a file that is still being
+    written: reading is retried until the data arrives or nothing new shows up
+    for idle_timeout seconds.
+    """
+    data = f.read(size)
+    if not follow or len(data) == size:
+        return data
+
+    chunks = [data]
+    received = len(data)
+    last_progress = time.monotonic()
+    while received < size:
+        chunk = f.read(size - received)
+        if chunk:
+            chunks.append(chunk)
+            received += len(chunk)
+            last_progress = time.monotonic()
+        elif time.monotonic() - last_progress >= idle_timeout:
+            break
+        else:
+            time.sleep(FOLLOW_POLL_INTERVAL)
+    return b"".join(chunks)
+
+
+def iter_dot11_data_frames(pcap_source, follow=False, idle_timeout=FOLLOW_IDLE_TIMEOUT):
+    """
+    Stream the 802.11 data frames of a pcap file without building packet objects.
+
+    Only the record headers and the radiotap/802.11 frame control bytes are
+    decoded, so memory use does not depend on the capture length.
+
+    Args:
+        pcap_source: Path to a classic (non-pcapng) pcap file, or a binary file
+            object such as a pipe from tcpdump (sys.stdin.buffer)
+        follow: Keep reading a file that is still growing (tcpdump -U -w),
+            until no data arrives for idle_timeout seconds
+        idle_timeout: Seconds without new data before a followed capture ends
+
+    Yields:
+        (packet_index, timestamp, size) for every 802.11 data frame, where
+        packet_index is the record position in the file, timestamp matches
+        float(scapy pkt.time) and size matches len(scapy pkt).
+    """
+    if isinstance(pcap_source, (str, os.PathLike)):
+        with open(pcap_source, "rb") as f:
+            yield from _iter_dot11_data_frames(f, pcap_source, follow, idle_timeout)
+    else:
+        name = getattr(pcap_source, "name", "<stream>")
+        yield from _iter_dot11_data_frames(pcap_source, name, follow, idle_timeout)
+
+
+def _iter_dot11_data_frames(f, pcap_name, follow, idle_timeout):
+    global_header = read_exact(f, PCAP_GLOBAL_HEADER_LEN, follow, idle_timeout)
+    if len(global_header) < PCAP_GLOBAL_HEADER_LEN:
+        raise RuntimeError(f"Truncated pcap header in {pcap_name}")
+
+    magic = global_header[:4]
+    if magic not in PCAP_MAGICS:
+        raise RuntimeError(f"Unsupported capture format (not a classic pcap): {pcap_name}")
+    byte_order, ts_units = PCAP_MAGICS[magic]
+
+    linktype = struct.unpack(byte_order + "I", global_header[20:24])[0] & 0x0FFFFFFF
+    if linktype not in (LINKTYPE_IEEE802_11, LINKTYPE_IEEE802_11_RADIOTAP):
+        raise RuntimeError(f"Unsupported link type {linktype} in {pcap_name}")
+
+    record_header = struct.Struct(byte_order + "IIII")
+
+    idx = 0
+    while True:
+        header = read_exact(f, PCAP_RECORD_HEADER_LEN, follow, idle_timeout)
+        if len(header) < PCAP_RECORD_HEADER_LEN:
+            break
+        ts_sec, ts_frac, incl_len, _ = record_header.unpack(header)
+        data = read_exact(f, incl_len, follow, idle_timeout)
+        if len(data) < incl_len:
+            break
+
+        # Offset of the 802.11 header inside the captured bytes
+        if linktype == LINKTYPE_IEEE802_11_RADIOTAP:
+            # Radiotap length is always little endian, bytes 2-3 of its header
+            dot11_offset = data[2] | (data[3] << 8) if incl_len >= 4 else incl_len
+        else:
+            dot11_offset = 0
+
+        if dot11_offset < incl_len:
+            # Frame control byte: subtype(4) | type(2) | protocol version(2)
+            frame_type = (data[dot11_offset] >> 2) & 0x3
+            if frame_type == DOT11_TYPE_DATA:
+                # Integer division keeps the timestamp correctly rounded,
+                # identical to converting scapy's Decimal time to float
+                timestamp = (ts_sec * ts_units + ts_frac) / ts_units
+                yield idx, timestamp, incl_len
+
+        idx += 1
+
+
+# ----------------------------
+# Frame bucketing
+# ----------------------------
+
+class VideoPacketGate:
+    """
+    Iterate the data frames of a capture from the first video packet on.
+
+    The first video packet is the first 802.11 data frame of at least
+    min_video_packet_size bytes. Data frames before it are held back until it
+    is found and kept only if their timestamp is not earlier than its
+    timestamp; later data frames timestamped before it are dropped.
+
+    first_video_timestamp and first_video_packet_index are set once the first
+    video packet has been seen.
+    """
+
+    def __init__(self, data_frames, min_video_packet_size=MIN_VIDEO_PACKET_SIZE):
+        self.data_frames = data_frames
+        self.min_video_packet_size = min_video_packet_size
+        self.first_video_timestamp = None
+        self.first_video_packet_index = None
+
+    def __iter__(self):
+        data_frames = iter(self.data_frames)
+
+        # Data frames seen before the first video packet
+        pending = []
+        for packet in data_frames:
+            if packet[2] < self.min_video_packet_size:
+                pending.append(packet)
+                continue
+
+            # Find the first video transmission packet (802.11 data frame with larger size)
+            first_video_timestamp = packet[1]
+            self.first_video_timestamp = first_video_timestamp
+            self.first_video_packet_index = packet[0]
+            for p in pending:
+                if p[1] >= first_video_timestamp:
+                    yield p
+            yield packet
+            break
+        else:
+            return
+
+        # Only consider packets after the first video packet
+        for packet in data_frames:
+            if packet[1] >= first_video_timestamp:
+                yield packet
+
+
+def iter_frame_windows(data_frames, min_video_packet_size=MIN_VIDEO_PACKET_SIZE):
+    """
+    Bucket a stream of 802.11 data frames into 1/FPS windows, emitting each as it closes.
+
+    A window is emitted once a data frame falls into a later window and one
+    more window has closed after it; empty windows in between are emitted
+    with no packets. The extra window of delay is what lets the stream end
+    like VideoPackets: a capture whose last packet lands exactly on a frame
+    boundary has ceil(...) frames there, so that last window is merged into
+    the one before it rather than emitted as a row of its own. For captures in
+    timestamp order the windows are the same as in VideoPackets; a packet
+    timestamped inside an already emitted window is put in the window that is
+    still open.
+
+    Args:
+        data_frames: iterable of (packet_index, timestamp, size), e.g. from
+            iter_dot11_data_frames(..., follow=True)
+
+    Yields:
+        (frame_idx, packets) with packets a list of (packet_index, timestamp, size)
+    """
+    frame_duration = 1.0 / FPS  # seconds per frame
+
+    gate = VideoPacketGate(data_frames, min_video_packet_size)
+    current_frame = 0
+    window = []
+    held = None  # last closed window, emitted once the next one closes
+    last_timestamp = None
+
+    for packet in gate:
+        last_timestamp = packet[1]
+        frame_idx = int((packet[1] - gate.first_video_timestamp) / frame_duration)
+        if frame_idx > current_frame:
+            if held is not None:
+                yield held
+            held = (current_frame, window)
+            for empty_idx in range(current_frame + 1, frame_idx):
+                yield held
+                held = (empty_idx, [])
+            current_frame = frame_idx
+            window = []
+        window.append(packet)
+
+    if gate.first_video_timestamp is None:
+        return
+    # Same frame count as VideoPackets, whose frame_indices clamp to num_frames - 1
+    num_frames = max(1, int(np.ceil((last_timestamp - gate.first_video_timestamp) / frame_duration)))
+    if held is not None and current_frame >= num_frames:
+        yield held[0], held[1] + window
+        return
+    if held is not None:
+        yield held
+    yield current_frame, window
+
+
+class VideoPackets:
+    """
+    The data frames of one capture from the first video packet on, as flat columns.
+
+    Built by read_video_packets. frame_sizes() and frame_features() bucket
+    the same packets into the same 1/FPS frames.
+    """
+
+    def __init__(self, timestamps, sizes, packet_indices, first_video_timestamp, first_video_packet_index):
+        self.timestamps = timestamps
+        self.sizes = sizes
+        self.packet_indices = packet_indices
+        self.first_video_timestamp = first_video_timestamp
+        self.first_video_packet_index = first_video_packet_index
+
+        # Determine number of frames based on the last packet timestamp
+        frame_duration = 1.0 / FPS  # seconds per frame
+        self.last_relative_timestamp = timestamps[-1] - first_video_timestamp
+        self.num_frames = max(1, int(np.ceil(self.last_relative_timestamp / frame_duration)))
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    def frame_indices(self):
+        """Frame of every packet; packets at the very end fall into the last frame."""
+        frame_duration = 1.0 / FPS  # seconds per frame
+        # Relative times are never negative, so truncation is the same floor as int(relative / duration)
+        frame_idx = ((self.timestamps - self.first_video_timestamp) / frame_duration).astype(np.int64)
+        np.minimum(frame_idx, self.num_frames - 1, out=frame_idx)
+        return frame_idx
+
+    def frame_sizes(self):
+        """Total bytes of the data frames in every frame (int64, num_frames)."""
+        # float64 sums of integer sizes are exact well past any realistic capture size
+        totals = np.bincount(self.frame_indices(), weights=self.sizes, minlength=self.num_frames)
+        return totals.astype(np.int64)
+
+    def frame_features(self):
+        """The 8 per-frame LSTM features, see aggregate_frame_features."""
+        return aggregate_frame_features(
+            self.timestamps, self.sizes, self.packet_indices, self.first_video_timestamp, self.num_frames
+        )
+
+
+def read_video_packets(pcap_path, verbose=True):
+    """
+    Read the data frames of a pcap from the first video packet on, in a single streaming pass.
+
+    Args:
+        pcap_path: Path to the pcap file
+        verbose: Show a progress bar over the file
+
+    Returns:
+        VideoPackets
+    """
+    # Compact per-packet columns for the 802.11 data frames we keep
+    timestamps = array("d")
+    sizes = array("q")
+    packet_indices = array("q")
+
+    file_size = os.path.getsize(pcap_path)
+    with tqdm(total=file_size, unit="B", unit_scale=True, desc="Reading 802.11 data frames",
+              leave=False, disable=not verbose) as pbar:
+        gate = VideoPacketGate(iter_dot11_data_frames(pcap_path))
+        for idx, timestamp, packet_size in gate:
+            packet_indices.append(idx)
+            timestamps.append(timestamp)
+            sizes.append(packet_size)
+            if verbose:
+                pbar.update(PCAP_RECORD_HEADER_LEN + packet_size)
+
+    if gate.first_video_timestamp is None:
+        raise RuntimeError(f"No video transmission packet found in {pcap_path}")
+
+    # Flat per-packet arrays (zero-copy views of the collected columns)
+    return VideoPackets(
+        np.frombuffer(timestamps, dtype=np.float64),
+        np.frombuffer(sizes, dtype=np.int64),
+        np.frombuffer(packet_indices, dtype=np.int64),
+        gate.first_video_timestamp,
+        gate.first_video_packet_index,
+    )
+
+# ----------------------------
+# Frame-level features
+# ----------------------------
+
+def aggregate_frame_features(timestamps, sizes, packet_indices, first_video_timestamp, num_frames):
+    """
+    Bucket packets into 1/FPS frames and compute the 8 per-frame features.
+
+    Frames are grouped by their packet count so that every mean/std is taken
+    with a row-wise NumPy reduction over exactly that frame's packets. This
+    keeps the summation order of np.mean/np.std on each frame on its own, so
+    the result is bit-identical to reducing the frames one at a time.
+
+    Args:
+        timestamps: float64 array of packet timestamps (seconds)
+        sizes: int64 array of packet sizes (bytes)
+        packet_indices: int64 array of packet positions in the pcap
+        first_video_timestamp: timestamp of the first video packet (frame 0 start)
+        num_frames: number of frames in the output
+
+    Returns:
+        frame_features: numpy array of shape (num_frames, 8) containing:
+            - num_packets
+            - sum_packet_length
+            - packet_size_mean
+            - packet_size_std
+            - inter_arrival_time_mean
+            - inter_arrival_time_std
+            - start_index (index of the packet in the pcap)
+            - end_index (index of the packet in the pcap)
+    """
+    frame_duration = 1.0 / FPS  # seconds per frame
+
+    # Determine which frame each packet belongs to. Relative times are never
+    # negative, so truncation is the same floor as int(relative / duration).
+    frame_idx = ((timestamps - first_video_timestamp) / frame_duration).astype(np.int64)
+
+    # Ensure frame_idx is within bounds
+    np.minimum(frame_idx, num_frames - 1, out=frame_idx)
+
+    # Packets of each frame are made contiguous. Sizes keep capture order,
+    # timestamps are sorted within their frame for the inter-arrival times.
+    size_order = np.argsort(frame_idx, kind="stable")
+    time_order = np.lexsort((timestamps, frame_idx))
+    sizes_by_frame = sizes[size_order]
+    timestamps_by_frame = timestamps[time_order]
+    indices_by_frame = packet_indices[size_order]
+
+    counts = np.bincount(frame_idx, minlength=num_frames)
+    starts = np.cumsum(counts) - counts
+
+    # Initialize feature array: (num_frames, 8)
+    # Features: [num_packets, sum_packet_length, packet_size_mean, packet_size_std, 
+    #            inter_arrival_time_mean, inter_arrival_time_std, start_index, end_index]
+    frame_features = np.zeros((num_frames, 8), dtype=np.float32)
+
+    # No packets in a frame - all features are 0, indices are -1
+    frame_features[:, 6:8] = -1
+
+    for count in np.unique(counts[counts > 0]):
+        frames = np.flatnonzero(counts == count)
+        members = starts[frames, None] + np.arange(count)
+
+        packet_sizes = sizes_by_frame[members]
+        frame_indices = indices_by_frame[members]
+
+        frame_features[frames, 0] = count
+        frame_features[frames, 1] = packet_sizes.sum(axis=1)
+        frame_features[frames, 2] = np.mean(packet_sizes, axis=1)
+        if count > 1:
+            frame_features[frames, 3] = np.std(packet_sizes, axis=1)
+
+            # Calculate inter-arrival times
+            inter_arrival_times = np.diff(timestamps_by_frame[members], axis=1)
+            frame_features[frames, 4] = np.mean(inter_arrival_times, axis=1)
+            frame_features[frames, 5] = np.std(inter_arrival_times, axis=1)
+
+        # Get start and end indices for each bucket
+        frame_features[frames, 6] = frame_indices.min(axis=1)
+        frame_features[frames, 7] = frame_indices.max(axis=1)
+
+    return frame_features
+
+
+def frame_feature_row(packets):
+    """
+    Compute the 8 features of one frame from its (packet_index, timestamp, size) tuples.
+
+    Same per-frame formulas as aggregate_frame_features, for use on a single open window.
+    """
+    if not packets:
+        # No packets in this frame - all features are 0, indices are -1
+        return np.array([0, 0, 0, 0, 0, 0, -1, -1], dtype=np.float32)
+
+    packet_indices = [p[0] for p in packets]
+    packet_timestamps = sorted([p[1] for p in packets])
+    packet_sizes = [p[2] for p in packets]
+
+    if len(packets) > 1:
+        packet_size_std = np.std(packet_sizes)
+        inter_arrival_times = np.diff(packet_timestamps)
+        inter_arrival_time_mean = np.mean(inter_arrival_times)
+        inter_arrival_time_std = np.std(inter_arrival_times)
+    else:
+        packet_size_std = inter_arrival_time_mean = inter_arrival_time_std = 0.0
+
+    return np.array([
+        len(packets),
+        sum(packet_sizes),
+        np.mean(packet_sizes),
+        packet_size_std,
+        inter_arrival_time_mean,
+        inter_arrival_time_std,
+        min(packet_indices),
+        max(packet_indices),
+    ], dtype=np.float32)
+
+
+def stream_frame_features(data_frames):
+    """
+    Turn a stream of 802.11 data frames into frame features as each 1/FPS window closes.
+
+    For captures in timestamp order the rows are identical to
+    read_video_packets(...).frame_features(); see iter_frame_windows.
+
+    Args:
+        data_frames: iterable of (packet_index, timestamp, size), e.g. from
+            iter_dot11_data_frames(..., follow=True)
+
+    Yields:
+        (frame_idx, features) with features a float32 array of length 8
+    """
+    for frame_idx, packets in iter_frame_windows(data_frames):
+        yield frame_idx, frame_feature_row(packets)
@@ -1,4 +1,14 @@
 import util
+from detection_log import DetectionLogWriter, LOG_SUFFIX
+
+import argparse
+import multiprocessing as mp
+import os
+import queue
+import threading
+import time
+import traceback
+from collections import deque
 
 import cv2
 import numpy as np
@@ -7,18 +17,26 @@ from ultralytics import YOLO
 import torch
 import torch.nn as nn
 import torchvision.models as models
-import torchvision.transforms as T
-import json
+from pathlib import Path
 
 import torchreid
 
-PATH_4 = "/home/ubuntu/M202A-CARLA/scripts/global_id_test_videos/black_blue/camera_4.mp4"
-PATH_5 = "/home/ubuntu/M202A-CARLA/scripts/global_id_test_videos/black_blue/camera_5.mp4"
+# Videos are read from <VIDEO_DIR>/camera_<id>.mp4, detection logs go to camera_<id>_input.jsonl
+VIDEO_DIR = "/home/ubuntu/M202A-CARLA/scripts/global_id_test_videos/black_blue"
+DEFAULT_CAMERA_IDS = [4, 5]  # visible cameras, see util.CAMERA_CONFIGS
 
-OUTPUT_4_PATH = "/home/ubuntu/M202A-CARLA/scripts/global_id_test_videos/black_blue/camera_4_input.json"
-OUTPUT_5_PATH = "/home/ubuntu/M202A-CARLA/scripts/global_id_test_videos/black_blue/camera_5_input.json"
+YOLO_WEIGHTS = "yolov8x.pt"
+ALLOWED_CLASSES = {"car", "truck", "bus", "motorbike"}
 
 COLOR = (0, 255, 0) # green for active tracking
+ANNOTATED_QUEUE_SIZE = 64  # frames buffered for the annotated video writer thread
+WORKER_POLL_INTERVAL = 1.0  # seconds between liveness checks of the workers
+MAX_FRAMES_AHEAD = 64  # frames a camera may send before the slowest camera catches up
+
+# Global ID gallery bounds: forget vehicles unseen for 10 minutes, keep at most 5000
+GALLERY_MAX_AGE = 10 * 60 * util.FPS  # frames
+GALLERY_MAX_TRACKS = 5000
+HISTORY_DIR_NAME = "global_id_history"  # detection history chunks, under the output directory by default
 
 class ReIDModelOSNet(nn.Module):
     def __init__(self, embedding_dim: int = 512):
@@ -65,36 +83,139 @@ class ReIDModel(nn.Module):
         emb = nn.functional.normalize(emb, p=2, dim=1)
         return emb
 
-# Standard image transforms for the ReID model
-reid_transform = T.Compose([
-    T.ToPILImage(),
-    T.Resize((224, 224)),
-    T.ToTensor(),
-    T.Normalize(
-        mean=[0.485, 0.456, 0.406],  # ImageNet stats
-        std=[0.229, 0.224, 0.225],
-    ),
-])
+# Standard input size and normalization for the ReID model
+REID_INPUT_SIZE = (224, 224)
+REID_MEAN = torch.tensor([0.485, 0.456, 0.406]).view(1, 3, 1, 1)  # ImageNet stats
+REID_STD = torch.tensor([0.229, 0.224, 0.225]).view(1, 3, 1, 1)
+
+def preprocess_crops(crops_bgr, device) -> torch.Tensor:
+    """
+    Turn BGR crops (OpenCV format) into one normalized [N, 3, H, W] batch.
+
+    Stays in tensors the whole way (no PIL round trip): each crop is moved to
+    the device as uint8 and resized there with antialiased bilinear
+    interpolation, which matches the PIL Resize the model was used with.
+    """
+    resized = []
+    for crop in crops_bgr:
+        rgb = torch.from_numpy(np.ascontiguousarray(crop[:, :, ::-1])).to(device)  # [H, W, 3] uint8
+        img = rgb.permute(2, 0, 1).unsqueeze(0).float().div_(255.0)             # [1, 3, H, W]
+        resized.append(nn.functional.interpolate(
+            img, size=REID_INPUT_SIZE, mode="bilinear", align_corners=False, antialias=True
+        ))
+    batch = torch.cat(resized)
+    return (batch - REID_MEAN.to(device)) / REID_STD.to(device)
+
+def extract_embeddings(model: nn.Module, device, crops_bgr) -> list:
+    """
+    Embed a list of BGR crops with a single batched forward pass.
+    Returns one 1D numpy array (L2-normalized) per crop, or None for empty crops.
+    """
+    embeddings = [None] * len(crops_bgr)
+    valid = [i for i, crop in enumerate(crops_bgr) if crop.size > 0]
+    if not valid:
+        return embeddings
+
+    batch = preprocess_crops([crops_bgr[i] for i in valid], device)  # [N, 3, H, W]
+    with torch.no_grad():
+        emb = model(batch)  # [N, D]
+    emb_np = emb.cpu().numpy()  # one device sync for the whole batch
+
+    for row, i in enumerate(valid):
+        embeddings[i] = emb_np[row]
+    return embeddings
 
 def extract_embedding(model: nn.Module, device, img_bgr: np.ndarray) -> np.ndarray:
     """
     Take a BGR crop (OpenCV format), convert to RGB, transform, run through ReID model.
-    Returns a 1D numpy array embedding (L2-normalized).
+    Returns a 1D numpy array embedding (L2-normalized), or None if the crop is empty.
     """
-    # defensive: if crop is empty, return None
-    if img_bgr.size == 0:
-        return None
+    return extract_embeddings(model, device, [img_bgr])[0]
 
-    img_rgb = cv2.cvtColor(img_bgr, cv2.COLOR_BGR2RGB)
-    tensor = reid_transform(img_rgb).unsqueeze(0).to(device)  # [1, 3, H, W]
+# -------------------------------------------------------------------
+# Compact, columnar detection history for the global tracker
+# -------------------------------------------------------------------
+class TrackHistory:
+    """
+    Append-only record of (global_id, camera_id, local_id, frame_idx, bbox) rows.
 
-    with torch.no_grad():
-        emb = model(tensor)  # [1, D]
-    emb_np = emb[0].cpu().numpy()  # [D]
-    return emb_np
+    Rows live in preallocated numpy columns instead of one dict per detection.
+    With spill_dir set, every chunk_rows rows are written to
+    spill_dir/history_XXXXX.npz and dropped from memory, so a long run only
+    holds the current chunk.
+    """
+
+    COLUMNS = {
+        "global_id": (np.int64, ()),
+        "camera_id": (np.int64, ()),
+        "local_id": (np.int64, ()),
+        "frame_idx": (np.int64, ()),
+        "bbox": (np.int32, (4,)),
+    }
+
+    def __init__(self, spill_dir=None, chunk_rows: int = 100_000):
+        self.spill_dir = Path(spill_dir) if spill_dir is not None else None
+        self.chunk_rows = chunk_rows
+        self.spilled_chunks = []
+        self.size = 0
+        self.columns = {
+            name: np.zeros((min(chunk_rows, 1024),) + shape, dtype=dtype)
+            for name, (dtype, shape) in self.COLUMNS.items()
+        }
+        if self.spill_dir is not None:
+            self.spill_dir.mkdir(parents=True, exist_ok=True)
+            # Chunks of an earlier run would be mistaken for this run's
+            for stale in self.spill_dir.glob("history_*.npz"):
+                stale.unlink()
+
+    def __len__(self) -> int:
+        return self.size + sum(n for _, n in self.spilled_chunks)
+
+    def append(self, global_id: int, camera_id: int, local_id: int, frame_idx: int, bbox):
+        if self.size == len(self.columns["global_id"]):
+            self.columns = {
+                name: np.concatenate([col, np.zeros_like(col)]) for name, col in self.columns.items()
+            }
+        row = self.size
+        self.columns["global_id"][row] = global_id
+        self.columns["camera_id"][row] = camera_id
+        self.columns["local_id"][row] = local_id
+        self.columns["frame_idx"][row] = frame_idx
+        self.columns["bbox"][row] = bbox
+        self.size += 1
+
+        if self.spill_dir is not None and self.size >= self.chunk_rows:
+            self.spill()
+
+    def spill(self):
+        """Write the in-memory rows to the next .npz chunk and clear them (no-op without a spill_dir)."""
+        if self.size == 0 or self.spill_dir is None:
+            return
+        path = self.spill_dir / f"history_{len(self.spilled_chunks):05d}.npz"
+        np.savez(path, **{name: col[:self.size] for name, col in self.columns.items()})
+        self.spilled_chunks.append((path, self.size))
+        self.size = 0
+
+    def iter_chunks(self):
+        """Yield dicts of column arrays: spilled chunks first, then the in-memory rows."""
+        for path, _ in self.spilled_chunks:
+            with np.load(path) as chunk:
+                yield {name: chunk[name] for name in self.COLUMNS}
+        if self.size:
+            yield {name: col[:self.size] for name, col in self.columns.items()}
+
+    def for_track(self, global_id: int) -> dict:
+        """All history rows of one global ID, as column arrays."""
+        parts = [
+            {name: col[chunk["global_id"] == global_id] for name, col in chunk.items()}
+            for chunk in self.iter_chunks()
+        ]
+        if not parts:
+            return {name: np.zeros((0,) + shape, dtype=dtype) for name, (dtype, shape) in self.COLUMNS.items()}
+        return {name: np.concatenate([part[name] for part in parts]) for name in self.COLUMNS}
 
 # -------------------------------------------------------------------
-# 2. Global appearance-based tracker across BOTH cameras
+# 2. Global appearance-based tracker across all cameras
 # -------------------------------------------------------------------
 class GlobalAppearanceTracker:
     """
@@ -105,28 +226,137 @@ class GlobalAppearanceTracker:
         - if best similarity >= threshold -> assign that global ID
         - else create a new global ID
 
+    The gallery is a contiguous matrix of L2-normalized embeddings (one row
+    per global ID, in creation order), so one matrix multiply scores every
+    detection of a frame against every track. Tracks can be evicted by age
+    (max_age) and by gallery size (max_tracks, least recently seen first)
+    to keep memory bounded on long runs.
+
+    With one_to_one=True, the detections of one assign_global_ids call are
+    matched greedily by similarity and never share a global ID.
+
     This is *appearance-only* (no timing, no geometry, no motion).
     """
 
-    def __init__(self, sim_threshold: float = 0.7):
+    INITIAL_CAPACITY = 64
+
+    def __init__(
+        self,
+        sim_threshold: float = 0.7,
+        one_to_one: bool = False,
+        max_age: int = None,
+        max_tracks: int = None,
+        history: TrackHistory = None,
+    ):
+        """
+        max_age:    evict tracks not seen for more than this many frames (None: never)
+        max_tracks: keep at most this many tracks, evicting the least recently seen (None: unbounded)
+        history:    TrackHistory receiving every assignment (default: in memory, no spilling)
+        """
         self.sim_threshold = sim_threshold
+        self.one_to_one = one_to_one
+        self.max_age = max_age
+        self.max_tracks = max_tracks
         self.next_global_id = 1
-        # global_id -> dict with keys: 'embedding', 'history'
-        self.tracks = {}
+        self.history = history if history is not None else TrackHistory()
+        # gallery[row] is the embedding of gallery_ids[row], last seen at frame
+        # gallery_last_seen[row]; rows [0, gallery_size) are in use
+        self.gallery = None
+        self.gallery_ids = np.zeros(0, dtype=np.int64)
+        self.gallery_last_seen = np.zeros(0, dtype=np.int64)
+        self.gallery_size = 0
+        self.gallery_row = {}  # global_id -> row
+        self.evicted_count = 0
 
     @staticmethod
     def cosine_similarity(a: np.ndarray, b: np.ndarray) -> float:
         denom = (np.linalg.norm(a) * np.linalg.norm(b)) + 1e-8
         return float(np.dot(a, b) / denom)
 
+    @staticmethod
+    def normalize(emb: np.ndarray) -> np.ndarray:
+        return emb / (np.linalg.norm(emb, axis=-1, keepdims=True) + 1e-8)
+
+    def embedding(self, global_id: int) -> np.ndarray:
+        return self.gallery[self.gallery_row[global_id]]
+
+    def add_to_gallery(self, global_id: int, emb: np.ndarray, frame_idx: int = 0):
+        """Append a normalized embedding row, doubling the matrix capacity when full."""
+        if self.gallery is None:
+            self.gallery = np.zeros((self.INITIAL_CAPACITY, emb.shape[-1]), dtype=np.float32)
+            self.gallery_ids = np.zeros(self.INITIAL_CAPACITY, dtype=np.int64)
+            self.gallery_last_seen = np.zeros(self.INITIAL_CAPACITY, dtype=np.int64)
+        elif self.gallery_size == len(self.gallery):
+            self.gallery = np.concatenate([self.gallery, np.zeros_like(self.gallery)])
+            self.gallery_ids = np.concatenate([self.gallery_ids, np.zeros_like(self.gallery_ids)])
+            self.gallery_last_seen = np.concatenate([self.gallery_last_seen, np.zeros_like(self.gallery_last_seen)])
+
+        row = self.gallery_size
+        self.gallery[row] = self.normalize(emb)
+        self.gallery_ids[row] = global_id
+        self.gallery_last_seen[row] = frame_idx
+        self.gallery_row[global_id] = row
+        self.gallery_size += 1
+
+    def evict(self, frame_idx: int):
+        """
+        Drop tracks older than max_age, then the least recently seen ones beyond max_tracks.
+
+        Remaining rows keep their relative (creation) order. Evicted global IDs
+        are never reused; their history stays in self.history.
+        """
+        n = self.gallery_size
+        keep = np.ones(n, dtype=bool)
+        last_seen = self.gallery_last_seen[:n]
+
+        if self.max_age is not None:
+            keep &= (frame_idx - last_seen) <= self.max_age
+
+        if self.max_tracks is not None and keep.sum() > self.max_tracks:
+            kept_rows = np.flatnonzero(keep)
+            # oldest last_seen first; stable so ties evict the oldest track
+            lru = kept_rows[np.argsort(last_seen[kept_rows], kind="stable")]
+            keep[lru[:len(kept_rows) - self.max_tracks]] = False
+
+        if keep.all():
+            return
+
+        kept = np.flatnonzero(keep)
+        m = len(kept)
+        for gid in self.gallery_ids[:n][~keep]:
+            del self.gallery_row[int(gid)]
+        self.gallery[:m] = self.gallery[kept]
+        self.gallery_ids[:m] = self.gallery_ids[kept]
+        self.gallery_last_seen[:m] = self.gallery_last_seen[kept]
+        self.gallery_size = m
+        for row, gid in enumerate(self.gallery_ids[:m]):
+            self.gallery_row[int(gid)] = row
+        self.evicted_count += n - m
+
     # constantly update stored global embeddings so we keep embedding state
     # as current as possible. 80% prev and 20% new, acts like a low pass filter.
     def update_gallery_embedding(self, global_id: int, new_emb: np.ndarray):
         """Running average of embeddings to keep track representation stable."""
-        old_emb = self.tracks[global_id]["embedding"]
-        updated = 0.8 * old_emb + 0.2 * new_emb
-        updated /= np.linalg.norm(updated) + 1e-8
-        self.tracks[global_id]["embedding"] = updated
+        row = self.gallery_row[global_id]
+        updated = 0.8 * self.gallery[row] + 0.2 * new_emb
+        self.gallery[row] = self.normalize(updated)
+
+    def match_one_to_one(self, sims: np.ndarray) -> dict:
+        """
+        Greedy one-to-one matching on a [detections, tracks] similarity matrix.
+        Returns {detection_index: gallery_row} for pairs with similarity >= threshold.
+        """
+        det_idx, rows = np.nonzero(sims >= self.sim_threshold)
+        order = np.argsort(-sims[det_idx, rows], kind="stable")
+
+        matches = {}
+        taken_rows = set()
+        for k, row in zip(det_idx[order], rows[order]):
+            if k in matches or row in taken_rows:
+                continue
+            matches[k] = row
+            taken_rows.add(row)
+        return matches
 
     def assign_global_ids(self, embeddings, camera_id: int, frame_idx: int, bboxes, local_ids):
         """
@@ -138,318 +368,512 @@ class GlobalAppearanceTracker:
 
         Returns: list of global IDs, same length/order as embeddings.
         """
-        assigned_ids = []
+        assigned_ids = [-1] * len(embeddings)
+        valid = [i for i, emb in enumerate(embeddings) if emb is not None]
+        if not valid:
+            return assigned_ids
 
-        for emb, bbox, local_id in zip(embeddings, bboxes, local_ids):
-            if emb is None:
-                assigned_ids.append(-1)
-                continue
+        dets = self.normalize(np.stack([embeddings[i] for i in valid]).astype(np.float32))  # [N, D]
 
-            best_id = None
-            best_sim = -1.0
+        # Compare with existing global tracks: one [N, D] x [D, T] product
+        start_size = self.gallery_size
+        if start_size:
+            sims = dets @ self.gallery[:start_size].T  # [N, T]
+        else:
+            sims = np.zeros((len(valid), 0), dtype=np.float32)
+
+        matches = self.match_one_to_one(sims) if self.one_to_one else None
+        # rows created or updated during this call, re-scored for later detections
+        changed_rows = []
 
-            # Compare with existing global tracks
-            for gid, info in self.tracks.items():
-                sim = self.cosine_similarity(emb, info["embedding"])
-                if sim > best_sim:
-                    best_sim = sim
-                    best_id = gid
+        for k, i in enumerate(valid):
+            emb = embeddings[i]
 
-            if best_id is not None and best_sim >= self.sim_threshold:
+            if matches is not None:
+                best_row = matches.get(k)
+            else:
+                row_sims = sims[k]
+                if changed_rows:
+                    row_sims = np.empty(self.gallery_size, dtype=np.float32)
+                    row_sims[:start_size] = sims[k]
+                    row_sims[changed_rows] = self.gallery[changed_rows] @ dets[k]
+                best_row = int(np.argmax(row_sims)) if len(row_sims) else None
+                if best_row is not None and row_sims[best_row] < self.sim_threshold:
+                    best_row = None
+
+            if best_row is not None:
                 # Match found -> update track
-                assigned_ids.append(best_id)
+                best_id = int(self.gallery_ids[best_row])
                 self.update_gallery_embedding(best_id, emb)
-
-                self.tracks[best_id]["history"].append({
-                    "camera_id": camera_id,
-                    "local_id": local_id,
-                    "frame_idx": frame_idx,
-                    "bbox": bbox,
-                })
+                self.gallery_last_seen[best_row] = frame_idx
             else:
                 # No match -> new global ID
-                gid = self.next_global_id
+                best_id = self.next_global_id
                 self.next_global_id += 1
+                self.add_to_gallery(best_id, emb, frame_idx)
+                best_row = self.gallery_row[best_id]
 
-                self.tracks[gid] = {
-                    "embedding": emb,
-                    "history": [{
-                        "camera_id": camera_id,
-                        "local_id": local_id,
-                        "frame_idx": frame_idx,
-                        "bbox": bbox,
-                    }]
-                }
-                assigned_ids.append(gid)
-
-        return assigned_ids
-
-def main() -> None:
-    
-    # ---------------------------
-    # Video setup
-    # ---------------------------
-    cap4 = cv2.VideoCapture(PATH_4)
-    cap5 = cv2.VideoCapture(PATH_5)
-
-    if not cap4.isOpened():
-        print(f"Error: could not open video {PATH_4}")
-        return
-    if not cap5.isOpened():
-        print(f"Error: could not open video {PATH_5}")
-        return
-
-    # ---------------------------
-    # YOLO model (detector)
-    # ---------------------------
-    print("Loading YOLOv8m...")
-    yolo_model4 = YOLO("yolov8x.pt") # two seperate models because it maintains internal state
-    yolo_model5 = YOLO("yolov8x.pt")
-    ALLOWED_CLASSES = {"car", "truck", "bus", "motorbike"}
-
-    # ---------------------------
-    # ReID / embedding model
-    # ---------------------------
-    print("Loading ReID...")
-    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-    print(f"Using device: {device}")
-    # fallback to ReIDModel if needed.
-    reid_model = ReIDModelOSNet(embedding_dim=512).to(device)
-    reid_model.eval()
+            assigned_ids[i] = best_id
+            self.history.append(best_id, camera_id, local_ids[i], frame_idx, bboxes[i])
 
-    # ---------------------------------------------------------------
-    # Global appearance-based tracker (shared across both cameras)
-    # ---------------------------------------------------------------
-    # WARNING: THIS VALUE IS EXTREMELY SENSITIVE
-    # use 0.86 for regular resnet
-    global_tracker = GlobalAppearanceTracker(sim_threshold=0.65)
+            if best_row not in changed_rows:
+                changed_rows.append(best_row)
 
-    # ---------------------------------------------------------------
-    # MAIN LOOP BEGIN ===============================================
-    # ---------------------------------------------------------------
+        # Rows only move here, after every detection of the call has been scored
+        self.evict(frame_idx)
 
-    frame_idx = 0
-    camera_4_output = []
-    camera_5_output = []
+        return assigned_ids
 
-    # DEBUG: can comment these lines out for faster processing
-    cv2.namedWindow("camera_4", cv2.WINDOW_NORMAL)
-    cv2.namedWindow("camera_5", cv2.WINDOW_NORMAL)
+# -------------------------------------------------------------------
+# 3. Per-camera worker: decode -> YOLO/ByteTrack -> ReID embeddings
+# -------------------------------------------------------------------
+def detect_vehicles(yolo_model, frame, reid_model, device, draw=True):
+    """
+    Detect and track vehicles in one frame and embed every vehicle crop in one batch.
 
-    while True:
-        ret4, frame4 = cap4.read()
-        ret5, frame5 = cap5.read()
+    Args:
+        draw: draw the detection rectangles onto frame (for the GUI preview)
 
-        # Stop when either video ends
-        if not ret4 or not ret5:
-            break
+    Returns (embeddings, bboxes, local_ids), one entry per vehicle.
+    """
+    # ----------------------------------------
+    # 1) YOLO detection
+    # ----------------------------------------
+    results = yolo_model.track(
+        frame,
+        persist=True,
+        tracker="bytetrack.yaml",
+        conf=0.35,
+        iou=0.5,
+        verbose=False,
+    )[0]
+
+    crops = []
+    bboxes = []
+    local_ids = []
+
+    for result in results:
+        if result.boxes is None or result.boxes.id is None: continue
+
+        boxes = result.boxes.cpu().numpy()
+        for box_data, cls_id, track_id in zip(boxes.xyxy, boxes.cls, boxes.id):
+
+                cls_id = int(cls_id)
+                track_id = int(track_id)
+
+                # don't track anything but vehicles
+                if yolo_model.names[int(cls_id)] not in ALLOWED_CLASSES: continue
+
+                # fetch bounding box corners
+                x1, y1, x2, y2 = box_data.astype(int)
+
+                # get frame height and width
+                h, w = frame.shape[:2]
+
+                # generate parameters for image crop
+                x1 = int(max(0, min(w - 1, x1)))
+                x2 = int(max(0, min(w - 1, x2)))
+                y1 = int(max(0, min(h - 1, y1)))
+                y2 = int(max(0, min(h - 1, y2)))
+                if x2 <= x1 or y2 <= y1:
+                    continue
 
-        # All processing happens here after loading frames.
+                crop = frame[y1:y2, x1:x2]
+                if draw:
+                    crop = crop.copy()  # rectangles are drawn on the frame before embedding
+                # DEBUG: cv2.imshow("cropped_vehicle", crop)  # visualize the most recent crop
+                crops.append(crop)
 
-        # ----------------------------------------
-        # 1) YOLO detection
-        # ----------------------------------------
-        results4 = yolo_model4.track(
-            frame4,
-            persist=True,
-            tracker="bytetrack.yaml",
-            conf=0.35,
-            iou=0.5,
-            verbose=False,
-        )[0]
-        results5 = yolo_model5.track(
-            frame5,
-            persist=True,
-            tracker="bytetrack.yaml",
-            conf=0.35,
-            iou=0.5,
-            verbose=False,
-        )[0]
-
-        dets_cam4 = []  # (embedding, bbox, local_id)
-        dets_cam5 = []
-
-        # Process camera 4 frame.
-        for result in results4:
-            if result.boxes is None or result.boxes.id is None: continue
-
-            boxes = result.boxes.cpu().numpy()
-            for box_data, cls_id, track_id in zip(boxes.xyxy, boxes.cls, boxes.id):
-
-                    cls_id = int(cls_id)
-                    track_id = int(track_id)
-
-                    # don't track anything but vehicles
-                    if yolo_model4.names[int(cls_id)] not in ALLOWED_CLASSES: continue
-
-                    # fetch bounding box corners
-                    x1, y1, x2, y2 = box_data.astype(int)
-
-                    # get frame height and width
-                    h5, w5 = frame4.shape[:2]
-
-                    # generate parameters for image crop
-                    x1 = int(max(0, min(w5 - 1, x1)))
-                    x2 = int(max(0, min(w5 - 1, x2)))
-                    y1 = int(max(0, min(h5 - 1, y1)))
-                    y2 = int(max(0, min(h5 - 1, y2)))
-                    if x2 <= x1 or y2 <= y1:
-                        continue
-
-                    crop = frame4[y1:y2, x1:x2]
-                    # DEBUG: cv2.imshow("cropped_vehicle", crop)  # visualize the most recent crop
-                    emb = extract_embedding(reid_model, device, crop)
-
-                    # get resnet embedding, bounding box, and local bytetrack id
-                    dets_cam4.append((emb, [x1, y1, x2, y2], track_id))
-
-                    # DEBUG: show green identification rectangle
-                    cv2.rectangle(frame4, (x1, y1), (x2, y2), COLOR, 2)
-                    
-        # Process camera 5 frame.
-        for result in results5:
-            if result.boxes is None or result.boxes.id is None: continue
-
-            boxes = result.boxes.cpu().numpy()
-            for box_data, cls_id, track_id in zip(boxes.xyxy, boxes.cls, boxes.id):
-
-                    cls_id = int(cls_id)
-                    track_id = int(track_id)
-
-                    # don't track anything but vehicles
-                    if yolo_model5.names[int(cls_id)] not in ALLOWED_CLASSES: continue
-
-                    # fetch bounding box corners
-                    x1, y1, x2, y2 = box_data.astype(int)
-
-                    # get frame height and width
-                    h5, w5 = frame5.shape[:2]
-
-                    # generate parameters for image crop
-                    x1 = int(max(0, min(w5 - 1, x1)))
-                    x2 = int(max(0, min(w5 - 1, x2)))
-                    y1 = int(max(0, min(h5 - 1, y1)))
-                    y2 = int(max(0, min(h5 - 1, y2)))
-                    if x2 <= x1 or y2 <= y1:
-                        continue
-
-                    crop = frame5[y1:y2, x1:x2]
-                    # DEBUG: cv2.imshow("cropped_vehicle", crop)  # visualize the most recent crop
-                    emb = extract_embedding(reid_model, device, crop)
-
-                    # get resnet embedding, bounding box, and local bytetrack id
-                    dets_cam5.append((emb, [x1, y1, x2, y2], track_id))
-
-                    # DEBUG: show green identification rectangle
-                    cv2.rectangle(frame5, (x1, y1), (x2, y2), COLOR, 2)
+                # bounding box and local bytetrack id, embedding is filled in below
+                bboxes.append([x1, y1, x2, y2])
+                local_ids.append(track_id)
 
-        # ----------------------------------------
-        # 3) Global ID assignment (appearance-only)
-        # ----------------------------------------
-        
-        if dets_cam4:
-            emb4   = [e for (e, b, tid) in dets_cam4]
-            box4   = [b for (e, b, tid) in dets_cam4]
-            lid4   = [tid for (e, b, tid) in dets_cam4]
-            global_ids4 = global_tracker.assign_global_ids(
-                emb4, camera_id=4, frame_idx=frame_idx, bboxes=box4, local_ids=lid4
-            )
-        else:
-            lid4 = []
-            global_ids4 = []
-        
-        if dets_cam5:
-            emb5   = [e for (e, b, tid) in dets_cam5]
-            box5   = [b for (e, b, tid) in dets_cam5]
-            lid5   = [tid for (e, b, tid) in dets_cam5]
-            global_ids5 = global_tracker.assign_global_ids(
-                emb5, camera_id=5, frame_idx=frame_idx, bboxes=box5, local_ids=lid5
-            )
-        else:
-            lid5 = []
-            global_ids5 = []
+                # DEBUG: show green identification rectangle
+                if draw:
+                    cv2.rectangle(frame, (x1, y1), (x2, y2), COLOR, 2)
 
-        # ----------------------------------------
-        # 4) Preprare for output generation
-        # ----------------------------------------
+    # ----------------------------------------
+    # 2) ReID embeddings, one batch per frame
+    # ----------------------------------------
+    embeddings = extract_embeddings(reid_model, device, crops)
+    return embeddings, bboxes, local_ids
 
-        '''
-        Output of this script can look like:
-        per camera:
 
-        the vector index implicitly serves as the frame index
-        [0|1 for if car detected, [pos/vel of cars], [id of cars]]
-        '''
+class AnnotatedVideoWriter:
+    """
+    Writes frames with their detection boxes to a video file on a background thread.
 
-        camera_4_output_frame = {
-            'frame': frame_idx,
-            'car_detected': True if any(global_ids4) else False,
-            'camera_pos': util.CAMERA_CONFIGS[0]["pos"],
-            'cars': []
-        }
+    write() only enqueues the frame, so drawing and encoding overlap with
+    detection instead of adding to it. The queue is bounded: if encoding falls
+    behind, write() blocks rather than buffering the whole video in memory.
+    """
 
-        # If this frame has any global detections, append entries to `cars`
-        # with global_id, local_id, and placeholder xyz position [0, 0, 0].
-        if any(global_ids4):
-            for local_id, global_id in zip(lid4, global_ids4):
-                if global_id is None:
-                    continue
-                camera_4_output_frame['cars'].append({
-                    'global_id': int(global_id),
-                    'local_id': int(local_id),
-                    'position': [0.0, 0.0, 0.0], # TODO: fill this code in from camera.py
-                })
-
-        camera_4_output.append(camera_4_output_frame)
-
-        camera_5_output_frame = {
-            'frame': frame_idx,
-            'car_detected': True if any(global_ids5) else False,
-            'camera_pos': util.CAMERA_CONFIGS[1]["pos"],
-            'cars': []
-        }
+    def __init__(self, output_path, fps, frame_size, max_queue=ANNOTATED_QUEUE_SIZE):
+        self.output_path = str(output_path)
+        self.writer = cv2.VideoWriter(self.output_path, cv2.VideoWriter_fourcc(*"mp4v"), fps, frame_size)
+        if not self.writer.isOpened():
+            raise RuntimeError(f"could not open video writer {self.output_path}")
+        self.frames = queue.Queue(maxsize=max_queue)
+        self.error = None
+        self.thread = threading.Thread(target=self._run, name="annotated_video_writer", daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        try:
+            while True:
+                item = self.frames.get()
+                if item is None:
+                    break
+                frame, bboxes = item
+                for x1, y1, x2, y2 in bboxes:
+                    cv2.rectangle(frame, (x1, y1), (x2, y2), COLOR, 2)
+                self.writer.write(frame)
+        except Exception as e:
+            self.error = e
+            # keep draining so write() never blocks on a dead writer
+            while self.frames.get() is not None:
+                pass
+        finally:
+            self.writer.release()
+
+    def write(self, frame, bboxes):
+        """Queue a frame. frame must not be modified by the caller afterwards."""
+        self.frames.put((frame, bboxes))
+
+    def close(self):
+        self.frames.put(None)
+        self.thread.join()
+        if self.error is not None:
+            raise RuntimeError(f"annotated video writer failed: {self.error}") from self.error
+
+
+def camera_worker(camera_id, video_path, results_queue, credits, torch_threads, headless=False, annotated_path=None):
+    """
+    Worker process for one camera.
+
+    Owns its own capture, YOLO instance (ByteTrack keeps per-camera state) and
+    ReID model, and sends one ("frame", camera_id, frame_idx, embeddings,
+    bboxes, local_ids) message per frame to results_queue. Finishes with
+    ("done", camera_id, num_frames, seconds), or ("error", camera_id, traceback).
+
+    Args:
+        credits: semaphore taken once per frame message and released by the
+            main process when it has assigned that frame, so the worker blocks
+            once it is MAX_FRAMES_AHEAD frames ahead of the assignment
+        headless: no preview window, drawing or waitKey; frames are processed
+            as fast as decode and inference allow
+        annotated_path: if set, write an annotated copy of the video here on a
+            background thread
+    """
+    frame_idx = 0
+    annotated = None
+    try:
+        torch.set_num_threads(torch_threads)
+
+        cap = cv2.VideoCapture(str(video_path))
+        if not cap.isOpened():
+            raise RuntimeError(f"could not open video {video_path}")
+
+        yolo_model = YOLO(YOLO_WEIGHTS)
+
+        device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+        # fallback to ReIDModel if needed.
+        reid_model = ReIDModelOSNet(embedding_dim=512).to(device)
+        reid_model.eval()
+
+        if annotated_path is not None:
+            fps = cap.get(cv2.CAP_PROP_FPS) or util.FPS
+            frame_size = (int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)))
+            annotated = AnnotatedVideoWriter(annotated_path, fps, frame_size)
+
+        window_name = f"camera_{camera_id}"
+        if not headless:
+            # DEBUG: can comment these lines out for faster processing
+            cv2.namedWindow(window_name, cv2.WINDOW_NORMAL)
+
+        start_time = time.perf_counter()
+        while True:
+            ret, frame = cap.read()
+            if not ret:
+                break
+
+            # Headless, the annotated writer draws the boxes on its thread. With a
+            # window they are drawn here for display instead (see below).
+            draw = not headless
+            embeddings, bboxes, local_ids = detect_vehicles(yolo_model, frame, reid_model, device, draw=draw)
+            credits.acquire()
+            results_queue.put(("frame", camera_id, frame_idx, embeddings, bboxes, local_ids))
+            frame_idx += 1
+
+            if annotated is not None:
+                if headless:
+                    annotated.write(frame, bboxes)
+                else:
+                    # imshow keeps showing frame, so the writer thread gets its own copy
+                    annotated.write(frame.copy(), [])
+
+            if not headless:
+                # DEBUG: can comment these lines out for faster processing
+                cv2.imshow(window_name, frame)
+                key = cv2.waitKey(33) & 0xFF
+                if key == ord("q"):
+                    break
+        elapsed = time.perf_counter() - start_time
+
+        cap.release()
+        if annotated is not None:
+            annotated.close()
+            annotated = None
+        if not headless:
+            cv2.destroyAllWindows()
+        results_queue.put(("done", camera_id, frame_idx, elapsed))
+    except Exception:
+        if annotated is not None:
+            try:
+                annotated.close()
+            except Exception:
+                pass
+        results_queue.put(("error", camera_id, traceback.format_exc()))
 
-        # If this frame has any global detections, append entries to `cars`
-        # with global_id, local_id, and placeholder xyz position [0, 0, 0].
-        if any(global_ids5):
-            for local_id, global_id in zip(lid5, global_ids5):
-                if global_id is None:
-                    continue
-                camera_5_output_frame['cars'].append({
-                    'global_id': int(global_id),
-                    'local_id': int(local_id),
-                    'position': [0.0, 0.0, 0.0], # TODO: fill this code in from camera.py
-                })
+# -------------------------------------------------------------------
+# 4. Central global ID assignment and output generation
+# -------------------------------------------------------------------
+def camera_position(camera_id):
+    for config in util.CAMERA_CONFIGS:
+        if config["id"] == camera_id:
+            return config["pos"]
+    raise KeyError(f"camera {camera_id} not found in util.CAMERA_CONFIGS")
 
-        camera_5_output.append(camera_5_output_frame)
 
-        # DEBUG: can comment these lines out for faster processing
-        print("frame:", frame_idx, "global_ids4:", global_ids4, "global_ids5", global_ids5)
-        cv2.imshow("camera_4", frame4)
-        cv2.imshow("camera_5", frame5)
+def build_output_frame(frame_idx, camera_pos, global_ids, local_ids):
+    """
+    Output of this script can look like:
+    per camera:
 
-        frame_idx += 1
+    the vector index implicitly serves as the frame index
+    [0|1 for if car detected, [pos/vel of cars], [id of cars]]
+    """
+    output_frame = {
+        'frame': frame_idx,
+        'car_detected': True if any(global_ids) else False,
+        'camera_pos': camera_pos,
+        'cars': []
+    }
+
+    # If this frame has any global detections, append entries to `cars`
+    # with global_id, local_id, and placeholder xyz position [0, 0, 0].
+    if any(global_ids):
+        for local_id, global_id in zip(local_ids, global_ids):
+            if global_id is None:
+                continue
+            output_frame['cars'].append({
+                'global_id': int(global_id),
+                'local_id': int(local_id),
+                'position': [0.0, 0.0, 0.0], # TODO: fill this code in from camera.py
+            })
+    return output_frame
 
-        # DEBUG: can comment these lines out for faster processing
-        key = cv2.waitKey(33) & 0xFF
-        if key == ord("q"):
-            break
 
-    # ----------------------------------------
-    # 45) Cleanup operations and save data
-    # ----------------------------------------
+def run_pipeline(camera_ids, video_dir, output_dir, headless=False, annotated_dir=None, history_dir=None):
+    """
+    Process the given cameras in parallel, one worker process per camera.
+
+    Workers stream per-frame embeddings to this process, which assigns global
+    IDs frame by frame in camera order (frame 0 of every camera, then frame 1,
+    ...), exactly like processing the cameras in lockstep. A camera that ends
+    early simply drops out; the others keep going. Each assigned frame is
+    appended to the camera's detection log right away (see detection_log.py).
+
+    Every camera holds MAX_FRAMES_AHEAD credits and spends one per frame it
+    sends; a credit comes back when that frame is assigned. A fast camera thus
+    waits for the slowest one instead of piling frames up here, and memory
+    stays bounded however many cameras run. Workers are checked for liveness
+    every WORKER_POLL_INTERVAL, so a worker killed outright (OOM, segfault)
+    is dropped even while the others keep sending frames.
+
+    Args:
+        headless: no preview windows and no per-frame prints
+        annotated_dir: if set, each worker writes camera_<id>_annotated.mp4 here
+        history_dir: where the global tracker's detection history is spilled
+            in chunks (default: output_dir/global_id_history), so memory stays
+            bounded however long the run is
+    """
+    video_dir = Path(video_dir)
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    history_dir = Path(history_dir) if history_dir is not None else output_dir / HISTORY_DIR_NAME
+    camera_pos = {camera_id: camera_position(camera_id) for camera_id in camera_ids}
 
-    with open(OUTPUT_4_PATH, "w") as f:
-        json.dump(camera_4_output, f, indent=2)
+    # ---------------------------------------------------------------
+    # Global appearance-based tracker (shared across all cameras)
+    # ---------------------------------------------------------------
+    # WARNING: THIS VALUE IS EXTREMELY SENSITIVE
+    # use 0.86 for regular resnet
+    global_tracker = GlobalAppearanceTracker(
+        sim_threshold=0.65,
+        max_age=GALLERY_MAX_AGE,
+        max_tracks=GALLERY_MAX_TRACKS,
+        history=TrackHistory(spill_dir=history_dir),
+    )
+
+    # Split CPU threads between the workers instead of oversubscribing
+    torch_threads = max(1, (os.cpu_count() or 1) // len(camera_ids))
+
+    # CUDA cannot be used from forked processes
+    ctx = mp.get_context("spawn")
+    results_queue = ctx.Queue()
+    credits = {camera_id: ctx.Semaphore(MAX_FRAMES_AHEAD) for camera_id in camera_ids}
+    workers = []
+    if annotated_dir is not None:
+        Path(annotated_dir).mkdir(parents=True, exist_ok=True)
+    for camera_id in camera_ids:
+        video_path = video_dir / f"camera_{camera_id}.mp4"
+        annotated_path = None
+        if annotated_dir is not None:
+            annotated_path = Path(annotated_dir) / f"camera_{camera_id}_annotated.mp4"
+        worker = ctx.Process(
+            target=camera_worker,
+            args=(camera_id, video_path, results_queue, credits[camera_id], torch_threads, headless, annotated_path),
+            name=f"camera_{camera_id}",
+        )
+        worker.start()
+        workers.append(worker)
+    print(f"Started {len(workers)} camera workers ({torch_threads} torch threads each).")
+
+    logs = {
+        camera_id: DetectionLogWriter(output_dir / f"camera_{camera_id}_input{LOG_SUFFIX}", camera_id, camera_pos[camera_id])
+        for camera_id in camera_ids
+    }
+    pending = {camera_id: deque() for camera_id in camera_ids}
+    active = set(camera_ids)
+
+    def assign_ready_frames():
+        # A frame index is ready once every camera still running has delivered it
+        while any(pending.values()):
+            if any(camera_id in active and not pending[camera_id] for camera_id in camera_ids):
+                return
+            for camera_id in camera_ids:
+                if not pending[camera_id]:
+                    continue
+                frame_idx, embeddings, bboxes, local_ids = pending[camera_id].popleft()
+                credits[camera_id].release()
+
+                # ----------------------------------------
+                # Global ID assignment (appearance-only)
+                # ----------------------------------------
+                if embeddings:
+                    global_ids = global_tracker.assign_global_ids(
+                        embeddings, camera_id=camera_id, frame_idx=frame_idx, bboxes=bboxes, local_ids=local_ids
+                    )
+                else:
+                    global_ids = []
+
+                logs[camera_id].write_frame(
+                    build_output_frame(frame_idx, camera_pos[camera_id], global_ids, local_ids)
+                )
+                if not headless:
+                    # DEBUG: can comment these lines out for faster processing
+                    print("frame:", frame_idx, f"global_ids{camera_id}:", global_ids)
+
+    start_time = time.perf_counter()
+    next_liveness_check = start_time + WORKER_POLL_INTERVAL
+    try:
+        while active:
+            if time.perf_counter() >= next_liveness_check:
+                # A worker killed outright (OOM, segfault) never sends "done"
+                for worker, camera_id in zip(workers, camera_ids):
+                    if camera_id in active and not worker.is_alive():
+                        active.discard(camera_id)
+                        print(f"ERROR: camera_{camera_id} worker exited with code {worker.exitcode}")
+                next_liveness_check = time.perf_counter() + WORKER_POLL_INTERVAL
+                assign_ready_frames()
+            try:
+                message = results_queue.get(timeout=WORKER_POLL_INTERVAL)
+            except queue.Empty:
+                continue
+            kind, camera_id = message[0], message[1]
+            if kind == "frame":
+                pending[camera_id].append(message[2:])
+            elif kind == "done":
+                active.discard(camera_id)
+                num_frames, seconds = message[2], message[3]
+                print(f"camera_{camera_id}: finished after {num_frames} frames "
+                      f"({num_frames / max(seconds, 1e-9):.1f} fps)")
+            else:
+                active.discard(camera_id)
+                print(f"ERROR in camera_{camera_id} worker:\n{message[2]}")
+            assign_ready_frames()
+    finally:
+        for worker in workers:
+            if worker.is_alive():
+                worker.terminate()
+            worker.join()
+        # ----------------------------------------
+        # Cleanup operations, logs are already on disk
+        # ----------------------------------------
+        for log in logs.values():
+            log.close()
+            print(f"Saved {log.num_frames} frames to {log.path}")
+        # Write the last partial history chunk, it is otherwise lost at exit
+        global_tracker.history.spill()
+        print(f"Saved {len(global_tracker.history)} history rows in "
+              f"{len(global_tracker.history.spilled_chunks)} chunks to {history_dir}")
+    elapsed = time.perf_counter() - start_time
+
+    total_frames = sum(log.num_frames for log in logs.values())
+    print(f"Processed {total_frames} camera frames in {elapsed:.1f}s ({total_frames / max(elapsed, 1e-9):.1f} fps overall)")
+    print(f"Global IDs assigned: {global_tracker.next_global_id - 1}, evicted: {global_tracker.evicted_count}")
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Assign global vehicle IDs across edge cameras (one worker process per camera)."
+    )
+    parser.add_argument(
+        "--cameras",
+        type=int,
+        nargs="+",
+        default=DEFAULT_CAMERA_IDS,
+        help=f"Camera IDs from util.CAMERA_CONFIGS to process (default: {DEFAULT_CAMERA_IDS})",
+    )
+    parser.add_argument(
+        "--video-dir",
+        default=VIDEO_DIR,
+        help=f"Directory containing camera_<id>.mp4 (default: {VIDEO_DIR})",
+    )
+    parser.add_argument(
+        "--output-dir",
+        default=None,
+        help=f"Directory for camera_<id>_input{LOG_SUFFIX} detection logs (default: the video directory)",
+    )
+    parser.add_argument(
+        "--headless",
+        action="store_true",
+        help="No preview windows, box drawing, per-frame prints or waitKey; run as fast as possible",
+    )
+    parser.add_argument(
+        "--annotated-dir",
+        default=None,
+        help="Write camera_<id>_annotated.mp4 with detection boxes here (on a background thread)",
+    )
+    parser.add_argument(
+        "--history-dir",
+        default=None,
+        help=f"Directory for the global ID detection history chunks (default: <output-dir>/{HISTORY_DIR_NAME})",
+    )
+    return parser.parse_args()
 
-    with open(OUTPUT_5_PATH, "w") as f:
-        json.dump(camera_5_output, f, indent=2)
 
-    # DEBUG: can comment these lines out for faster processing
-    cap4.release()
-    cap5.release()
-    cv2.destroyAllWindows()
+def main() -> None:
+    args = parse_args()
+    run_pipeline(
+        args.cameras,
+        args.video_dir,
+        args.output_dir or args.video_dir,
+        headless=args.headless,
+        annotated_dir=args.annotated_dir,
+        history_dir=args.history_dir,
+    )
 
 if __name__ == "__main__":
     main()
-